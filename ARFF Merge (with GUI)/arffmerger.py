@@ -1,166 +1,265 @@
 import os
-import glob
+import sys
+import argparse
 import datetime
-from tkinter import *
-from tkinter import messagebox
-from tkinter import filedialog
-
-#Functionality for the first "Browse" button. Grabs the path of the folder chosen by the user and saves it in the input_dir variable
-def browse_input():
-    input_dir_disp.config(state="normal")
-    input_dir_disp.delete(0, "end")
-    input_dir = filedialog.askdirectory()
-    input_dir_disp.insert(0, input_dir)
-    input_dir_disp.config(state='readonly')
-
-#Functionality for the second "Browse" button. Grabs the path of the folder chosen by the user and saves it in the output_dir variable
-def browse_output():
-    output_dir_disp.config(state="normal")
-    output_dir_disp.delete(0, "end")
-    output_dir = filedialog.askdirectory()
-    output_dir_disp.insert(0, output_dir)
-    output_dir_disp.config(state="readonly")
-
-#Functionality for "Start Merging" button. Gets the user inputs and performs error handling
-def get_data():
-    global final_in_dir
-    global final_out_dir
-    global file_name
-    special_chars = "!@#$%^&*()-+?_=,<>/ "
-    final_in_dir = input_dir_disp.get()
-    final_out_dir = output_dir_disp.get()
-    file_name = filename_disp.get()
-    if final_in_dir == ""  or final_out_dir == "" or file_name == "": #Checks if any of the input fields are empty, if empty, show this message below
-        messagebox.showinfo("ARFFMerger.exe", "At least one of the input fields are empty.")
-    elif any(char in special_chars for char in file_name): #Checks if special characters are present in the file name. Done to prevent problems in filename saving
-        messagebox.showinfo("ARFFMerger.exe", "No special characters or white spaces allowed in filename.")
-    else: #If no errors in the input fields, close the gui and start the merging
-        file_name = file_name.rstrip('arff')
-        opening_window.destroy()
-
-
-def mergeArff(file_list):
-
-    #Initialization of dictionaries and lists for error handling
-    class_dict = {}
-    attributes_dict = {}
-    file_class_lst = []
-    attribute_count_lst = []
-    now = datetime.datetime.now()
-    #Main merging algorithm
-    for name in files_list: 
-        with open(name) as out: 
-            currentString = ''
-            attribute_count = 0
-
-            while currentString != '@data': #Loop through the lines of the arff file until "@data" line
-                currentString = out.readline().strip()
-                if currentString == '@data':
-                    break
-                if currentString.startswith("@attribute"): #Counts the numbers of attributes in each file. Done for error handling
-                    attribute_count +=1
-                if currentString.startswith("@attribute class"):
-                    file_class = currentString.split(',')[-1].lstrip("'").rstrip("'}") #Grabs the amount of classes per file
-            if file_class not in file_class_lst: #Put the obtained file class in the file_class_lst if not yet in that list.
-                file_class_lst.append(file_class)
-                class_dict[file_class] = []
-
-            if str(attribute_count) not in attribute_count_lst: #Put the obrained number of attributes in the attribute_count_lst if not yet in that list.
-                attribute_count_lst.append(str(attribute_count))
-                attributes_dict[str(attribute_count)] = []
-
-            attributes_dict[str(attribute_count)].append(name.split("\\")[-1]) #Grabs the current filename and puts it in the attributes_dict dictionary
-            class_dict[file_class].append(name.split("\\")[-1]) ##Grabs the current filename and puts it in the class_dict dictionary
-            
-    if len(file_class_lst) > 1: # If we have more than one element in the file_class_lst, output error message below
-        error_message = ''
-        for key in class_dict.keys():
-            error_message = error_message + key[-1] + '-class files:' + '\n' + str(class_dict[key])[1:-1] + '\n\n' #Print out the filenames corresponding to their class number
-        error_filename = f"ARFFMERGER_ERROR_{now.strftime('%Y-%m-%d_%H-%M-%S')}.txt"
-        error_filepath = final_out_dir + '/' + error_filename
-        with open(error_filepath, 'w') as err:
-            err.writelines("Merging procedure cannot continue while input folder contains files with different number of classes. \n\n" + error_message)
-        messagebox.showinfo("ARFFMerger.exe", "Merging procedure cannot continue while input folder contains files with different number of classes. \n\n" + error_message)
-        os._exit(0)
-    
-    if len(attribute_count_lst) > 1: # If we have more than one element in the attribute_count_lst, output error message below
-        error_message = ''
-        
-        for key in attributes_dict.keys():
-            error_message = error_message + key + '-attribute files:' + '\n' + str(attributes_dict[key])[1:-1] + '\n\n' # Print out the filenames corresponding to their attribute number
-        error_filename = f"ARFFMERGER_ERROR_{now.strftime('%Y-%m-%d_%H-%M-%S')}.txt"
-        error_filepath = final_out_dir + '/' + error_filename
-        with open(error_filepath, 'w') as err:
-            err.writelines("Merging procedure cannot continue while input folder contains files with different number of attributes. \n\n" + error_message)
-        messagebox.showinfo('ARFFMerger.exe', "Merging procedure cannot continue while input folder contains files with different number of attributes. \n\n" + error_message)
-        os._exit(0)
-
-    #Once the code gets to this point, all arff files have the same number of classes and attributes. Merging starts here
-    first_file = 0
-    datastart = 1
-    merged_arff = []
-    for name in files_list:
-        with open(name) as out:
-            if first_file == 0: #Checks if this is this the first file that has been opened, if yes read all the lines in that file
-                merged_arff = out.readlines()
-                datastart = merged_arff.index("@data\n") #Get the index where the "@data" is located
-                first_file = 1 # Update first_file variable to indicate that the first file has been opened
-
-            if first_file == 1: #Combine the previous data with new data
-                merged_arff = merged_arff + out.readlines()[datastart + 1:]
-    
-    output_path = final_out_dir + '/' + file_name + '.arff' #Setting the output path for the merged file
-
-    with open(output_path, 'w') as output_file:
-        output_file.writelines(merged_arff) #Writes the lines for the merged file
-    mergedfiles = str(class_dict[file_class_lst[0]])[1:-1]
-    result_filename = f"ARFFMERGER_RESULT_{now.strftime('%Y-%m-%d_%H-%M-%S')}.txt"
-    result_filepath = final_out_dir + '/' + result_filename
-    with open(result_filepath, 'w') as err:
-        err.writelines(f"Merging succesful.\nFiles merged:\n\n{mergedfiles}\n\nFile saved with name: {file_name}.arff")
-
-    messagebox.showinfo("ARFFMerger.exe", f"Merging succesful.\nFiles merged:\n\n{mergedfiles}") #Message box pops out that shows the file names involved in the merge
-  
-
-#Initialize GUI window
-opening_window = Tk()
-opening_window.title("ARFFMerger.exe")
-opening_window.geometry("750x100")
-
-#Make GUI elements
-input_dir_disp = Entry(opening_window, width = 80, state = "readonly")
-output_dir_disp = Entry(opening_window, width = 80, state = "readonly")
-filename_disp = Entry(opening_window, width = 60, text = "Insert filename here")
-files_dir_btn = Button(opening_window, text="Browse", command=browse_input, bd = 3)
-output_dir_btn = Button(opening_window, text="Browse", command=browse_output, bd = 3)
-merge_btn = Button(opening_window, text = "Start Merging", command=get_data, bd = 3)
-files_label = Label(opening_window,text = "Folder containing arff files:")
-filedest_label = Label(opening_window, text = "Output file destination:")
-filename_label = Label(opening_window, text = "Merged output filename:")
-
-#Layout GUI elements in a grid
-input_dir_disp.grid(row = 0, column = 1)
-output_dir_disp.grid(row = 1, column = 1)
-filename_disp.grid(row = 2, column = 1, sticky = 'W')
-files_dir_btn.grid(row = 0,column = 2, padx = 2)
-output_dir_btn.grid(row = 1, column = 2, pady = 2)
-merge_btn.grid(row = 2, column = 2, sticky = 'N')
-files_label.grid(row = 0,column = 0, sticky = 'W')
-filedest_label.grid(row = 1, column = 0, sticky = 'W')
-filename_label.grid(row=2, column = 0, sticky = 'W')
-
-
-opening_window.mainloop()
-
-#Check for user input
-special_chars = "!@#$%^&*()-+?_=,<>/ "
-if final_in_dir == "" or final_out_dir == "" or file_name == "" or any(char in special_chars for char in file_name): #If any of the user inputs are empty or if special characters are present in the filename, exit the .exe file
-    os._exit(0)
-
-#Grab the filenames of files in the input directory(chosen by user) which have the file extension .arff
-files_list = glob.glob(os.path.join(final_in_dir,'*.arff'))
-filenames = os.listdir(final_in_dir)
-
-#Run the merging script
-mergeArff(files_list)
+import multiprocessing
 
+#The streaming merge engine lives in the sibling "ARFF Merge Engine" folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "ARFF Merge Engine"))
+from arffbatch import BATCH_FILES, BATCH_WAIT, POLL_INTERVAL, merge_folder, watch_folder
+from arffdedup import RowDeduplicator, duplicate_summary
+from arffengine import group_summary
+from arffio import ARFF_SUFFIX, CODECS, find_arff
+from arfflog import MergeLog, format_file, format_run
+from arffscan import CACHE_NAME, load_cache
+
+SCAN_WORKERS = os.cpu_count() or 1 #Number of processes used to check the input headers
+OUTPUT_LEVEL = None #Compression level of .arff.gz/.bz2/.xz outputs (None uses the defaults in arffio.DEFAULT_LEVELS)
+DEDUP_MEMORY = 512 * 1024 * 1024 #Memory for the exact duplicate row check, beyond it the check continues in a temporary on-disk set
+DEDUP_SPILL = "disk" #"disk" (exact) or "bloom" (smaller and faster, may drop a unique row with probability 0.001)
+SPARSE_THRESHOLD = 0.5 #With the sparse option, rows with at least this fraction of zero values are written as sparse {index value} rows
+SELECT_THRESHOLD = 0.5 #With the select option, only attributes with an information gain above this are merged (as in AttributeSelection/Main.java)
+SPECIAL_CHARS = "!@#$%^&*()-+?_=,<>/ " #Not allowed in the merged filename, to prevent problems in filename saving
+LOG_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S-%f" #Time in the log and report names, to the microsecond so that runs started in the same second do not overwrite each other
+OUTPUT_FORMATS = [ARFF_SUFFIX[1:]] + [ARFF_SUFFIX[1:] + suffix for suffix in CODECS] #arff, arff.gz, arff.bz2, arff.xz
+
+#Runs one merge with its log. ARFFMERGER_LOG_<time>.jsonl gets one JSON record per merged file (bytes, rows, header scan and copy time, MB/s) and the run totals,
+#and the ARFFMERGER_RESULT_<time>.txt or ARFFMERGER_ERROR_<time>.txt file is generated from those records. Returns whether the merge succeeded and the message to show
+def logged_merge(file_list, output_dir, file_name, **options):
+    now = datetime.datetime.now().strftime(LOG_TIME_FORMAT)
+    log = MergeLog(os.path.join(output_dir, f"ARFFMERGER_LOG_{now}.jsonl"), output=os.path.join(output_dir, file_name), options=options)
+    message = None
+    try:
+        message = mergeArff(file_list, output_dir, file_name, log=log, **options)
+    except ValueError as error: #Files with different number of classes or conflicting attributes
+        log.error(str(error))
+    except OSError as error: #Unreadable input or full disk: recorded in the log and report, then raised
+        log.error(str(error))
+        raise
+    finally:
+        log.finish()
+        if log.run["status"] == "error":
+            kind, message = "ERROR", "".join(record["message"] for record in log.records_of("error"))
+            text = message
+        else:
+            kind = "RESULT"
+            text = message + "\n\n" + "".join(format_file(record) for record in log.records_of("file")) + "".join(record["text"] + "\n" for record in log.records_of("note")) + "\n" + format_run(log.run)
+        with open(os.path.join(output_dir, f"ARFFMERGER_{kind}_{now}.txt"), 'w') as report:
+            report.writelines(text)
+    return kind == "RESULT", message
+
+#Merges file_list into output_dir/file_name + suffix. Returns the result text, or raises ValueError with the error text when the files cannot be merged
+def mergeArff(file_list, output_dir, file_name, incremental=False, group=False, columnar=False, sparse_threshold=None, suffix=ARFF_SUFFIX,
+              index=False, remove_duplicates=False, workers=SCAN_WORKERS, cache=None, log=None, select_threshold=None):
+    dedup = None
+    if remove_duplicates: #Row hashes are kept in memory up to DEDUP_MEMORY, then in DEDUP_SPILL
+        dedup = RowDeduplicator(DEDUP_MEMORY, DEDUP_SPILL, work_dir=output_dir, expected_bytes=sum(os.path.getsize(name) for name in file_list))
+    try:
+        #Reads each header once (up to and including the "@data" line) across workers processes, checks the classes and attributes match, then streams each file's data section in chunks
+        result = merge_folder(None, output_dir, file_name, incremental=incremental, group=group, columnar=columnar, sparse_threshold=sparse_threshold,
+                              suffix=suffix, level=OUTPUT_LEVEL, index=index, dedup=dedup, workers=workers, file_list=file_list, cache=cache,
+                              progress=log.file if log else None, #Every merged file is recorded in the log with its metrics
+                              threshold=select_threshold) #Rank the attributes over all files first, then merge only the selected columns
+    finally:
+        if dedup:
+            dedup.close()
+
+    if log and result["groups"] and result["columnar_rows"] is not None: #One columnar copy next to every group output
+        for group_output in result["groups"].values():
+            log.note(f"Columnar copy with {group_output['columnar_rows']} rows saved in {os.path.basename(group_output['columnar'])}")
+    elif log and result["columnar_rows"] is not None:
+        log.note(f"Columnar copy with {result['columnar_rows']} rows saved in {file_name}.columns")
+    sections = [] #Duplicate counts and the selected attributes, each after one blank line
+    if dedup:
+        sections.append(duplicate_summary(result["entries"]))
+    if result["ranking"] is not None: #Which attributes were kept, best first
+        selection = f"Attributes with information gain above {select_threshold}: {len(result['ranking'])}\n" + "".join(f"{gain:.4f} {name}\n" for name, gain in result["ranking"])
+        sections.append(selection)
+        if log:
+            log.note(selection.strip(), ranking=result["ranking"])
+    extra = "".join("\n\n" + section.rstrip("\n") for section in sections)
+    if result["groups"]: #Mixed folder: every group of matching files went into its own output
+        return ("Merging succesful.\nFiles merged by number of attributes and classes:\n\n" + group_summary(result["groups"])).rstrip("\n") + extra
+    if result["rebuilt"]:
+        outputs = [os.path.abspath(path) for path in result["outputs"]]
+        mergedfiles = str([os.path.basename(name) for name in file_list if os.path.abspath(name) not in outputs])[1:-1]
+    else: #Only the new files were appended to the existing output
+        mergedfiles = str([os.path.basename(entry["path"]) for entry in result["entries"]])[1:-1]
+    return f"Merging succesful.\nFiles merged:\n\n{mergedfiles}\n\nFile saved with name: {file_name}{suffix}{extra}"
+
+#Keeps merging the files dropped into input_dir, in batches, until stopped with Ctrl+C
+def watchArff(input_dir, output_dir, file_name, interval=POLL_INTERVAL, batch_files=BATCH_FILES, batch_wait=BATCH_WAIT, **options):
+    cache = load_cache(os.path.join(output_dir, CACHE_NAME)) #Kept in memory between batches
+    log_path = os.path.join(output_dir, f"ARFFMERGER_LOG_{datetime.datetime.now().strftime(LOG_TIME_FORMAT)}.jsonl") #Every batch appends its records
+    suffix = options.get("suffix", ARFF_SUFFIX)
+    def is_output(path): #The merged outputs are never inputs, when they are written into the watched folder
+        name = os.path.basename(path)
+        return os.path.dirname(path) == os.path.abspath(output_dir) and (name == file_name + suffix or name.startswith(file_name + "_"))
+    def merge(file_list):
+        log = MergeLog(log_path, output=os.path.join(output_dir, file_name), options=options)
+        try:
+            return mergeArff(file_list, output_dir, file_name, incremental=True, cache=cache, log=log, **options)
+        except ValueError as error:
+            log.error(str(error))
+            raise
+        finally:
+            print(format_run(log.finish()), end="", flush=True)
+    def report(new_files, result):
+        now = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        if isinstance(result, ValueError): #The new files are left out until they change
+            print(f"{now} Merging of {len(new_files)} new files failed:\n{result}", flush=True)
+        elif result is not None:
+            print(f"{now} {len(new_files)} new files\n{result}\n", flush=True)
+    watch_folder(input_dir, merge, interval, batch_files, batch_wait, ignore=is_output, report=report)
+
+#Shows the window and returns the user inputs, or None if it was closed without a valid input
+def run_gui():
+    from tkinter import Tk, Entry, Button, Label, Checkbutton, OptionMenu, IntVar, StringVar
+    from tkinter import messagebox
+    from tkinter import filedialog
+    settings = {}
+
+    #Functionality for the "Browse" buttons. Grabs the path of the folder chosen by the user and shows it in the entry
+    def browse(entry):
+        entry.config(state="normal")
+        entry.delete(0, "end")
+        entry.insert(0, filedialog.askdirectory())
+        entry.config(state="readonly")
+
+    #Functionality for "Start Merging" button. Gets the user inputs and performs error handling
+    def get_data():
+        input_dir = input_dir_disp.get()
+        output_dir = output_dir_disp.get()
+        file_name = filename_disp.get()
+        if input_dir == ""  or output_dir == "" or file_name == "": #Checks if any of the input fields are empty, if empty, show this message below
+            messagebox.showinfo("ARFFMerger.exe", "At least one of the input fields are empty.")
+        elif any(char in SPECIAL_CHARS for char in file_name): #Checks if special characters are present in the file name
+            messagebox.showinfo("ARFFMerger.exe", "No special characters or white spaces allowed in filename.")
+        elif incremental_var.get() == 1 and group_var.get() == 1: #Group outputs are always rewritten from scratch
+            messagebox.showinfo("ARFFMerger.exe", "Appending new files cannot be combined with one output per group.")
+        else: #If no errors in the input fields, close the gui and start the merging
+            settings.update(input_dir=input_dir, output_dir=output_dir, file_name=file_name.rstrip('arff'),
+                            incremental=incremental_var.get() == 1, #Append only the files added since the last merge into this output
+                            group=group_var.get() == 1, #Merge mismatched files into one output per number of attributes and classes
+                            columnar=columnar_var.get() == 1, #Also save the merged data as one NumPy array per attribute
+                            sparse_threshold=SPARSE_THRESHOLD if sparse_var.get() == 1 else None, #Write mostly-zero rows in sparse form
+                            remove_duplicates=dedup_var.get() == 1, #Drop rows identical to a row merged before
+                            index=index_var.get() == 1, #Also save each data row's position and class next to the merged file
+                            suffix="." + format_var.get()) #.arff, or .arff.gz/.arff.bz2/.arff.xz for a compressed output
+            opening_window.destroy()
+
+    #Initialize GUI window
+    opening_window = Tk()
+    opening_window.title("ARFFMerger.exe")
+    opening_window.geometry("750x280")
+
+    #Make GUI elements
+    input_dir_disp = Entry(opening_window, width = 80, state = "readonly")
+    output_dir_disp = Entry(opening_window, width = 80, state = "readonly")
+    filename_disp = Entry(opening_window, width = 60, text = "Insert filename here")
+    files_dir_btn = Button(opening_window, text="Browse", command=lambda: browse(input_dir_disp), bd = 3)
+    output_dir_btn = Button(opening_window, text="Browse", command=lambda: browse(output_dir_disp), bd = 3)
+    merge_btn = Button(opening_window, text = "Start Merging", command=get_data, bd = 3)
+    files_label = Label(opening_window,text = "Folder containing arff files:")
+    filedest_label = Label(opening_window, text = "Output file destination:")
+    filename_label = Label(opening_window, text = "Merged output filename:")
+    incremental_var = IntVar()
+    incremental_chk = Checkbutton(opening_window, text = "Only append new files to an existing merged output", variable = incremental_var)
+    group_var = IntVar()
+    group_chk = Checkbutton(opening_window, text = "Merge files with different attributes/classes into one output per group", variable = group_var)
+    columnar_var = IntVar()
+    columnar_chk = Checkbutton(opening_window, text = "Also save a columnar copy for fast loading in Python (needs numpy)", variable = columnar_var)
+    sparse_var = IntVar()
+    sparse_chk = Checkbutton(opening_window, text = "Write mostly-zero rows as sparse rows (smaller output)", variable = sparse_var)
+    dedup_var = IntVar()
+    dedup_chk = Checkbutton(opening_window, text = "Remove duplicate rows (rows identical to a row merged before)", variable = dedup_var)
+    index_var = IntVar()
+    index_chk = Checkbutton(opening_window, text = "Also save a row index for fast random/class-balanced subsets (SubsetArff.py)", variable = index_var)
+    format_label = Label(opening_window, text = "Output file format:")
+    format_var = StringVar(opening_window, OUTPUT_FORMATS[0])
+    format_menu = OptionMenu(opening_window, format_var, *OUTPUT_FORMATS) #Compressed outputs are smaller to store and copy over the network
+
+    #Layout GUI elements in a grid
+    input_dir_disp.grid(row = 0, column = 1)
+    output_dir_disp.grid(row = 1, column = 1)
+    filename_disp.grid(row = 2, column = 1, sticky = 'W')
+    files_dir_btn.grid(row = 0,column = 2, padx = 2)
+    output_dir_btn.grid(row = 1, column = 2, pady = 2)
+    merge_btn.grid(row = 2, column = 2, sticky = 'N')
+    files_label.grid(row = 0,column = 0, sticky = 'W')
+    filedest_label.grid(row = 1, column = 0, sticky = 'W')
+    filename_label.grid(row=2, column = 0, sticky = 'W')
+    incremental_chk.grid(row = 3, column = 1, sticky = 'W')
+    group_chk.grid(row = 4, column = 1, sticky = 'W')
+    columnar_chk.grid(row = 5, column = 1, sticky = 'W')
+    sparse_chk.grid(row = 6, column = 1, sticky = 'W')
+    dedup_chk.grid(row = 7, column = 1, sticky = 'W')
+    index_chk.grid(row = 8, column = 1, sticky = 'W')
+    format_label.grid(row = 9, column = 0, sticky = 'W')
+    format_menu.grid(row = 9, column = 1, sticky = 'W')
+
+
+    opening_window.mainloop()
+    return settings or None #Empty if the window was closed without starting the merge
+
+
+if __name__ == "__main__": #Worker processes re-import this file, so the GUI only starts in the main process
+    multiprocessing.freeze_support() #Needed for the worker processes of a pyinstaller .exe
+
+    if len(sys.argv) == 1: #No arguments: ask for the inputs in the window, as before
+        settings = run_gui()
+        if settings is None: #If the window was closed without valid inputs, exit the .exe file
+            os._exit(0)
+        from tkinter import messagebox
+        input_dir = settings.pop("input_dir")
+        output_dir = settings.pop("output_dir")
+        file_name = settings.pop("file_name")
+        #Grab the filenames of files in the input directory(chosen by user) which have the file extension .arff, .arff.gz, .arff.bz2 or .arff.xz
+        merged, message = logged_merge(find_arff(input_dir), output_dir, file_name, **settings)
+        if not merged: #Files with different number of classes or conflicting attributes: show which files belong to which group
+            messagebox.showinfo("ARFFMerger.exe", message)
+            os._exit(0)
+        messagebox.showinfo("ARFFMerger.exe", message.split("\n\nFile saved with name")[0]) #Message box pops out that shows the file names involved in the merge
+        sys.exit(0)
+
+    #Command line: the same merge without a window, e.g. on machines without a display
+    parser = argparse.ArgumentParser(description="Merge the .arff files of a folder (run without arguments for the window)")
+    parser.add_argument("input_dir", help="folder containing the .arff, .arff.gz, .arff.bz2 and .arff.xz files")
+    parser.add_argument("output_dir", nargs="?", help="folder of the merged file (default: the input folder)")
+    parser.add_argument("-n", "--name", default="MergedArff", help="merged output filename, without extension (default MergedArff)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default=OUTPUT_FORMATS[0], help="output file format; compressed outputs are smaller to store and copy")
+    parser.add_argument("--incremental", action="store_true", help="only append new files to an existing merged output")
+    parser.add_argument("--group", action="store_true", help="merge files with different attributes/classes into one output per group")
+    parser.add_argument("--columnar", action="store_true", help="also save a columnar copy for fast loading in Python (needs numpy)")
+    parser.add_argument("--sparse", type=float, nargs="?", const=SPARSE_THRESHOLD, metavar="FRACTION", help=f"write rows with at least this fraction of zero values as sparse rows (default {SPARSE_THRESHOLD})")
+    parser.add_argument("--dedup", action="store_true", help="remove rows identical to a row merged before")
+    parser.add_argument("--select", type=float, nargs="?", const=SELECT_THRESHOLD, metavar="THRESHOLD",
+                        help=f"rank the attributes over all files first and merge only those with an information gain above this (default {SELECT_THRESHOLD}, needs numpy)")
+    parser.add_argument("--index", action="store_true", help="also save a row index for fast subsets (SubsetArff.py)")
+    parser.add_argument("--workers", type=int, default=SCAN_WORKERS, help="number of processes used to check the headers")
+    parser.add_argument("--watch", action="store_true", help="keep running and merge the files dropped into the input folder incrementally, in batches")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help=f"with --watch, seconds between two looks at the folder (default {POLL_INTERVAL:g})")
+    parser.add_argument("--batch-files", type=int, default=BATCH_FILES, help=f"with --watch, number of new files that starts a merge at once (default {BATCH_FILES})")
+    parser.add_argument("--batch-wait", type=float, default=BATCH_WAIT, help=f"with --watch, seconds a new file waits for more files before merging (default {BATCH_WAIT:g})")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or args.input_dir
+    file_name = args.name[:-len(ARFF_SUFFIX)] if args.name.endswith(ARFF_SUFFIX) else args.name
+    if any(char in SPECIAL_CHARS for char in file_name):
+        parser.error("no special characters or white spaces allowed in the output filename")
+    if args.group and (args.incremental or args.watch):
+        parser.error("--group rewrites every group output on each run, it cannot be combined with --incremental or --watch")
+    os.makedirs(output_dir, exist_ok=True) #The log and the merged file are written into it
+    options = dict(group=args.group, columnar=args.columnar, sparse_threshold=args.sparse, suffix="." + args.format,
+                   index=args.index, remove_duplicates=args.dedup, workers=args.workers, select_threshold=args.select)
+    if args.watch:
+        print(f"Watching {os.path.abspath(args.input_dir)}, press Ctrl+C to stop", flush=True)
+        try:
+            watchArff(args.input_dir, output_dir, file_name, args.interval, args.batch_files, args.batch_wait, **options)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    merged, message = logged_merge(find_arff(args.input_dir), output_dir, file_name, incremental=args.incremental, **options)
+    if not merged:
+        sys.exit(message)
+    print(message)
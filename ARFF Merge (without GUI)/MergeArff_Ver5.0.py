@@ -1,107 +1,215 @@
 import os
-import glob
+import sys
+import argparse
 import datetime
-def mergeArff(file_list):
+import multiprocessing
+
+# The streaming merge engine lives in the sibling "ARFF Merge Engine" folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "ARFF Merge Engine"))
+from arffbatch import BATCH_FILES, BATCH_WAIT, POLL_INTERVAL, watch_folder
+from arffdedup import DEFAULT_ERROR, SPILL_MODES, RowDeduplicator
+from arffengine import group_summary, merge_groups, merge_incremental
+from arffindex import build_index
+from arfflog import MergeLog, format_file, format_run
+from arffio import ARFF_SUFFIX, CODECS, find_arff
+from arffscan import CACHE_NAME, load_cache, save_cache, scan_files
+from arffschema import select_schema, union_schema
+
+OUTPUT_BASE = "MergedArff-V5" # Group outputs are named MergedArff-V5_<attributes>-attribute_<class>-class.arff
+COLUMNAR_SUFFIX = ".columns" # Replaces the .arff extension of an output in the name of its --columnar folder
+COLUMNAR_NAME = OUTPUT_BASE + COLUMNAR_SUFFIX # Folder of NumPy columns written by --columnar
+SELECT_THRESHOLD = 0.5 # Information gain threshold of --select, as in AttributeSelection/Main.java
+LOG_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S-%f" # Time in the log names, to the microsecond so that runs started in the same second do not overwrite each other
+
+def logError(log, message):
+    # Record why merging stopped (shown after the "ERROR:" line of the log), then stop merging (ValueError)
+    log.error(message)
+    raise ValueError(message)
+
+def writeLog(filename, log):
+    # The text log is generated from the JSON records: errors, every merged file with its metrics, then the run totals
+    with open(filename, 'w') as file:
+        file.write("ERROR:\n")
+        for record in log.records_of("error"):
+            file.write("\n" + record["message"] + "\n")
+        file.write("\nMerging Process:\n\n")
+        for record in log.records_of("file"):
+            file.write(format_file(record))
+        for record in log.records_of("note"):
+            file.write(record["text"])
+        file.write("\n" + format_run(log.run))
+
+def mergeArff(file_list, incremental=False, workers=1, group=False, columnar=None, sparse=None, compress=None, level=None, index=False, dedup=None, folder=None, select=None):
 
     
-    attributes_list = []
-    data_list = []
-    non_redundant_attributes = []
-    n=1
-    Datastart = 0
+    headers = []
+    entries = []
     currentStringLength = 0
     classLength = 0
-    attributeAmount = 0
-    tempattributeAmount = 0
     
+    folder = folder or os.getcwd() # The log, cache and outputs are written into the merged folder
     now = datetime.datetime.now()
-    filename = f"File_Merging_log_time_{now.strftime('%Y-%m-%d_%H-%M-%S')}.txt"
-    with open(filename, 'w') as file:
-        file.write("ERROR:\n\nMerging Process:\n\n")
-    # Extract attributes from .arff file
-    for name in file_list:
-        with open(name) as out:
-            
-            currentString = out.readline()
-            while currentString.strip()!="@data":      
+    filename = os.path.join(folder, f"File_Merging_log_time_{now.strftime(LOG_TIME_FORMAT)}.txt")
+    # Buffered structured log: one JSON record per merged file (bytes, rows, header scan and copy time, MB/s) and the run totals with peak memory
+    log = MergeLog(filename[:-len(".txt")] + ".jsonl", folder=folder, options={"incremental": incremental, "group": group, "columnar": columnar,
+                   "sparse": sparse, "compress": compress, "level": level, "index": index, "dedup": dedup is not None, "workers": workers,
+                   "select": select})
+    try:
+        suffix = ARFF_SUFFIX + ("." + compress if compress else "") # Compressed outputs end in .arff.gz, .arff.bz2 or .arff.xz
+        # Extract attributes from .arff file (headers of unchanged files come from the cache)
+        cache_path = os.path.join(folder, CACHE_NAME)
+        cache = load_cache(cache_path)
+        if group:
+            # Sort the files by number of attributes and classes, and merge every group into its own output in one pass
+            try:
+                groups = merge_groups(file_list, folder, OUTPUT_BASE, cache, workers, progress=log.file, sparse_threshold=sparse, suffix=suffix, level=level, dedup=dedup)
+            except ValueError as error:
+                logError(log, str(error) + ", merging terminated.")
+            save_cache(cache, cache_path)
+            if index:
+                for group_output in groups.values():
+                    build_index(group_output["output"])
+            if columnar:
+                # One folder of NumPy columns next to every group output, read back from it (needs numpy)
+                from arffcolumnar import export_arff
+                for group_output in groups.values():
+                    columns_path = group_output["output"][:-len(suffix)] + COLUMNAR_SUFFIX
+                    rows = export_arff(group_output["output"], columns_path, relation="segment")
+                    log.note(f"Columnar copy with {rows} rows saved in {os.path.basename(columns_path)}\n")
+            log.note("\nFiles merged by schema:\n\n" + group_summary(groups))
+            return
+
+        try:
+            entries = list(scan_files(file_list, cache, workers=workers))
+        except ValueError as error:
+            logError(log, str(error) + ", merging terminated.")
+        for entry in entries:
+            name = entry["path"]
+            header_lines = entry["header_lines"]
+            for currentString in header_lines[:-1]:
                 if currentString.startswith("@attribute class"):
                     currentStringLength = len(currentString)
                     if(classLength == 0):
                         classLength = currentStringLength
                     if(classLength != 0 and classLength != currentStringLength):
-                        with open(filename, 'r') as file:
-                            lines = file.readlines()
-                        new_lines = []
-                        for line in lines:
-                            new_lines.append(line)
-                            if line.strip().startswith("ERROR:"):
-                                new_lines.append("\nCurrent file " + name +" has different amount of class, merging terminated.\n") 
-                        with open(filename, 'w') as file:
-                            file.writelines(new_lines)
-                        os._exit(0)
-                if currentString.startswith("@attribute"):
-                    tempattributeAmount+=1
-                attributes_list.append(currentString)
-                currentString = out.readline()
-                n+=1
-            attributes_list.append(currentString)
-            #print(tempattributeAmount)
-            if(attributeAmount == 0):
-                attributeAmount = tempattributeAmount
-            if(attributeAmount != tempattributeAmount):
-                with open(filename, 'r') as file:
-                    lines = file.readlines()
-                new_lines = []
-                for line in lines:
-                    new_lines.append(line)
-                    if line.strip().startswith("ERROR:"):
-                        new_lines.append("\nCurrent file " + name +" has different amount of attribute, merging terminated.\n") 
-                with open(filename, 'w') as file:
-                    file.writelines(new_lines)
-                os._exit(0)
-            Datastart = n
-        n=1
-        tempattributeAmount = 0
-        
-    
-    # Extract data from .arff file
-    for name in file_list:
-        with open(name) as out:
-            dataframe = out.readlines()[Datastart:]      
-            for single_data in dataframe:
-                data_list.append(single_data)
-            datanow = datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f')
-            with open(filename, 'a') as file:
-                    file.write("File "+ name + " has merged. Time: " + datanow + "\n")
-
-    # Remove duplicate attribute 
-    for single_attribute in attributes_list:
-        if single_attribute not in non_redundant_attributes:
-            non_redundant_attributes.append(single_attribute)    
-
-
-    # Remove @relation and insert customized relation
-    for single_attribute in non_redundant_attributes:
-        if "@relation" in single_attribute:
-            non_redundant_attributes.remove(single_attribute)
-    non_redundant_attributes.insert(0, "@relation segment")
-    non_redundant_attributes.insert(1, "\n")
-
-
-    # Write attributes & data into the final output
-    with open("MergedArff-V5.arff", "w") as out: 
-        for single_attribute in non_redundant_attributes:
-            out.write(single_attribute)
-        out.write('\n')
-        for single_data in data_list:
-            out.write(single_data)
-
-# Detect all .arff file in the folder
-filepath = os.getcwd()
-file_list = glob.glob(os.path.join(filepath,'*.arff'))
-
-print(file_list)
-
-mergeArff(file_list)
-
-print ("Merge Finished")
+                        logError(log, "Current file " + name +" has different amount of class, merging terminated.")
+            headers.append(header_lines)
+
+
+        # Merge the attributes by name: files with other or reordered attributes are aligned to the union, missing values become ?
+        try:
+            schema = union_schema(headers)
+        except ValueError as error:
+            logError(log, str(error) + ", merging terminated.")
+
+        if select is not None:
+            # Rank the attributes over the rows of every file in one streaming pass, then merge only the columns above the threshold (needs numpy).
+            # The statistics are saved next to the output, so the files merged before are not read again for an incremental or watch merge
+            from arffsketch import SKETCH_SUFFIX, update_sketch
+            try:
+                ranking = update_sketch(entries, os.path.join(folder, OUTPUT_BASE + suffix + SKETCH_SUFFIX), workers).ranking(select)
+            except ValueError as error:
+                logError(log, str(error) + ", merging terminated.")
+            schema = select_schema(schema, [name for name, _ in ranking])
+            log.note(f"\nAttributes with information gain above {select}: {len(ranking)}\n" + "".join(f"{gain:.4f} {name}\n" for name, gain in ranking),
+                     ranking=ranking)
+
+        # Insert customized relation
+        non_redundant_attributes = ["@relation segment\n", "\n"] + schema + ["@data\n"]
+
+
+        # Write attributes once, then stream each file's data into the final output
+        try:
+            output_path = os.path.join(folder, OUTPUT_BASE + suffix)
+            if columnar != "only":
+                _, rebuilt = merge_incremental(file_list, output_path, cache, non_redundant_attributes + ['\n'],
+                                  rebuild=not incremental, progress=log.file, schema=schema, sparse_threshold=sparse, level=level, dedup=dedup, entries=entries)
+                if index:
+                    # Row offsets and classes for SubsetArff.py; after an append only the new rows are indexed
+                    build_index(output_path, update=not rebuilt)
+            if columnar:
+                # One NumPy array per attribute, for loading without re-parsing the text (needs numpy); read back from the merged file
+                # when there is one, so deduplicated and appended rows match it, else straight from the input files
+                from arffcolumnar import export_arff, export_columnar
+                if columnar != "only":
+                    rows = export_arff(output_path, os.path.join(folder, COLUMNAR_NAME), relation="segment")
+                else:
+                    rows = export_columnar(entries, schema, os.path.join(folder, COLUMNAR_NAME), relation="segment")
+                log.note(f"Columnar copy with {rows} rows saved in {COLUMNAR_NAME}\n")
+        except ValueError as error:
+            logError(log, str(error) + ", merging terminated.")
+        save_cache(cache, cache_path)
+    finally:
+        log.finish()
+        writeLog(filename, log)
+
+if __name__ == "__main__": # Worker processes re-import this file, so only merge in the main process
+    multiprocessing.freeze_support() # Needed for the worker processes of a pyinstaller application
+
+    parser = argparse.ArgumentParser(description="Merge all .arff files in a folder (default: the current folder)")
+    parser.add_argument("folder", nargs="?", default=os.getcwd(), help="folder of the .arff files; the merged file and the log are written into it")
+    parser.add_argument("--incremental", action="store_true", help="only append rows of files added since the last merge")
+    parser.add_argument("--group", action="store_true", help="merge files with different numbers of attributes or classes into one output per group instead of stopping")
+    parser.add_argument("--columnar", choices=["also", "only"], help="also (or only) write the merged data as one NumPy array per attribute")
+    parser.add_argument("--sparse", type=float, metavar="FRACTION", help="write rows with at least this fraction of zero values (e.g. 0.5) as sparse {index value} rows")
+    parser.add_argument("--compress", choices=[suffix[1:] for suffix in CODECS], help="write a compressed MergedArff-V5.arff.gz/.bz2/.xz (compressed inputs are always read)")
+    parser.add_argument("--level", type=int, help="compression level of the output (gz/bz2 1-9, xz 0-9)")
+    parser.add_argument("--index", action="store_true", help="also write a row index (MergedArff-V5.arff.index) for fast subsets with SubsetArff.py")
+    parser.add_argument("--dedup", action="store_true", help="drop data rows that are identical to a row merged before")
+    parser.add_argument("--dedup-memory", type=int, default=512, metavar="MB", help="memory for the exact duplicate check before it moves to --dedup-spill (default 512)")
+    parser.add_argument("--dedup-spill", choices=SPILL_MODES, default="disk", help="disk: exact check in a temporary on-disk set; bloom: in-memory Bloom filter that may drop a unique row with probability --dedup-error")
+    parser.add_argument("--dedup-error", type=float, default=DEFAULT_ERROR, help="false-positive rate of the Bloom filter (default 0.001)")
+    parser.add_argument("--watch", action="store_true", help="keep running and merge the files dropped into the folder incrementally, in batches (stop with Ctrl+C)")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="with --watch, seconds between two looks at the folder")
+    parser.add_argument("--batch-files", type=int, default=BATCH_FILES, help="with --watch, number of new files that starts a merge at once")
+    parser.add_argument("--batch-wait", type=float, default=BATCH_WAIT, help="with --watch, seconds a new file waits for more files before merging")
+    parser.add_argument("--select", type=float, nargs="?", const=SELECT_THRESHOLD, metavar="THRESHOLD",
+                        help="rank the attributes over all files first and merge only those with an information gain above this (default 0.5, needs numpy)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of processes used to scan the headers")
+    args = parser.parse_args()
+    if args.select is not None and args.group:
+        parser.error("--select needs one class set, it cannot be combined with --group")
+    if args.group and (args.incremental or args.watch):
+        parser.error("--group rewrites every group output on each run, it cannot be combined with --incremental or --watch")
+    if args.columnar == "only" and args.dedup:
+        parser.error("--dedup drops rows while writing the merged file, which --columnar only does not write; use --columnar also")
+    if args.columnar == "only" and args.group:
+        parser.error("--group writes the merged files its columnar folders are read from, use --columnar also")
+
+    def merge(file_list, incremental):
+        # A fresh duplicate check per merge; an incremental merge primes it with the rows already merged
+        dedup = None
+        if args.dedup:
+            dedup = RowDeduplicator(args.dedup_memory * 1024 * 1024, args.dedup_spill, args.dedup_error, work_dir=filepath,
+                                    expected_bytes=sum(os.path.getsize(name) for name in file_list))
+        try:
+            mergeArff(file_list, incremental, args.workers, args.group, args.columnar, args.sparse, args.compress, args.level, args.index, dedup, filepath, args.select)
+        finally:
+            if dedup:
+                dedup.close()
+
+    filepath = os.path.abspath(args.folder)
+    if args.watch:
+        # Merge the files dropped into the folder in batches; files that cannot be merged are logged and left out until they change
+        def report(new_files, error):
+            print(f"{len(new_files)} new files: " + ("merging terminated, see the log" if isinstance(error, ValueError) else "Merge Finished"), flush=True)
+        print("Watching " + filepath + ", press Ctrl+C to stop", flush=True)
+        try:
+            watch_folder(filepath, lambda file_list: merge(file_list, True), args.interval, args.batch_files, args.batch_wait,
+                         ignore=lambda name: os.path.basename(name).startswith(OUTPUT_BASE), report=report)
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    # Detect all .arff file in the folder
+    file_list = find_arff(filepath) # .arff, .arff.gz, .arff.bz2 and .arff.xz files
+    file_list = [name for name in file_list if not os.path.basename(name).startswith(OUTPUT_BASE)] # Never merge a previous output into itself
+
+    print(file_list)
+
+    try:
+        merge(file_list, args.incremental)
+    except ValueError:
+        sys.exit(1) # The reason is in the log; a non-zero exit status tells scripts and cluster jobs the merge failed
+
+    print ("Merge Finished")
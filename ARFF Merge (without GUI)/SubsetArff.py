@@ -0,0 +1,49 @@
+import os
+import sys
+import argparse
+
+# The row index lives in the sibling "ARFF Merge Engine" folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "ARFF Merge Engine"))
+from arffindex import build_index, load_index, random_rows, range_rows, stratified_rows, write_subset
+
+def amount(text):
+    # "0.01" is a fraction of the rows, "5000" a number of rows
+    value = float(text)
+    return (None, value) if value < 1 else (int(value), None)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a random, class-balanced or range subset of a merged ARFF file, using its row index")
+    parser.add_argument("data", help="merged ARFF file, e.g. MergedArff-V5.arff")
+    parser.add_argument("-o", "--output", help="subset ARFF file to write (.arff.gz/.bz2/.xz to compress)")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--random", type=amount, metavar="AMOUNT", help="rows picked at random: a fraction (0.01) or a number of rows")
+    mode.add_argument("--stratified", type=amount, metavar="AMOUNT", help="rows picked at random, the same number from every class")
+    mode.add_argument("--range", type=int, nargs=2, metavar=("START", "STOP"), help="rows START to STOP-1")
+    parser.add_argument("--proportional", action="store_true", help="with --stratified, keep the class proportions instead of balancing them")
+    parser.add_argument("--seed", type=int, help="random seed, to get the same subset again")
+    parser.add_argument("--rebuild-index", action="store_true", help="index the file again even if its index is up to date")
+    args = parser.parse_args()
+
+    # Reuse the index written by the merger (--index), or build it once
+    try:
+        if args.rebuild_index:
+            raise ValueError("index rebuild requested")
+        index = load_index(args.data)
+    except (OSError, ValueError):
+        print("Indexing " + args.data)
+        index = build_index(args.data)
+    print(f"{index.rows} rows, per class: " + str(dict(zip(index.classes, index.counts)))[1:-1])
+
+    if args.random:
+        rows = random_rows(index, *args.random, seed=args.seed)
+    elif args.stratified:
+        rows = stratified_rows(index, *args.stratified, balanced=not args.proportional, seed=args.seed)
+    elif args.range:
+        rows = range_rows(index, *args.range)
+    else:
+        sys.exit(0) # Only (re)build the index
+
+    if not args.output:
+        parser.error("--output is needed to write a subset")
+    write_subset(index, rows, args.output)
+    print(f"{len(rows)} rows written to {args.output}")
@@ -0,0 +1,198 @@
+"""Merge benchmark harness
+
+Generates (or reuses) synthetic datasets for every combination of the given
+parameters, runs each merge engine on them in a child process and reports
+wall time, throughput and the child's peak resident memory as a CSV or JSON
+Lines table. Every run starts from a clean folder: previous outputs, logs and
+the header cache are removed first unless --warm is given.
+"""
+
+# Library imports
+import argparse
+import csv
+import itertools
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from makearff import MANIFEST_NAME, make_dataset  # Also puts the engine on sys.path
+from arffscan import CACHE_NAME
+
+# Constant definitions
+HERE = os.path.dirname(os.path.abspath(__file__))
+ENGINES = {
+    "ver5": [sys.executable, os.path.join(HERE, os.pardir, "ARFF Merge (without GUI)",
+                                          "MergeArff_Ver5.0.py"), "{input}", "--workers", "{workers}"],
+    "arffmerger": [sys.executable, os.path.join(HERE, os.pardir, "ARFF Merge (with GUI)",
+                                                "arffmerger.py"), "{input}", "{output}", "-n", "bench",
+                   "--workers", "{workers}"],
+}  # Engine name -> command; {input}, {output} and {workers} are filled in
+FIELDS = ["dataset", "files", "attributes", "rows_per_file", "classes", "zeros",
+          "sparse", "compression", "input_mb", "engine", "repeat",
+          "returncode", "seconds", "mb_per_s", "rows_per_s", "peak_rss_mb"]
+MEGABYTE = 1024 * 1024  # Bytes per MB in the table
+
+
+def clean_folder(manifest, output_dir, warm=False):
+    """
+    Removes everything a previous run wrote
+
+    :param manifest: Dataset manifest from make_dataset
+    :param output_dir: Output folder of the engines that write elsewhere
+    :param warm: Keep the header cache
+    """
+
+    keep = set(manifest["files"]) | {MANIFEST_NAME}
+    if warm:
+        keep.add(CACHE_NAME)
+    for name in os.listdir(manifest["folder"]):
+        if name not in keep:
+            path = os.path.join(manifest["folder"], name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+    if os.path.isdir(output_dir):
+        for name in os.listdir(output_dir):
+            if not (warm and name==CACHE_NAME):
+                path = os.path.join(output_dir, name)
+                shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+    os.makedirs(output_dir, exist_ok=True)
+
+
+def run_engine(command, timeout=None):
+    """
+    Runs one merge in a child process and measures it
+
+    :param command: Argument list
+    :param timeout: Seconds before the child is killed, or None
+    :return: Return code, wall seconds and the child's peak resident memory
+        in bytes (its own or its largest waited-for child's)
+    """
+
+    start = time.perf_counter()
+    child = subprocess.Popen(command, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE)
+    deadline = start + timeout if timeout else None
+    while True:
+        pid, status, usage = os.wait4(child.pid, os.WNOHANG if deadline else 0)
+        if pid:
+            break
+        if time.perf_counter()>deadline:
+            child.kill()
+            pid, status, usage = os.wait4(child.pid, 0)
+            break
+        time.sleep(0.01)
+    seconds = time.perf_counter() - start
+    child.returncode = os.waitstatus_to_exitcode(status)
+    error = child.stderr.read().decode(errors="replace").strip()
+    child.stderr.close()
+    if child.returncode and error:
+        print(error.splitlines()[-1], file=sys.stderr)
+    return child.returncode, seconds, usage.ru_maxrss * 1024
+
+
+def run_benchmark(datasets, engines, root, repeats=1, workers=1, warm=False,
+                  timeout=None, report=None):
+    """
+    Runs every engine on every dataset
+
+    :param datasets: List of make_dataset keyword dictionaries
+    :param engines: Dictionary of engine name -> command template
+    :param root: Folder of the datasets and the engine outputs
+    :param repeats: Runs per engine and dataset
+    :param workers: Header scan processes passed to the engines
+    :param warm: Keep the header cache between repeats (the first run of
+        each engine is still cold)
+    :param timeout: Seconds before a run is killed
+    :param report: Optional callback, called with each result row
+    :return: List of result dictionaries (see FIELDS)
+    """
+
+    results = []
+    for parameters in datasets:
+        manifest = make_dataset(root, **parameters)
+        output_dir = os.path.join(root, "output")
+        for name, template in engines.items():
+            for repeat in range(repeats):
+                clean_folder(manifest, output_dir, warm and repeat>0)
+                command = [part.format(input=manifest["folder"],
+                                       output=output_dir, workers=workers)
+                           for part in template]
+                returncode, seconds, peak = run_engine(command, timeout)
+                result = {"dataset": os.path.basename(manifest["folder"]),
+                          "files": parameters["files"],
+                          "attributes": parameters["attributes"],
+                          "rows_per_file": parameters["rows"],
+                          "classes": parameters["classes"],
+                          "zeros": parameters["zeros"],
+                          "sparse": parameters["sparse"],
+                          "compression": (parameters["compression"] or "none").lstrip("."),
+                          "input_mb": round(manifest["bytes"] / MEGABYTE, 3),
+                          "engine": name, "repeat": repeat,
+                          "returncode": returncode,
+                          "seconds": round(seconds, 4),
+                          "mb_per_s": round(manifest["bytes"] / MEGABYTE / seconds, 3),
+                          "rows_per_s": round(manifest["rows"] / seconds),
+                          "peak_rss_mb": round(peak / MEGABYTE, 1)}
+                results.append(result)
+                if report:
+                    report(result)
+        clean_folder(manifest, output_dir)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the ARFF merge front ends on synthetic folders. "
+                                                 "Every combination of the dataset options is generated and merged.")
+    parser.add_argument("--root", default=os.path.join(HERE, "datasets"), help="folder of the generated datasets (reused between runs)")
+    parser.add_argument("--files", type=int, nargs="+", default=[100], help="numbers of files per folder (default 100)")
+    parser.add_argument("--attributes", type=int, nargs="+", default=[50], help="numeric attributes per file (default 50)")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000], help="rows per file (default 1000)")
+    parser.add_argument("--classes", type=int, nargs="+", default=[3], help="class values (default 3)")
+    parser.add_argument("--zeros", type=float, nargs="+", default=[0.0], help="fractions of numeric values that are 0 (default 0)")
+    parser.add_argument("--layout", choices=["dense", "sparse"], nargs="+", default=["dense"], help="row layouts (default dense)")
+    parser.add_argument("--compression", choices=["none"] + [suffix[1:] for suffix in (".gz", ".bz2", ".xz")], nargs="+", default=["none"],
+                        help="input compressions (default none)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the datasets")
+    parser.add_argument("--engine", action="append", default=[], metavar="NAME[=COMMAND]",
+                        help="engine to run: ver5, arffmerger, or NAME=COMMAND with {input}, {output} and {workers} placeholders "
+                             "(repeatable; default: ver5 and arffmerger)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per engine and dataset (default 3)")
+    parser.add_argument("--workers", type=int, default=1, help="header scan processes passed to the engines (default 1)")
+    parser.add_argument("--warm", action="store_true", help="keep the header cache between repeats")
+    parser.add_argument("--timeout", type=float, help="seconds before a run is killed")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv", help="table format (default csv)")
+    parser.add_argument("-o", "--output", help="write the table to this file instead of the screen")
+    args = parser.parse_args()
+
+    engines = {}
+    for spec in args.engine or list(ENGINES):
+        name, _, command = spec.partition("=")
+        if command:
+            engines[name] = shlex.split(command)
+        elif name in ENGINES:
+            engines[name] = ENGINES[name]
+        else:
+            parser.error(f"unknown engine {name}, give it as {name}=COMMAND")
+    datasets = [{"files": files, "attributes": attributes, "rows": rows, "classes": classes, "zeros": zeros,
+                 "sparse": layout=="sparse", "compression": "" if compression=="none" else "." + compression, "seed": args.seed}
+                for files, attributes, rows, classes, zeros, layout, compression in itertools.product(
+                    args.files, args.attributes, args.rows, args.classes, args.zeros, args.layout, args.compression)]
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    writer = csv.DictWriter(output, FIELDS)
+    if args.format=="csv":
+        writer.writeheader()
+    def report(result):
+        if args.format=="csv":
+            writer.writerow(result)
+        else:
+            output.write(json.dumps(result) + "\n")
+        output.flush()
+    run_benchmark(datasets, engines, args.root, args.repeat, args.workers, args.warm, args.timeout, report)
+    if args.output:
+        output.close()
@@ -0,0 +1,195 @@
+"""Synthetic ARFF folders for merge benchmarks
+
+A dataset is a folder of equally shaped ARFF files (numeric attributes plus a
+nominal class), dense or sparse, plain or compressed, and a dataset.json
+manifest listing the files and the parameters they were made with. The same
+parameters and seed always give the same bytes, and a folder whose manifest
+already matches is reused instead of being written again.
+"""
+
+# Library imports
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, "ARFF Merge Engine"))
+from arffio import ARFF_SUFFIX, CODECS, open_arff
+
+# Constant definitions
+MANIFEST_NAME = "dataset.json"  # Parameters and file list of a dataset folder
+POOL_SIZE = 1000  # Distinct values drawn from per file
+WRITE_ROWS = 1000  # Rows joined per write
+
+
+def dataset_name(files, attributes, rows, classes, zeros=0.0, sparse=False,
+                 compression="", seed=0):
+    """
+    Names the folder of a dataset after its parameters
+
+    :param files, attributes, rows, classes, zeros, sparse, compression, seed:
+        Dataset parameters (see make_dataset)
+    :return: Folder name, e.g. f100_a50_r1000_c3_z0.0_dense_arff_s0
+    """
+
+    return f"f{files}_a{attributes}_r{rows}_c{classes}_z{zeros}_" \
+           f"{'sparse' if sparse else 'dense'}_{(compression or 'arff').lstrip('.')}_s{seed}"
+
+
+def header_text(attributes, classes):
+    """
+    Builds the header of every file of a dataset
+
+    :param attributes: Number of numeric attributes (the class comes on top)
+    :param classes: Number of class values
+    :return: Header text, up to and including the @data line
+    """
+
+    lines = ["@relation synthetic\n", "\n"]
+    lines += [f"@attribute attr{index} numeric\n" for index in range(attributes)]
+    values = ",".join(f"class{index}" for index in range(1, classes + 1))
+    lines += ["@attribute class {" + values + "}\n", "\n", "@data\n"]
+    return "".join(lines)
+
+
+def value_pool(generator, zeros):
+    """
+    Draws the values rows are made of
+
+    :param generator: random.Random
+    :param zeros: Fraction of the values that are 0
+    :return: List of value strings
+    """
+
+    zero_count = round(POOL_SIZE * zeros)
+    return ["0"] * zero_count + [f"{generator.uniform(-100, 100):.4f}"
+                                 for _ in range(POOL_SIZE - zero_count)]
+
+
+def data_rows(generator, attributes, rows, classes, zeros, sparse):
+    """
+    Generates the data rows of one file
+
+    :param generator: random.Random
+    :param attributes: Number of numeric attributes
+    :param rows: Number of rows
+    :param classes: Number of class values
+    :param zeros: Fraction of numeric values that are 0
+    :param sparse: Write {index value} rows that leave the zeros out
+    :return: Iterator of row strings, without line terminators
+    """
+
+    pool = value_pool(generator, zeros)
+    labels = [f"class{index}" for index in range(1, classes + 1)]
+    for _ in range(rows):
+        values = generator.choices(pool, k=attributes)
+        label = generator.choice(labels)
+        if sparse:
+            pairs = [f"{index} {value}" for index, value in enumerate(values)
+                     if value!="0"]
+            yield "{" + ",".join(pairs + [f"{attributes} {label}"]) + "}"
+        else:
+            yield ",".join(values) + "," + label
+
+
+def write_file(path, header, rows, level=None):
+    """
+    Writes one ARFF file
+
+    :param path: File path; .gz/.bz2/.xz compresses it
+    :param header: Header text
+    :param rows: Iterator of row strings
+    :param level: Compression level of a compressed file
+    :return: Size of the file in bytes
+    """
+
+    with open_arff(path, "wb", level) as arff:
+        arff.write(header.encode())
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch)>=WRITE_ROWS:
+                arff.write(("\n".join(batch) + "\n").encode())
+                batch = []
+        if batch:
+            arff.write(("\n".join(batch) + "\n").encode())
+    return os.path.getsize(path)
+
+
+def make_dataset(root, files, attributes, rows, classes, zeros=0.0,
+                 sparse=False, compression="", seed=0, level=None):
+    """
+    Writes a dataset folder, or reuses it if it was made with the same
+    parameters
+
+    :param root: Folder the dataset folder is created in
+    :param files: Number of files
+    :param attributes: Numeric attributes per file
+    :param rows: Rows per file
+    :param classes: Class values
+    :param zeros: Fraction of numeric values that are 0
+    :param sparse: Write sparse {index value} rows
+    :param compression: "", ".gz", ".bz2" or ".xz"
+    :param seed: Random seed
+    :param level: Compression level (default: arffio.DEFAULT_LEVELS)
+    :return: Manifest dictionary (parameters, "folder", "files", "bytes",
+        "rows")
+    """
+
+    if compression and not compression.startswith("."):
+        compression = "." + compression
+    if compression and compression not in CODECS:
+        raise ValueError(f"Unknown compression {compression}")
+    parameters = {"files": files, "attributes": attributes, "rows": rows,
+                  "classes": classes, "zeros": zeros, "sparse": sparse,
+                  "compression": compression, "seed": seed, "level": level}
+    folder = os.path.join(os.path.abspath(root), dataset_name(files, attributes, rows, classes,
+                                             zeros, sparse, compression, seed))
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    try:
+        with open(manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest["parameters"]==parameters and \
+                all(os.path.exists(os.path.join(folder, name))
+                    for name in manifest["files"]):
+            return manifest
+    except (OSError, ValueError, KeyError):
+        pass
+
+    os.makedirs(folder, exist_ok=True)
+    header = header_text(attributes, classes)
+    names = []
+    size = 0
+    for index in range(files):
+        name = f"f{index:06d}{ARFF_SUFFIX}{compression}"
+        generator = random.Random(seed * 1000003 + index)
+        size += write_file(os.path.join(folder, name), header,
+                           data_rows(generator, attributes, rows, classes,
+                                     zeros, sparse), level)
+        names.append(name)
+    manifest = {"parameters": parameters, "folder": folder, "files": names,
+                "bytes": size, "rows": files * rows}
+    with open(manifest_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a folder of synthetic ARFF files for merge benchmarks")
+    parser.add_argument("root", help="folder the dataset folder is created in")
+    parser.add_argument("--files", type=int, default=100, help="number of files (default 100)")
+    parser.add_argument("--attributes", type=int, default=50, help="numeric attributes per file, the class comes on top (default 50)")
+    parser.add_argument("--rows", type=int, default=1000, help="rows per file (default 1000)")
+    parser.add_argument("--classes", type=int, default=3, help="class values (default 3)")
+    parser.add_argument("--zeros", type=float, default=0.0, help="fraction of the numeric values that are 0 (default 0)")
+    parser.add_argument("--sparse", action="store_true", help="write sparse {index value} rows")
+    parser.add_argument("--compression", choices=[suffix[1:] for suffix in CODECS], help="compress the files")
+    parser.add_argument("--level", type=int, help="compression level")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default 0)")
+    args = parser.parse_args()
+
+    manifest = make_dataset(args.root, args.files, args.attributes, args.rows, args.classes, args.zeros, args.sparse,
+                            args.compression or "", args.seed, args.level)
+    print(f"{manifest['folder']}: {len(manifest['files'])} files, {manifest['rows']} rows, {manifest['bytes'] / 1024 / 1024:.1f} MB")
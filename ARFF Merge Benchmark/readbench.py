@@ -0,0 +1,134 @@
+"""Reader benchmark
+
+Writes (or reuses) one synthetic ARFF file and reads it into NumPy arrays
+twice: with the engine's vectorized reader (arffreader.read_arff) and with a
+plain Python loop that splits every row and converts value by value, the way
+the data was read before the reader existed. Both results are compared, and
+the wall times, throughput and speedup are printed as a CSV table.
+"""
+
+# Library imports
+import argparse
+import csv
+import os
+import sys
+import time
+import numpy as np
+from makearff import make_dataset  # Also puts the engine on sys.path
+from arffio import open_arff
+from arffreader import MISSING_CODE, MISSING_TEXT, ArffReader, read_arff
+from arffscan import ENCODING, ERRORS
+from arffschema import split_row
+
+# Constant definitions
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIELDS = ["reader", "rows", "attributes", "sparse", "compression", "input_mb",
+          "repeat", "seconds", "mb_per_s", "rows_per_s", "speedup"]
+MEGABYTE = 1024 * 1024  # Bytes per MB in the table
+
+
+def read_loop(path, float_dtype="float64"):
+    """
+    Reads an ARFF file row by row in Python, the baseline of the benchmark
+
+    :param path: ARFF file path
+    :param float_dtype: NumPy float type for numeric attributes
+    :return: Attribute dictionaries and a dictionary of attribute name ->
+        array, like read_arff
+    """
+
+    reader = ArffReader(path, float_dtype)
+    attributes = reader.attributes
+    width = len(attributes)
+    lookups = [{value: code for code, value in
+                enumerate(attribute.get("values", []))} for attribute in attributes]
+    columns = [[] for _ in attributes]
+    with open_arff(path) as arff:
+        arff.seek(reader.data_offset)
+        for line in arff:
+            line = line.strip()
+            if not line or line.startswith(b"%"):
+                continue
+            for index, value in enumerate(split_row(line, width, reader.defaults)):
+                if attributes[index]["kind"]=="numeric":
+                    columns[index].append(float("nan") if value==MISSING_TEXT
+                                          else float(value))
+                else:
+                    value = value.decode(ENCODING, ERRORS).strip("'\"")
+                    columns[index].append(MISSING_CODE if value=="?" else
+                                          lookups[index].setdefault(value, len(lookups[index])))
+    return attributes, {attribute["name"]: np.array(column, dtype=attribute["dtype"])
+                        for attribute, column in zip(attributes, columns)}
+
+
+def run_readbench(root, rows, attributes, classes=3, sparse=False,
+                  compression="", repeats=3, seed=0, report=None):
+    """
+    Times the vectorized reader against the Python loop on one file
+
+    :param root: Folder of the generated datasets
+    :param rows: Rows of the file
+    :param attributes: Numeric attributes of the file
+    :param classes: Class values
+    :param sparse: Write sparse {index value} rows
+    :param compression: "", ".gz", ".bz2" or ".xz"
+    :param repeats: Runs per reader
+    :param seed: Random seed of the file
+    :param report: Optional callback, called with each result row
+    :return: List of result dictionaries (see FIELDS)
+    """
+
+    manifest = make_dataset(root, 1, attributes, rows, classes, sparse=sparse,
+                            compression=compression, seed=seed)
+    path = os.path.join(manifest["folder"], manifest["files"][0])
+    _, expected = read_loop(path)
+    if not all(np.array_equal(array, expected[name], equal_nan=True)
+               for name, array in read_arff(path)[1].items()):
+        raise ValueError(f"File {path}: the readers disagree")
+
+    results = []
+    best = {}
+    for name, function in (("loop", read_loop), ("arffreader", read_arff)):
+        for repeat in range(repeats):
+            start = time.perf_counter()
+            function(path)
+            seconds = time.perf_counter() - start
+            best[name] = min(best.get(name, seconds), seconds)
+            result = {"reader": name, "rows": manifest["rows"],
+                      "attributes": attributes, "sparse": sparse,
+                      "compression": (compression or "none").lstrip("."),
+                      "input_mb": round(manifest["bytes"] / MEGABYTE, 3),
+                      "repeat": repeat, "seconds": round(seconds, 4),
+                      "mb_per_s": round(manifest["bytes"] / MEGABYTE / seconds, 3),
+                      "rows_per_s": round(manifest["rows"] / seconds),
+                      "speedup": round(best["loop"] / seconds, 2)}
+            results.append(result)
+            if report:
+                report(result)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized ARFF reader against a row by row Python loop "
+                                                 "on one synthetic file.")
+    parser.add_argument("--root", default=os.path.join(HERE, "datasets"), help="folder of the generated datasets (reused between runs)")
+    parser.add_argument("--rows", type=int, default=50000, help="rows of the file (default 50000)")
+    parser.add_argument("--attributes", type=int, default=200, help="numeric attributes (default 200)")
+    parser.add_argument("--classes", type=int, default=3, help="class values (default 3)")
+    parser.add_argument("--layout", choices=["dense", "sparse"], default="dense", help="row layout (default dense)")
+    parser.add_argument("--compression", choices=["none", "gz", "bz2", "xz"], default="none", help="file compression (default none)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the file")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per reader (default 3)")
+    parser.add_argument("-o", "--output", help="write the table to this file instead of the screen")
+    args = parser.parse_args()
+
+    output = open(args.output, "w", newline="") if args.output else sys.stdout
+    writer = csv.DictWriter(output, FIELDS)
+    writer.writeheader()
+    def report(result):
+        writer.writerow(result)
+        output.flush()
+    run_readbench(args.root, args.rows, args.attributes, args.classes, args.layout=="sparse",
+                  "" if args.compression=="none" else "." + args.compression, args.repeat, args.seed, report)
+    if args.output:
+        output.close()
@@ -0,0 +1,275 @@
+"""Headless folder merges and a watch-folder batch merger
+
+merge_folder is the whole GUI merge (header checks, schema union, merge,
+index and columnar copy) as one call with explicit input, output and
+options, for scripts and cluster jobs. With a selection threshold it first
+ranks the attributes over all inputs in one streaming pass and then merges
+only the selected columns, so no full-width merge is ever written. watch_folder keeps running and merges
+the ARFF files dropped into a folder incrementally, a batch at a time.
+"""
+
+# Library imports
+import os
+import time
+from arffengine import merge_groups, merge_incremental
+from arffindex import build_index
+from arffio import ARFF_SUFFIX, find_arff
+from arffscan import CACHE_NAME, file_stamp, group_entries, load_cache, \
+    save_cache, scan_files
+from arffschema import schema_header, select_schema, union_schema
+
+# Constant definitions
+POLL_INTERVAL = 10.0  # Seconds between two looks at the watched folder
+BATCH_FILES = 50  # New files that start a merge straight away
+BATCH_WAIT = 60.0  # Seconds a new file waits for more files before merging
+COLUMNAR_SUFFIX = ".columns"  # Replaces the output extension in the name of
+# its columnar copy
+
+
+def mismatch_message(kind, problem, groups):
+    """
+    Builds the error text listing the files of every class or attribute group
+
+    :param kind: "class" or "attribute"
+    :param problem: What stops the merge
+    :param groups: Dictionary of group name -> filenames from group_entries
+    :return: Message text
+    """
+
+    listing = ""
+    for key, names in groups.items():
+        label = key[-1] if kind=="class" else key
+        listing += f"{label}-{kind} files:\n{str(names)[1:-1]}\n\n"
+    return f"Merging procedure cannot continue while input folder contains " \
+           f"{problem}. \n\n{listing}"
+
+
+def merge_folder(input_dir, output_dir, file_name, incremental=False,
+                 group=False, columnar=False, sparse_threshold=None,
+                 suffix=ARFF_SUFFIX, level=None, index=False, dedup=None,
+                 workers=1, file_list=None, cache=None, progress=None,
+                 threshold=None):
+    """
+    Merges the ARFF files of a folder into one output (or one per group)
+
+    :param input_dir: Folder of .arff/.arff.gz/.arff.bz2/.arff.xz files
+    :param output_dir: Folder of the merged file, its cache and sidecars
+    :param file_name: Merged filename without extension
+    :param incremental: Only append the files added since the last merge
+    :param group: Merge a folder with different class sets or attribute
+        counts into one output per group instead of failing
+    :param columnar: Also write the NumPy columnar copy of every output
+        (needs numpy)
+    :param sparse_threshold: Write dense rows with at least this fraction of
+        numeric zeros as sparse rows (None keeps them dense)
+    :param suffix: Output extension, ".arff" or ".arff.gz/.bz2/.xz"
+    :param level: Compression level of a compressed output
+    :param index: Also write the row index sidecar
+    :param dedup: arffdedup.RowDeduplicator to drop repeated rows, or None
+    :param workers: Number of processes used to scan the headers
+    :param file_list: Files to merge (default: every ARFF file of input_dir)
+    :param cache: Cache dictionary to reuse between calls (default: loaded
+        from, and in any case saved to, output_dir)
+    :param progress: Optional callback, called with each entry once its rows
+        have been written
+    :param threshold: Information gain threshold (e.g. arffselect.THRESHOLD):
+        rank the attributes over all inputs first (arffsketch, needs numpy)
+        and merge only those above it and the class; None merges everything
+    :return: Result dictionary: "outputs" (merged file paths), "entries"
+        (entries of the files written), "rebuilt", "groups" (from
+        merge_groups, or None; with columnar, every group also gets its
+        "columnar" folder and "columnar_rows"), "columnar_rows" (rows of all
+        columnar copies, or None) and "ranking" (selected (name, gain) pairs,
+        best first, or None)
+    """
+
+    cache_path = os.path.join(output_dir, CACHE_NAME)
+    if cache is None:
+        cache = load_cache(cache_path)
+    if file_list is None:
+        file_list = find_arff(input_dir)
+    output_path = os.path.join(output_dir, file_name + suffix)
+    file_list = [name for name in file_list if os.path.abspath(name)!=
+                 os.path.abspath(output_path)]  # Never merge an output into itself
+    entries = scan_files(file_list, cache, workers=workers)
+    if not entries:
+        raise ValueError("No ARFF files to merge")
+    class_dict, attributes_dict = group_entries(entries)
+    result = {"outputs": [], "entries": [], "rebuilt": True, "groups": None,
+              "columnar_rows": None, "ranking": None}
+
+    select = None
+    if threshold is not None:
+        if len(class_dict)>1:  # Gains over different class sets mean nothing
+            raise ValueError(mismatch_message(
+                "class", "files with different number of classes", class_dict))
+        from arffsketch import SKETCH_SUFFIX, update_sketch  # Only selection
+        # needs numpy; the inputs of the previous merge are not read again
+        result["ranking"] = update_sketch(entries, output_path + SKETCH_SUFFIX,
+                                          workers).ranking(threshold)
+        select = [name for name, _ in result["ranking"]]
+
+    if group and (len(class_dict)>1 or len(attributes_dict)>1):
+        groups = merge_groups(file_list, output_dir, file_name, cache, workers,
+                              progress, sparse_threshold=sparse_threshold,
+                              suffix=suffix, level=level, dedup=dedup,
+                              select=select, entries=entries)
+        save_cache(cache, cache_path)
+        if index:
+            for group_output in groups.values():
+                build_index(group_output["output"])
+        if columnar:
+            from arffcolumnar import export_arff  # Only this option needs numpy
+            for group_output in groups.values():
+                group_output["columnar"] = group_output["output"][:-len(suffix)] + \
+                    COLUMNAR_SUFFIX
+                group_output["columnar_rows"] = export_arff(
+                    group_output["output"], group_output["columnar"],
+                    relation=os.path.basename(group_output["output"][:-len(suffix)]))
+            result["columnar_rows"] = sum(group_output["columnar_rows"] for
+                                          group_output in groups.values())
+        result.update(groups=groups, outputs=[group_output["output"] for
+                                              group_output in groups.values()],
+                      entries=[entry for group_output in groups.values()
+                               for entry in group_output["entries"]])
+        return result
+
+    if len(class_dict)>1:
+        raise ValueError(mismatch_message(
+            "class", "files with different number of classes", class_dict))
+    try:
+        schema = union_schema(entry["header_lines"] for entry in entries)
+    except ValueError as conflict:
+        raise ValueError(mismatch_message(
+            "attribute", f"files with conflicting attributes ({conflict})",
+            attributes_dict)) from conflict
+    if select is not None:
+        schema = select_schema(schema, select)
+    merged_header = schema_header(entries[0]["header_lines"], schema)
+
+    merged_entries, rebuilt = merge_incremental(
+        file_list, output_path, cache, merged_header, rebuild=not incremental,
+        progress=progress, schema=schema, sparse_threshold=sparse_threshold,
+        level=level, dedup=dedup, entries=entries)
+    save_cache(cache, cache_path)
+    if index:
+        build_index(output_path, update=not rebuilt)
+    if columnar:  # Read back from the output, so it has the same rows after
+        # deduplication and appends
+        from arffcolumnar import export_arff  # Only this option needs numpy
+        result["columnar_rows"] = export_arff(
+            output_path, os.path.join(output_dir, file_name + COLUMNAR_SUFFIX),
+            relation=file_name)
+    result.update(outputs=[output_path], entries=merged_entries,
+                  rebuilt=rebuilt)
+    return result
+
+
+def merge_isolating(merge, merged_files, new_files, report=None):
+    """
+    Merges new files with the files merged before, leaving out only the new
+    files that make the merge fail
+
+    A batch whose merge raises ValueError is split in halves, merged one
+    after the other (the good files of the first half joining the merged
+    files before the second half is tried), down to the single files that
+    cannot be merged with the rest.
+
+    :param merge: Callable taking the file list
+    :param merged_files: Files merged before
+    :param new_files: New files of the batch
+    :param report: Optional callback, called with the new files of every
+        merge that succeeded and its result, and with the new files given up
+        on and the ValueError their merge raised
+    :return: New files merged and new files rejected
+    """
+
+    try:
+        result = merge(sorted(merged_files + new_files))
+    except ValueError as error:
+        if len(new_files)<=1:
+            if report:
+                report(new_files, error)
+            return [], new_files
+        half = len(new_files) // 2
+        merged, rejected = merge_isolating(merge, merged_files, new_files[:half],
+                                           report)
+        more, also_rejected = merge_isolating(merge, merged_files + merged,
+                                              new_files[half:], report)
+        return merged + more, rejected + also_rejected
+    if report:
+        report(new_files, result)
+    return new_files, []
+
+
+def watch_folder(input_dir, merge, interval=POLL_INTERVAL,
+                 batch_files=BATCH_FILES, batch_wait=BATCH_WAIT, ignore=None,
+                 report=None, stop=None):
+    """
+    Merges the files dropped into a folder, in batches, until stopped
+
+    A file joins a batch once its size and modification time have not
+    changed between two looks at the folder (so files still being copied are
+    left for later). A batch is merged when it has batch_files files or its
+    oldest file has waited batch_wait seconds. merge is called with every
+    file of the folder except the ones still being written or rejected
+    before, so an incremental merge only appends the new ones. When a batch
+    cannot be merged, only its files that raise ValueError (see
+    merge_isolating) are left out until they change.
+
+    :param input_dir: Watched folder
+    :param merge: Callable taking the file list, e.g. a merge_folder call
+        with incremental=True
+    :param interval: Seconds between two looks at the folder
+    :param batch_files: Number of new files that starts a merge at once
+    :param batch_wait: Seconds the oldest new file waits for more files
+    :param ignore: Optional callable taking a path, True for files never to
+        merge (e.g. the merged outputs, when they are written to the folder)
+    :param report: Optional callback, called with the new files of each
+        merge and its result, or with the rejected files and the ValueError
+        their merge raised
+    :param stop: Optional callable; the watch ends when it returns True
+    """
+
+    merged = {}  # path -> stamp when last merged (or rejected)
+    rejected = set()
+    previous = {}  # path -> stamp at the previous look
+    waiting_since = None
+    while not (stop and stop()):
+        current = {}
+        for path in find_arff(input_dir):
+            path = os.path.abspath(path)
+            if ignore and ignore(path):
+                continue
+            try:
+                current[path] = file_stamp(path)[1:]
+            except OSError:  # Deleted between the listing and the stat
+                continue
+
+        settled = {path: stamp for path, stamp in current.items()
+                   if previous.get(path)==stamp}
+        new = sorted(path for path, stamp in settled.items()
+                     if merged.get(path)!=stamp)
+        removed = [path for path in merged if path not in current]
+        if (new or removed) and waiting_since is None:
+            waiting_since = time.monotonic()
+        if waiting_since is not None and (
+                len(new)>=batch_files or
+                time.monotonic() - waiting_since>=batch_wait):
+            for path in removed:
+                merged.pop(path)
+                rejected.discard(path)
+            rejected.difference_update(new)
+            merged_files = [path for path in settled
+                            if path not in rejected and path not in new]
+            if merged_files or new:
+                rejected.update(merge_isolating(merge, merged_files, new,
+                                                report)[1])
+            elif report:
+                report(new, None)
+            for path in new:
+                merged[path] = settled[path]
+            waiting_since = None
+        previous = current
+        if not (stop and stop()):
+            time.sleep(interval)
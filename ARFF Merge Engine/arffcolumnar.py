@@ -0,0 +1,240 @@
+"""Columnar binary export of merged ARFF data, loaded back through memory maps
+
+A columnar dataset is a directory holding header.json and one .npy file per
+attribute. Numeric attributes are stored as floats (missing values are NaN),
+nominal and string attributes as small integer codes into a dictionary kept
+in header.json (missing values are -1). Any column can be opened with
+numpy.load(..., mmap_mode="r"), so reading a few columns or a row range only
+touches those bytes on disk.
+"""
+
+# Library imports
+import json
+import os
+import numpy as np
+from arffreader import MISSING_CODE, ArffDecoder, describe_attributes, \
+    iter_blocks
+from arffscan import CHUNK_SIZE, read_header
+from arffschema import column_map, header_attributes, sparse_defaults, \
+    union_schema
+
+# Constant definitions
+HEADER_NAME = "header.json"  # Dataset description inside the directory
+FORMAT_VERSION = 1  # Bumped whenever the layout changes
+NPY_HEADER_SIZE = 128  # Fixed .npy header size, so it can be rewritten in place
+
+
+def attribute_layout(schema, float_dtype="float64"):
+    """
+    Describes how every attribute of a schema is stored
+
+    :param schema: Attribute declaration lines (see arffschema.union_schema)
+    :param float_dtype: NumPy float type for numeric attributes
+    :return: Attribute dictionaries from arffreader.describe_attributes, with
+        the file holding each column
+    """
+
+    layout = describe_attributes(schema, float_dtype)
+    for index, attribute in enumerate(layout):
+        attribute["file"] = f"col_{index:05d}.npy"
+    return layout
+
+
+def npy_header(dtype, rows):
+    """
+    Builds a fixed-size .npy (version 1.0) header for a 1D array
+
+    :param dtype: Array dtype
+    :param rows: Array length
+    :return: Header bytes, NPY_HEADER_SIZE long
+    """
+
+    text = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        np.lib.format.dtype_to_descr(np.dtype(dtype)), rows)
+    text = text.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + len(text).to_bytes(2, "little") + \
+        text.encode("latin1")
+
+
+class ColumnarWriter:
+    """Appends rows to a columnar dataset, one file per attribute"""
+
+    def __init__(self, out_dir, schema, relation="merged", float_dtype="float64"):
+        """
+        Creates the dataset directory and its column files
+
+        :param out_dir: Dataset directory
+        :param schema: Attribute declaration lines
+        :param relation: Relation name stored in the header
+        :param float_dtype: NumPy float type for numeric attributes
+        """
+
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.relation = relation
+        self.layout = attribute_layout(schema, float_dtype)
+        self.decoder = ArffDecoder(self.layout)
+        self.rows = 0
+        self.files = []
+        for attribute in self.layout:
+            column_file = open(os.path.join(out_dir, attribute["file"]), "wb")
+            column_file.write(npy_header(attribute["dtype"], 0))
+            self.files.append(column_file)
+
+    def write_batch(self, arrays):
+        """
+        Appends a batch of rows
+
+        :param arrays: Dictionary of attribute name -> array, from
+            arffreader.ArffDecoder.decode_block
+        """
+
+        rows = 0
+        for attribute, column_file in zip(self.layout, self.files):
+            column = arrays[attribute["name"]]
+            column_file.write(column.astype(attribute["dtype"], copy=False).tobytes())
+            rows = len(column)
+        self.rows += rows
+
+    def close(self):
+        """Writes the final row count into every column and the header file"""
+
+        for attribute, column_file in zip(self.layout, self.files):
+            column_file.seek(0)
+            column_file.write(npy_header(attribute["dtype"], self.rows))
+            column_file.close()
+        header = {"version": FORMAT_VERSION, "relation": self.relation,
+                  "rows": self.rows, "attributes": self.layout}
+        with open(os.path.join(self.out_dir, HEADER_NAME), "w",
+                  encoding="utf-8") as header_file:
+            json.dump(header, header_file, indent=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def export_columnar(entries, schema, out_dir, relation="merged",
+                    float_dtype="float64", chunk_size=CHUNK_SIZE):
+    """
+    Streams scanned ARFF files into one columnar dataset
+
+    Every chunk of a file is converted straight into schema-ordered columns
+    (missing values for attributes the file lacks), so memory stays bounded
+    by the chunk size.
+
+    :param entries: Entry dictionaries from arffscan.scan_files
+    :param schema: Attribute declaration lines from arffschema.union_schema
+    :param out_dir: Dataset directory
+    :param relation: Relation name stored in the header
+    :param float_dtype: NumPy float type for numeric attributes
+    :param chunk_size: Bytes read at a time
+    :return: Number of rows written
+    """
+
+    with ColumnarWriter(out_dir, schema, relation, float_dtype) as writer:
+        for entry in entries:
+            mapping = column_map(entry["header_lines"], schema)
+            width = len(header_attributes(entry["header_lines"]))
+            defaults = sparse_defaults(entry["header_lines"])
+            for block in iter_blocks(entry["path"], entry["data_offset"],
+                                     chunk_size):
+                writer.write_batch(writer.decoder.decode_block(
+                    block, width, mapping, entry["path"], defaults))
+    return writer.rows
+
+
+def export_arff(path, out_dir, relation="merged", float_dtype="float64",
+                chunk_size=CHUNK_SIZE):
+    """
+    Writes the columnar copy of one ARFF file, e.g. a merged output, so the
+    copy holds exactly the rows written there
+
+    :param path: ARFF file path
+    :param out_dir: Dataset directory
+    :param relation: Relation name stored in the header
+    :param float_dtype: NumPy float type for numeric attributes
+    :param chunk_size: Bytes read at a time
+    :return: Number of rows written
+    """
+
+    header_lines, data_offset = read_header(path)
+    entry = {"path": path, "header_lines": header_lines,
+             "data_offset": data_offset}
+    return export_columnar([entry], union_schema([header_lines]), out_dir,
+                           relation, float_dtype, chunk_size)
+
+
+class ColumnarDataset:
+    """Read-only view of a columnar dataset; columns are memory-mapped"""
+
+    def __init__(self, path):
+        """
+        Opens a dataset directory
+
+        :param path: Dataset directory
+        """
+
+        with open(os.path.join(path, HEADER_NAME), encoding="utf-8") as header_file:
+            self.header = json.load(header_file)
+        if self.header.get("version")!=FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} "
+                             f"columnar dataset")
+        self.path = path
+        self.rows = self.header["rows"]
+        self.attributes = {attribute["name"]: attribute
+                           for attribute in self.header["attributes"]}
+        self.names = list(self.attributes)
+
+    def column(self, name, start=None, stop=None):
+        """
+        Gets one column, or a row range of it, without reading the rest
+
+        :param name: Attribute name
+        :param start: First row (default 0)
+        :param stop: Row after the last one (default: all rows)
+        :return: Memory-mapped NumPy array (floats or integer codes)
+        """
+
+        attribute = self.attributes[name]
+        column = np.load(os.path.join(self.path, attribute["file"]),
+                         mmap_mode="r")
+        return column[start:stop]
+
+    def select(self, names, start=None, stop=None):
+        """
+        Gets several columns over a row range
+
+        :param names: Attribute names
+        :param start: First row (default 0)
+        :param stop: Row after the last one (default: all rows)
+        :return: Dictionary of name -> memory-mapped array
+        """
+
+        return {name: self.column(name, start, stop) for name in names}
+
+    def decode(self, name, codes):
+        """
+        Turns nominal/string codes back into their values
+
+        :param name: Attribute name
+        :param codes: Integer codes from column()
+        :return: NumPy array of values (None where missing)
+        """
+
+        values = np.array(self.attributes[name]["values"] + [None], dtype=object)
+        codes = np.asarray(codes)
+        return values[np.where(codes==MISSING_CODE, len(values) - 1, codes)]
+
+
+def open_columnar(path):
+    """
+    Opens a columnar dataset
+
+    :param path: Dataset directory
+    :return: ColumnarDataset
+    """
+
+    return ColumnarDataset(path)
@@ -0,0 +1,319 @@
+"""Bounded-memory duplicate row removal for ARFF merges
+
+Each data row is normalized (spaces around values dropped) and hashed to a
+128-bit digest. Digests are kept in an exact in-memory set until it reaches
+the memory budget; after that they move to a spill store, either an on-disk
+hash set (an SQLite table keyed by digest, looked up a chunk of rows at a
+time) or a Bloom filter sized for the rows still to come at a chosen
+false-positive rate.
+"""
+
+# Library imports
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+import numpy as np
+
+# Constant definitions
+DIGEST_SIZE = 16  # Bytes per row hash (blake2b)
+ENTRY_BYTES = 100  # Approximate memory per digest in a Python set
+DEFAULT_BUDGET = 512 * 1024 * 1024  # Memory for the exact set, in bytes
+DEFAULT_ERROR = 0.001  # Bloom filter false-positive rate
+SPILL_MODES = ("disk", "bloom")  # Stores used once the budget is reached
+QUERY_BATCH = 500  # Digests per SQLite IN (...) lookup
+PRIME_BATCH = 10000  # Rows hashed at a time when priming from an output
+BLOOM_GROWTH = 2  # Capacity factor of each extra Bloom filter stage
+BLOOM_TIGHTENING = 0.5  # Error factor of each extra Bloom filter stage
+
+
+def normalize_row(line):
+    """
+    Normalizes a data row so that equal instances hash the same
+
+    :param line: Data row bytes, stripped
+    :return: Row bytes without spaces around the values
+    """
+
+    if b" " not in line and b"\t" not in line:
+        return line
+    return b",".join(value.strip() for value in line.split(b","))
+
+
+def row_digest(line):
+    """
+    Hashes one data row
+
+    :param line: Data row bytes, stripped
+    :return: Digest bytes
+    """
+
+    return hashlib.blake2b(normalize_row(line), digest_size=DIGEST_SIZE).digest()
+
+
+class DiskHashSet:
+    """Digest set stored in an SQLite file, queried in batches"""
+
+    def __init__(self, work_dir=None, cache_bytes=64 * 1024 * 1024):
+        """
+        Creates the database in a temporary directory
+
+        :param work_dir: Directory for the temporary database (default: the
+            system temporary directory)
+        :param cache_bytes: SQLite page cache size
+        """
+
+        self.directory = tempfile.TemporaryDirectory(prefix="arffdedup_",
+                                                     dir=work_dir)
+        self.connection = sqlite3.connect(os.path.join(self.directory.name,
+                                                       "seen.db"))
+        self.connection.execute("PRAGMA journal_mode=OFF")
+        self.connection.execute("PRAGMA synchronous=OFF")
+        self.connection.execute(f"PRAGMA cache_size=-{cache_bytes // 1024}")
+        self.connection.execute("CREATE TABLE seen (digest BLOB PRIMARY KEY) "
+                                "WITHOUT ROWID")
+
+    def add_new(self, digests):
+        """
+        Adds digests and reports which of them were already present
+
+        :param digests: List of distinct digests
+        :return: Set of the digests that were already present
+        """
+
+        present = set()
+        for start in range(0, len(digests), QUERY_BATCH):
+            batch = digests[start:start + QUERY_BATCH]
+            query = "SELECT digest FROM seen WHERE digest IN (" + \
+                ",".join("?" * len(batch)) + ")"
+            present.update(row[0] for row in self.connection.execute(query, batch))
+        self.connection.executemany("INSERT INTO seen VALUES (?)",
+                                    [(digest,) for digest in digests
+                                     if digest not in present])
+        return present
+
+    def close(self):
+        """Deletes the database"""
+
+        self.connection.close()
+        self.directory.cleanup()
+
+
+class BloomFilter:
+    """Scalable Bloom filter: a new, larger stage is added when one fills up"""
+
+    def __init__(self, capacity, error=DEFAULT_ERROR):
+        """
+        Creates the first stage
+
+        :param capacity: Number of digests the first stage is sized for
+        :param error: False-positive rate of the first stage
+        """
+
+        self.error = error
+        self.stages = []  # [bits, size in bits, hash count, capacity, count]
+        self.add_stage(max(capacity, 1024), error)
+
+    def add_stage(self, capacity, error):
+        """
+        Adds an empty stage
+
+        :param capacity: Number of digests the stage is sized for
+        :param error: False-positive rate of the stage
+        """
+
+        size = math.ceil(-capacity * math.log(error) / math.log(2) ** 2)
+        hashes = max(1, round(size / capacity * math.log(2)))
+        self.stages.append([np.zeros(size // 8 + 1, dtype=np.uint8), size,
+                            hashes, capacity, 0])
+
+    @staticmethod
+    def positions(digests, size, hashes):
+        """
+        Gets the bit positions of a batch of digests (double hashing)
+
+        :param digests: List of digest bytes
+        :param size: Stage size in bits
+        :param hashes: Number of positions per digest
+        :return: uint64 array of shape (digests, hashes)
+        """
+
+        halves = np.frombuffer(b"".join(digests), dtype="<u8").reshape(-1, 2)
+        size = np.uint64(size)
+        first = halves[:, 0] % size
+        step = (halves[:, 1] | np.uint64(1)) % size
+        return (first[:, None] + step[:, None] *
+                np.arange(hashes, dtype=np.uint64)) % size
+
+    def add_new(self, digests):
+        """
+        Adds digests and reports which of them were (probably) present
+
+        The whole batch is tested against every stage at once; the absent
+        digests are then set in the last stage, as many as it has room for
+        before the next stage is added.
+
+        :param digests: List of distinct digests
+        :return: Set of the digests found in the filter
+        """
+
+        if not digests:
+            return set()
+        found = np.zeros(len(digests), dtype=bool)
+        for bits, size, hashes, _, _ in self.stages:
+            positions = self.positions(digests, size, hashes)
+            found |= np.all((bits[positions >> np.uint64(3)] >>
+                             (positions & np.uint64(7)).astype(np.uint8)) & 1,
+                            axis=1)
+
+        absent = [digest for digest, hit in zip(digests, found) if not hit]
+        while absent:
+            stage = self.stages[-1]
+            if stage[4]>=stage[3]:
+                self.add_stage(stage[3] * BLOOM_GROWTH, self.error *
+                               BLOOM_TIGHTENING ** len(self.stages))
+                stage = self.stages[-1]
+            bits, size, hashes, capacity, count = stage
+            batch, absent = absent[:capacity - count], absent[capacity - count:]
+            positions = self.positions(batch, size, hashes)
+            np.bitwise_or.at(bits, positions >> np.uint64(3), np.left_shift(
+                np.uint8(1), (positions & np.uint64(7)).astype(np.uint8)))
+            stage[4] += len(batch)
+        return {digest for digest, hit in zip(digests, found) if hit}
+
+    @property
+    def memory(self):
+        """Bytes used by the bit arrays"""
+
+        return sum(len(stage[0]) for stage in self.stages)
+
+    def close(self):
+        """Frees the bit arrays"""
+
+        self.stages = []
+
+
+class RowDeduplicator:
+    """Drops data rows seen before, within a memory budget"""
+
+    def __init__(self, memory_budget=DEFAULT_BUDGET, spill="disk",
+                 error=DEFAULT_ERROR, work_dir=None, expected_bytes=None):
+        """
+        Sets the dedup options
+
+        :param memory_budget: Bytes the exact in-memory set may use
+        :param spill: "disk" (exact, on-disk hash set) or "bloom" (Bloom
+            filter, may drop a unique row with probability `error`)
+        :param error: Bloom filter false-positive rate
+        :param work_dir: Directory for the on-disk set
+        :param expected_bytes: Total input bytes to deduplicate, used to size
+            the Bloom filter (it grows automatically if this is too small)
+        """
+
+        if spill not in SPILL_MODES:
+            raise ValueError(f"Unknown spill mode {spill}")
+        self.memory_budget = memory_budget
+        self.spill_mode = spill
+        self.error = error
+        self.work_dir = work_dir
+        self.expected_bytes = expected_bytes
+        self.seen = set()
+        self.store = None  # DiskHashSet or BloomFilter once spilled
+        self.rows = 0  # Rows checked
+        self.row_bytes = 0  # Bytes of the rows checked
+        self.removed = 0  # Rows dropped as duplicates
+
+    def fresh(self):
+        """
+        Creates an empty deduplicator with the same options
+
+        :return: RowDeduplicator
+        """
+
+        return RowDeduplicator(self.memory_budget, self.spill_mode, self.error,
+                               self.work_dir, self.expected_bytes)
+
+    def spill(self):
+        """Moves the in-memory digests into the spill store"""
+
+        if self.spill_mode=="disk":
+            self.store = DiskHashSet(self.work_dir)
+        else:
+            capacity = len(self.seen) * 2
+            if self.expected_bytes and self.row_bytes:
+                capacity = max(capacity, round(self.expected_bytes * self.rows /
+                                               self.row_bytes))
+            self.store = BloomFilter(capacity, self.error)
+        self.store.add_new(list(self.seen))
+        self.seen = set()
+
+    def keep(self, rows):
+        """
+        Checks a batch of data rows, in order
+
+        :param rows: List of stripped data row bytes
+        :return: List of booleans: True for rows seen for the first time
+        """
+
+        digests = [row_digest(row) for row in rows]
+        self.rows += len(rows)
+        self.row_bytes += sum(len(row) + 1 for row in rows)
+
+        first = {}  # digest -> position of its first occurrence in the batch
+        for position, digest in enumerate(digests):
+            first.setdefault(digest, position)
+        if self.store is None:
+            present = {digest for digest in first if digest in self.seen}
+            self.seen.update(first)
+            if len(self.seen) * ENTRY_BYTES>self.memory_budget:
+                self.spill()
+        else:
+            present = self.store.add_new(list(first))
+
+        flags = [first[digest]==position and digest not in present
+                 for position, digest in enumerate(digests)]
+        self.removed += flags.count(False)
+        return flags
+
+    def prime(self, rows):
+        """
+        Records rows as seen without checking them (e.g. an existing output)
+
+        :param rows: Iterable of stripped data row bytes
+        """
+
+        removed = self.removed
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch)>=PRIME_BATCH:
+                self.keep(batch)
+                batch = []
+        self.keep(batch)
+        self.removed = removed
+
+    def close(self):
+        """Frees the in-memory set and deletes the on-disk set"""
+
+        self.seen = set()
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
+
+def duplicate_summary(entries):
+    """
+    Lists how many duplicate rows were removed from each input file
+
+    :param entries: Entry dictionaries merged with a deduplicator
+    :return: Summary text
+    """
+
+    summary = ""
+    total = 0
+    for entry in entries:
+        removed = entry.get("duplicates", 0)
+        total += removed
+        summary += f"{os.path.basename(entry['path'])}: {removed}\n"
+    return f"Duplicate rows removed: {total}\n{summary}"
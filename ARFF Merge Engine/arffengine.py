@@ -0,0 +1,375 @@
+"""Streaming ARFF merge engine shared by the GUI and non-GUI merge front ends"""
+
+# Library imports
+import os
+import re
+import time
+from arffio import ARFF_SUFFIX, open_arff
+from arffscan import CHUNK_SIZE, ENCODING, ERRORS, ROW_PATTERN, file_stamp, \
+    read_header, record_rows, scan_files
+from arffschema import column_map, header_attributes, is_identity, \
+    iter_data_rows, remap_data, schema_header, select_schema, sparse_plan, \
+    union_schema
+
+# Constant definitions
+UNSAFE_NAME = re.compile(r"[^A-Za-z0-9]+")  # Characters replaced in group
+# output filenames
+
+
+def copy_data(path, data_offset, output, chunk_size=CHUNK_SIZE):
+    """
+    Streams the @data section of an ARFF file into an open output file
+
+    :param path: ARFF file path
+    :param data_offset: Byte offset of the first data row
+    :param output: Output file opened in binary write/append mode
+    :param chunk_size: Bytes copied per read
+    :return: Number of bytes copied and number of data rows
+    """
+
+    copied = 0
+    rows = 0
+    tail = b""  # Partial line carried over to the next chunk for row counting
+    with open_arff(path) as arff:
+        arff.seek(data_offset)
+        while True:
+            chunk = arff.read(chunk_size)
+            if not chunk:
+                break
+            output.write(chunk)
+            copied += len(chunk)
+            cut = chunk.rfind(b"\n") + 1
+            if cut:
+                rows += len(ROW_PATTERN.findall(tail + chunk[:cut]))
+                tail = chunk[cut:]
+            else:
+                tail += chunk
+
+    if tail:  # Keep the next file's first row on its own line
+        rows += len(ROW_PATTERN.findall(tail))
+        output.write(b"\n")
+    return copied, rows
+
+
+def copy_entry(entry, output, schema=None, chunk_size=CHUNK_SIZE,
+               sparse_threshold=None, dedup=None):
+    """
+    Streams the @data section of a scanned file, remapping its columns if needed
+
+    Files whose columns already match the schema are copied as raw chunks,
+    dense and sparse rows alike; only files with other or reordered
+    attributes, whose rows are to be rewritten sparse or deduplicated, are
+    parsed row by row. With a deduplicator, the number of rows dropped is
+    stored in entry["duplicates"].
+
+    :param entry: Entry dictionary from arffscan.scan_files
+    :param output: Output file opened in binary write/append mode
+    :param schema: Attribute declaration lines from arffschema.union_schema,
+        or None to copy the rows unchanged
+    :param chunk_size: Bytes copied per read
+    :param sparse_threshold: Write dense rows with at least this fraction of
+        numeric zeros as sparse rows (None keeps them as they are)
+    :param dedup: arffdedup.RowDeduplicator, or None to keep every row
+    :return: Number of bytes read and number of data rows written
+    """
+
+    header_lines = entry["header_lines"]
+    if dedup is not None:
+        removed = dedup.removed
+        result = remap_data(entry["path"], entry["data_offset"], output,
+                            header_lines, schema or header_lines, chunk_size,
+                            sparse_threshold, dedup)
+        entry["duplicates"] = dedup.removed - removed
+        return result
+    if schema is None:
+        return copy_data(entry["path"], entry["data_offset"], output, chunk_size)
+    mapping = column_map(header_lines, schema)
+    if sparse_threshold is None and \
+            is_identity(mapping, len(header_attributes(header_lines))) and \
+            not sparse_plan(header_lines, schema, mapping)[1]:
+        return copy_data(entry["path"], entry["data_offset"], output, chunk_size)
+    return remap_data(entry["path"], entry["data_offset"], output, header_lines,
+                      schema, chunk_size, sparse_threshold)
+
+
+def write_header(output, header_lines):
+    """
+    Writes header lines to an open output file
+
+    :param output: Output file opened in binary write mode
+    :param header_lines: Header lines to write, ending with the @data line
+    """
+
+    output.write("".join(header_lines).encode(ENCODING, ERRORS))
+
+
+def write_merged(output_path, header_lines, sources, chunk_size=CHUNK_SIZE,
+                 level=None):
+    """
+    Writes the header once, then streams every source's @data section after it
+
+    Only one chunk is held in memory at a time, so peak memory does not depend
+    on the number of files or rows merged.
+
+    :param output_path: Merged ARFF file path
+    :param header_lines: Header lines to write, ending with the @data line
+    :param sources: Iterable of (file path, data offset) pairs, in merge order
+    :param chunk_size: Bytes copied per read
+    :param level: Compression level of a .gz/.bz2/.xz output (see
+        arffio.open_arff)
+    :return: List of (bytes copied, data rows) pairs, one per source
+    """
+
+    with open_arff(output_path, "wb", level) as output:
+        write_header(output, header_lines)
+        return [copy_data(path, data_offset, output, chunk_size)
+                for path, data_offset in sources]
+
+
+def merge_arff(file_list, output_path, header_lines=None, chunk_size=CHUNK_SIZE,
+               level=None):
+    """
+    Merges ARFF files that share one header into a single ARFF file
+
+    :param file_list: ARFF file paths, in merge order
+    :param output_path: Merged ARFF file path
+    :param header_lines: Header to write; defaults to the first file's header
+    :param chunk_size: Bytes copied per read
+    :param level: Compression level of a .gz/.bz2/.xz output
+    :return: List of (bytes copied, data rows) pairs, one per file
+    """
+
+    sources = []
+    for name in file_list:
+        file_header, data_offset = read_header(name)
+        if header_lines is None:
+            header_lines = file_header
+        sources.append((name, data_offset))
+
+    if not sources:
+        raise ValueError("No ARFF files to merge")
+    return write_merged(output_path, header_lines, sources, chunk_size, level)
+
+
+def merge_incremental(file_list, output_path, cache, header_lines=None,
+                      rebuild=False, progress=None, schema=None,
+                      chunk_size=CHUNK_SIZE, sparse_threshold=None, level=None,
+                      dedup=None, entries=None):
+    """
+    Appends only the rows of new files to an existing merged ARFF file
+
+    The cache remembers which inputs (by path, size and mtime) went into the
+    output and the schema it was written with. If the output or any of those
+    inputs has changed or gone since, a new file brings a schema the output
+    has not seen, or the schema differs (e.g. another attribute selection),
+    the output is rebuilt from scratch instead. The output file itself is
+    never treated as an input.
+
+    :param file_list: ARFF file paths, in merge order
+    :param output_path: Merged ARFF file path
+    :param cache: Cache dictionary from arffscan.load_cache
+    :param header_lines: Header to write on a rebuild; defaults to the first
+        file's header
+    :param rebuild: Always rewrite the output from scratch
+    :param progress: Optional callback, called with each entry once its rows
+        have been written (with bytes_read and copy_seconds set, see
+        arfflog.MergeLog.file)
+    :param schema: Attribute declaration lines from arffschema.union_schema
+        to align every file's columns to by name, or None to copy rows as
+        they are
+    :param chunk_size: Bytes copied per read
+    :param sparse_threshold: Write dense rows with at least this fraction of
+        numeric zeros as sparse rows (needs a schema; None keeps them dense)
+    :param level: Compression level of a .gz/.bz2/.xz output (appending adds
+        a compressed stream to the file)
+    :param dedup: arffdedup.RowDeduplicator to drop repeated rows, or None;
+        when appending, it is first primed with the rows already merged
+    :param entries: Entries of file_list already scanned (e.g. by scan_files
+        across workers), so the headers are not looked up twice
+    :return: Entries of the files whose rows were written, and whether the
+        output was rebuilt
+    """
+
+    output_key = os.path.abspath(output_path)
+    if entries is None:
+        entries = scan_files(file_list, cache)
+    entries = [entry for entry in entries
+               if os.path.abspath(entry["path"])!=output_key]
+    if not entries:
+        raise ValueError("No ARFF files to merge")
+
+    # Check the previous merge is still intact before appending to it
+    record = cache["outputs"].get(output_key)
+    current = {os.path.abspath(entry["path"]): [entry["size"], entry["mtime_ns"]]
+               for entry in entries}
+    fingerprints = sorted({entry["fingerprint"] for entry in entries})
+    if not record or not os.path.exists(output_path) or \
+            not set(fingerprints)<=set(record["fingerprints"]) or \
+            record.get("schema")!=schema:
+        rebuild = True  # New schemas may need a different header
+    elif not rebuild:
+        _, size, mtime_ns = file_stamp(output_path)
+        rebuild = [size, mtime_ns]!=record["stamp"] or \
+            any(current.get(key)!=stamp for key, stamp in record["inputs"].items())
+
+    if rebuild:
+        new_entries = entries
+        mode = "wb"
+        inputs = {}
+    else:
+        new_entries = [entry for entry in entries
+                       if os.path.abspath(entry["path"]) not in record["inputs"]]
+        mode = "ab"
+        inputs = record["inputs"]
+
+    if dedup is not None and not rebuild:
+        _, data_offset = read_header(output_path)
+        dedup.prime(iter_data_rows(output_path, data_offset, chunk_size))
+
+    with open_arff(output_path, mode, level) as output:
+        if rebuild:
+            write_header(output, header_lines or entries[0]["header_lines"])
+        for entry in new_entries:
+            start = time.perf_counter()
+            copied, rows = copy_entry(entry, output, schema, chunk_size,
+                                      sparse_threshold, dedup)
+            entry["bytes_read"] = copied
+            entry["copy_seconds"] = time.perf_counter() - start
+            record_rows(entry, rows, cache)
+            inputs[os.path.abspath(entry["path"])] = [entry["size"],
+                                                      entry["mtime_ns"]]
+            if progress:
+                progress(entry)
+
+    _, size, mtime_ns = file_stamp(output_path)
+    if not rebuild:
+        fingerprints = record["fingerprints"]
+    cache["outputs"][output_key] = {"fingerprints": fingerprints,
+                                    "stamp": [size, mtime_ns], "inputs": inputs,
+                                    "schema": schema}
+    return new_entries, rebuild
+
+
+def group_key(entry):
+    """
+    Gets the schema signature files are grouped by
+
+    :param entry: Entry dictionary from arffscan.scan_files
+    :return: (attribute count, class set) pair, as used by the error reports
+    """
+
+    return entry["attribute_count"], entry["file_class"]
+
+
+def group_output_path(output_dir, base_name, key, suffix=ARFF_SUFFIX):
+    """
+    Builds the output path of one schema group
+
+    :param output_dir: Output directory
+    :param base_name: Merged filename without extension
+    :param key: Group key from group_key
+    :param suffix: Output extension, e.g. ".arff.gz" for compressed outputs
+    :return: Output file path
+    """
+
+    attribute_count, file_class = key
+    file_class = UNSAFE_NAME.sub("", file_class) or "no"
+    return os.path.join(output_dir, f"{base_name}_{attribute_count}-attribute_"
+                                    f"{file_class}-class{suffix}")
+
+
+def merge_groups(file_list, output_dir, base_name, cache=None, workers=1,
+                 progress=None, chunk_size=CHUNK_SIZE, sparse_threshold=None,
+                 suffix=ARFF_SUFFIX, level=None, dedup=None, select=None,
+                 entries=None):
+    """
+    Merges a mixed folder into one output per schema group in a single pass
+
+    Files are grouped by attribute count and class set from one header scan.
+    Every group's output is opened up front and each input is streamed into
+    its group's output as it comes, so the inputs are read once whatever the
+    number of groups. Within a group, columns are aligned by attribute name.
+    Previous group outputs found among the inputs are skipped.
+
+    :param file_list: ARFF file paths, in merge order
+    :param output_dir: Output directory
+    :param base_name: Merged filename without extension
+    :param cache: Cache dictionary from arffscan.load_cache, or None
+    :param workers: Number of processes used to scan the headers
+    :param progress: Optional callback, called with each entry once its rows
+        have been written
+    :param chunk_size: Bytes copied per read
+    :param sparse_threshold: Write dense rows with at least this fraction of
+        numeric zeros as sparse rows (None keeps them dense)
+    :param suffix: Output extension, e.g. ".arff.gz" for compressed outputs
+    :param level: Compression level of compressed outputs
+    :param dedup: arffdedup.RowDeduplicator to drop repeated rows, or None;
+        every group gets its own (see RowDeduplicator.fresh)
+    :param select: Names of the attributes to write (the class is always
+        written), or None to write every attribute
+    :param entries: Entries of file_list already scanned (e.g. by
+        merge_folder), so the headers are not looked up twice
+    :return: Dictionary of group key -> {"output": path, "entries": list,
+        "schema": attribute declaration lines written}, in first-seen order
+    """
+
+    groups = {}
+    members = []  # (entry, key) pairs in merge order
+    if entries is None:
+        entries = scan_files(file_list, cache, workers=workers)
+    for entry in entries:
+        key = group_key(entry)
+        output_path = group_output_path(output_dir, base_name, key, suffix)
+        if os.path.abspath(entry["path"])==os.path.abspath(output_path):
+            continue
+        groups.setdefault(key, {"output": output_path, "entries": []})
+        groups[key]["entries"].append(entry)
+        members.append((entry, key))
+    if not groups:
+        raise ValueError("No ARFF files to merge")
+
+    outputs = {}
+    schemas = {}
+    dedups = {key: dedup.fresh() if dedup else None for key in groups}
+    try:
+        for key, group in groups.items():
+            headers = [entry["header_lines"] for entry in group["entries"]]
+            schemas[key] = union_schema(headers)
+            if select is not None:
+                schemas[key] = select_schema(schemas[key], select)
+            group["schema"] = schemas[key]
+            outputs[key] = open_arff(group["output"], "wb", level)
+            write_header(outputs[key], schema_header(headers[0], schemas[key]))
+
+        for entry, key in members:
+            start = time.perf_counter()
+            copied, rows = copy_entry(entry, outputs[key], schemas[key],
+                                      chunk_size, sparse_threshold, dedups[key])
+            entry["bytes_read"] = copied
+            entry["copy_seconds"] = time.perf_counter() - start
+            record_rows(entry, rows, cache)
+            if progress:
+                progress(entry)
+    finally:
+        for output in outputs.values():
+            output.close()
+        for group_dedup in dedups.values():
+            if group_dedup:
+                group_dedup.close()
+    return groups
+
+
+def group_summary(groups):
+    """
+    Lists which input files went into which group output
+
+    :param groups: Dictionary returned by merge_groups
+    :return: Summary text
+    """
+
+    summary = ""
+    for (attribute_count, file_class), group in groups.items():
+        names = [os.path.basename(entry["path"]) for entry in group["entries"]]
+        summary += f"{os.path.basename(group['output'])} ({attribute_count}-" \
+                   f"attribute, {file_class}-class files):\n{str(names)[1:-1]}\n\n"
+    return summary
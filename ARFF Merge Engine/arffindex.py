@@ -0,0 +1,364 @@
+"""Row index sidecar for merged ARFF files: random, stratified and range subsets
+
+The index of data.arff is stored next to it as data.arff.index: one JSON line
+(file stamp, class values, per-class row counts) followed by three binary
+arrays: the byte offset of every data row, its class code, and the row
+numbers sorted by class. Subsets are then written by seeking straight to the
+chosen rows, so their cost depends on the subset size, not the file size.
+"""
+
+# Library imports
+from array import array
+import json
+import os
+import random
+import re
+import sys
+from arffio import open_arff
+from arffscan import CHUNK_SIZE, ENCODING, ERRORS, file_stamp, read_header
+from arffschema import CLASS_NAME, header_attributes, nominal_values, \
+    sparse_pairs, split_name, split_row
+
+# Constant definitions
+INDEX_SUFFIX = ".index"  # Appended to the data file path
+INDEX_VERSION = 1  # Bumped whenever the index layout changes
+OFFSET_TYPE = "q"  # array type of row offsets and row numbers (int64)
+LABEL_TYPE = "i"  # array type of class codes (int32)
+MISSING_LABEL = -1  # Class code of rows whose class is '?'
+DATA_ROW = re.compile(rb"^[ \t]*[^%\s][^\n]*", re.MULTILINE)  # One data row
+# (blank and % comment lines skipped)
+
+
+def index_path(data_path):
+    """
+    Gets the sidecar index path of a data file
+
+    :param data_path: ARFF file path
+    :return: Index file path
+    """
+
+    return data_path + INDEX_SUFFIX
+
+
+def class_column(header_lines):
+    """
+    Finds the class attribute of a header
+
+    :param header_lines: Header lines
+    :return: Column index (the attribute named class, else the last one),
+        number of attributes and the declared class values (unquoted, empty
+        if the class is not nominal)
+    """
+
+    attributes = header_attributes(header_lines)
+    if not attributes:
+        raise ValueError("Header declares no attributes")
+    names = [name.lower() for name, _ in attributes]
+    column = names.index(CLASS_NAME) if CLASS_NAME in names else len(names) - 1
+    values = nominal_values(split_name(attributes[column][1])[1]) or []
+    return column, len(attributes), [value.strip("'\"") for value in values]
+
+
+class RowIndex:
+    """Byte offsets and class labels of the data rows of one ARFF file"""
+
+    def __init__(self, data_path, header_lines, classes):
+        """
+        Creates an empty index
+
+        :param data_path: ARFF file path
+        :param header_lines: Header lines of the file
+        :param classes: Class values, in code order
+        """
+
+        self.data_path = data_path
+        self.header_lines = header_lines
+        self.classes = list(classes)
+        self.codes = {value: code for code, value in enumerate(self.classes)}
+        self.offsets = array(OFFSET_TYPE)
+        self.labels = array(LABEL_TYPE)
+        self.by_class = array(OFFSET_TYPE)
+        self.counts = [0] * len(self.classes)
+        self.scanned = 0  # Uncompressed bytes of the file covered
+        self.stamp = None  # [size, mtime_ns] of the file when indexed
+
+    @property
+    def rows(self):
+        """Number of indexed data rows"""
+
+        return len(self.offsets)
+
+    def label_code(self, value):
+        """
+        Gets the code of a class value, adding values not declared
+
+        :param value: Class value bytes (quotes kept)
+        :return: Class code
+        """
+
+        value = value.strip().decode(ENCODING, ERRORS).strip("'\"")
+        if value=="?":
+            return MISSING_LABEL
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.classes)
+            self.classes.append(value)
+            self.counts.append(0)
+        return code
+
+    def scan(self, start):
+        """
+        Indexes the data rows from a byte offset to the end of the file
+
+        :param start: Uncompressed byte offset of the first row to index
+        """
+
+        column, width, _ = class_column(self.header_lines)
+        last = column==width - 1
+        default = b"0"
+        nominal = nominal_values(split_name(header_attributes(
+            self.header_lines)[column][1])[1])
+        if nominal:
+            default = nominal[0].encode(ENCODING, ERRORS)
+
+        first = len(self.labels)
+        position = start  # File offset of the current block
+        tail = b""
+        with open_arff(self.data_path) as arff:
+            arff.seek(start)
+            for chunk in iter(lambda: arff.read(CHUNK_SIZE), b""):
+                block = tail + chunk
+                cut = block.rfind(b"\n") + 1
+                for match in DATA_ROW.finditer(block, 0, cut):
+                    line = match.group().strip()
+                    if line.startswith(b"{"):
+                        value = dict(sparse_pairs(line, width)).get(column,
+                                                                     default)
+                    elif last:
+                        value = line.rpartition(b",")[2]
+                    else:
+                        value = split_row(line, width)[column]
+                    self.offsets.append(position + match.start())
+                    self.labels.append(self.label_code(value))
+                tail = block[cut:]
+                position += cut
+            if tail.strip():
+                self.scan_tail(tail, position, column, width, default)
+            self.scanned = arff.tell()
+
+        for code in self.labels[first:]:
+            if code!=MISSING_LABEL:
+                self.counts[code] += 1
+        self.sort_by_class()
+
+    def scan_tail(self, tail, position, column, width, default):
+        """
+        Indexes a last row that has no line terminator
+
+        :param tail: Row bytes
+        :param position: File offset of the row
+        :param column: Class column index
+        :param width: Number of attributes
+        :param default: Class value of sparse rows that leave it out
+        """
+
+        line = tail.strip()
+        if line.startswith(b"%"):
+            return
+        if line.startswith(b"{"):
+            value = dict(sparse_pairs(line, width)).get(column, default)
+        else:
+            value = split_row(line, width)[column]
+        self.offsets.append(position)
+        self.labels.append(self.label_code(value))
+
+    def sort_by_class(self):
+        """Lists the row numbers grouped by class code (rows with '?' last)"""
+
+        order = sorted(range(len(self.labels)),
+                       key=lambda row: (self.labels[row]==MISSING_LABEL,
+                                        self.labels[row]))
+        self.by_class = array(OFFSET_TYPE, order)
+
+    def class_rows(self, code):
+        """
+        Gets the row numbers of one class
+
+        :param code: Class code
+        :return: Slice of the by-class row list, in file order
+        """
+
+        start = sum(self.counts[:code])
+        return self.by_class[start:start + self.counts[code]]
+
+    def save(self, path=None):
+        """
+        Writes the index file
+
+        :param path: Index file path (default: next to the data file)
+        """
+
+        path = path or index_path(self.data_path)
+        header = {"version": INDEX_VERSION, "byteorder": sys.byteorder,
+                  "stamp": self.stamp, "scanned": self.scanned,
+                  "rows": self.rows, "classes": self.classes,
+                  "counts": self.counts}
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as index_file:
+            index_file.write(json.dumps(header).encode(ENCODING) + b"\n")
+            self.offsets.tofile(index_file)
+            self.labels.tofile(index_file)
+            self.by_class.tofile(index_file)
+        os.replace(temp_path, path)
+
+
+def build_index(data_path, path=None, update=False):
+    """
+    Indexes the data rows of an ARFF file and saves the sidecar index
+
+    :param data_path: ARFF file path (plain or compressed)
+    :param path: Index file path (default: next to the data file)
+    :param update: Only scan the rows appended since the saved index was
+        built (as after an incremental merge); falls back to a full scan if
+        there is no usable index
+    :return: RowIndex
+    """
+
+    index = None
+    if update:
+        try:
+            index = load_index(data_path, path, check=False)
+        except (OSError, ValueError):
+            index = None
+    if index is None:
+        header_lines, data_offset = read_header(data_path)
+        index = RowIndex(data_path, header_lines,
+                         class_column(header_lines)[2])
+        index.scan(data_offset)
+    else:
+        index.scan(index.scanned)
+
+    _, size, mtime_ns = file_stamp(data_path)
+    index.stamp = [size, mtime_ns]
+    index.save(path)
+    return index
+
+
+def load_index(data_path, path=None, check=True):
+    """
+    Loads the sidecar index of an ARFF file
+
+    :param data_path: ARFF file path
+    :param path: Index file path (default: next to the data file)
+    :param check: Refuse an index older than the data file
+    :return: RowIndex
+    """
+
+    path = path or index_path(data_path)
+    with open(path, "rb") as index_file:
+        header = json.loads(index_file.readline())
+        if header.get("version")!=INDEX_VERSION:
+            raise ValueError(f"{path} is not a version {INDEX_VERSION} index")
+        _, size, mtime_ns = file_stamp(data_path)
+        if check and header["stamp"]!=[size, mtime_ns]:
+            raise ValueError(f"{path} is out of date, rebuild it")
+
+        header_lines, _ = read_header(data_path)
+        index = RowIndex(data_path, header_lines, header["classes"])
+        index.counts = header["counts"]
+        index.scanned = header["scanned"]
+        index.stamp = header["stamp"]
+        for values in (index.offsets, index.labels, index.by_class):
+            values.fromfile(index_file, header["rows"])
+            if header["byteorder"]!=sys.byteorder:
+                values.byteswap()
+    return index
+
+
+def range_rows(index, start, stop=None):
+    """
+    Picks a contiguous slice of rows
+
+    :param index: RowIndex
+    :param start: First row number
+    :param stop: Row number after the last one (default: end of the file)
+    :return: List of row numbers
+    """
+
+    return list(range(*slice(start, stop).indices(index.rows)))
+
+
+def random_rows(index, count=None, fraction=None, seed=None):
+    """
+    Picks rows uniformly at random
+
+    :param index: RowIndex
+    :param count: Number of rows
+    :param fraction: Fraction of the rows (used if count is None)
+    :param seed: Random seed, for repeatable subsets
+    :return: Sorted list of row numbers
+    """
+
+    if count is None:
+        count = round(index.rows * fraction)
+    return sorted(random.Random(seed).sample(range(index.rows),
+                                             min(count, index.rows)))
+
+
+def stratified_rows(index, count=None, fraction=None, balanced=True,
+                    seed=None):
+    """
+    Picks rows class by class
+
+    :param index: RowIndex
+    :param count: Number of rows in total
+    :param fraction: Fraction of the rows (used if count is None)
+    :param balanced: Take the same number of rows from every class (as far
+        as each class has rows); otherwise keep the class proportions
+    :param seed: Random seed, for repeatable subsets
+    :return: Sorted list of row numbers (rows with a missing class are left
+        out)
+    """
+
+    if count is None:
+        count = round(index.rows * fraction)
+    generator = random.Random(seed)
+    classes = [code for code, rows in enumerate(index.counts) if rows]
+    labelled = sum(index.counts)
+    chosen = []
+    for position, code in enumerate(classes):
+        if balanced:
+            wanted = count // len(classes) + (position<count % len(classes))
+        else:
+            wanted = round(count * index.counts[code] / labelled)
+        rows = index.class_rows(code)
+        chosen += generator.sample(rows, min(wanted, len(rows)))
+    return sorted(chosen)
+
+
+def write_subset(index, rows, output_path, level=None):
+    """
+    Writes the chosen rows, with the data file's header, to a new ARFF file
+
+    Rows are read in file order by seeking to their offsets; consecutive rows
+    are read without seeking.
+
+    :param index: RowIndex
+    :param rows: Sorted row numbers
+    :param output_path: Subset ARFF file path (.gz/.bz2/.xz to compress)
+    :param level: Compression level of a compressed output
+    :return: Number of rows written
+    """
+
+    position = -1
+    with open_arff(index.data_path) as arff, \
+            open_arff(output_path, "wb", level) as output:
+        output.write("".join(index.header_lines).encode(ENCODING, ERRORS))
+        for row in rows:
+            offset = index.offsets[row]
+            if offset!=position:
+                arff.seek(offset)
+            line = arff.readline()
+            position = offset + len(line)
+            output.write(line.rstrip(b"\r\n") + b"\n")
+    return len(rows)
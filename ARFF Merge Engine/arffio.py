@@ -0,0 +1,72 @@
+"""Plain and compressed (.arff.gz, .arff.bz2, .arff.xz) ARFF file access"""
+
+# Library imports
+import bz2
+import glob
+import gzip
+import lzma
+import os
+
+# Constant definitions
+ARFF_SUFFIX = ".arff"  # Extension of plain ARFF files
+CODECS = {".gz": gzip, ".bz2": bz2, ".xz": lzma}  # Compressed file extension
+# -> standard library module that streams it
+DEFAULT_LEVELS = {".gz": 6, ".bz2": 9, ".xz": 6}  # Output compression levels
+# (gzip 6 is several times faster than its maximum for a slightly larger file)
+ARFF_PATTERNS = ["*" + ARFF_SUFFIX] + ["*" + ARFF_SUFFIX + suffix
+                                       for suffix in CODECS]  # Input filenames
+
+
+def compression(path):
+    """
+    Gets the compression suffix of a file
+
+    :param path: File path
+    :return: ".gz", ".bz2", ".xz", or "" for an uncompressed file
+    """
+
+    suffix = os.path.splitext(path)[1].lower()
+    return suffix if suffix in CODECS else ""
+
+
+def open_arff(path, mode="rb", level=None):
+    """
+    Opens a plain or compressed ARFF file as a binary stream
+
+    Compressed files are decompressed (or compressed) on the fly, so nothing
+    is written to temporary files and reading can stop anywhere, e.g. at the
+    @data line. seek() and tell() count uncompressed bytes; seeking forward
+    in a compressed file decompresses up to the target.
+
+    :param path: File path; the extension selects the codec
+    :param mode: "rb", "wb" or "ab" (appending adds a new compressed stream,
+        which every codec reads back as one file)
+    :param level: Compression level for writing (gzip/bz2 1-9, xz 0-9);
+        defaults to DEFAULT_LEVELS
+    :return: Binary file object
+    """
+
+    suffix = compression(path)
+    if not suffix:
+        return open(path, mode)
+    if mode=="rb":
+        return CODECS[suffix].open(path, mode)
+    if level is None:
+        level = DEFAULT_LEVELS[suffix]
+    if suffix==".xz":
+        return lzma.open(path, mode, preset=level)
+    return CODECS[suffix].open(path, mode, compresslevel=level)
+
+
+def find_arff(folder):
+    """
+    Lists the plain and compressed ARFF files of a folder
+
+    :param folder: Folder path
+    :return: File paths, plain .arff files first
+    """
+
+    file_list = []
+    for pattern in ARFF_PATTERNS:
+        file_list += glob.glob(os.path.join(folder, pattern))
+    return file_list
@@ -0,0 +1,247 @@
+"""Buffered JSON Lines merge log with per-file throughput metrics
+
+Every merged file gets one record with the bytes read, rows written and the
+time spent scanning its header and copying its data; every run ends with a
+totals record (wall time, MB/s, peak memory). Records are kept in memory and
+written with one open() per flush, so logging does not add a file open per
+merged file on slow storage. The text logs of the front ends are generated
+from the same records.
+"""
+
+# Library imports
+import datetime
+import json
+import os
+import sys
+import time
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Constant definitions
+FLUSH_RECORDS = 1000  # Records buffered before they are written out
+MEGABYTE = 1024 * 1024  # Bytes per MB in the metrics
+
+
+def peak_rss():
+    """
+    Gets the peak resident memory of this process and of its finished child
+    processes (e.g. header scan workers)
+
+    :return: Peak bytes of this process and of the largest child, None
+        where the platform does not report it
+    """
+
+    if resource is not None:
+        scale = 1 if sys.platform=="darwin" else 1024  # ru_maxrss is in KB
+        # on Linux, in bytes on macOS
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + \
+                [(name, ctypes.c_size_t) for name in (
+                    "PeakWorkingSetSize", "WorkingSetSize",
+                    "QuotaPeakPagedPoolUsage", "QuotaPagedPoolUsage",
+                    "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                    "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = Counters(cb=ctypes.sizeof(Counters))
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters),
+            counters.cb)
+        return counters.PeakWorkingSetSize, None
+    except (AttributeError, OSError):
+        return None, None
+
+
+def rate(size, seconds):
+    """
+    Computes a throughput
+
+    :param size: Bytes
+    :param seconds: Elapsed time
+    :return: MB/s, or None if no time was measured
+    """
+
+    return round(size / MEGABYTE / seconds, 3) if seconds>0 else None
+
+
+class MergeLog:
+    """Buffered log of one merge run"""
+
+    def __init__(self, path=None, flush_records=FLUSH_RECORDS, **fields):
+        """
+        Starts a run
+
+        :param path: JSON Lines file the records are appended to, or None to
+            only keep them in memory
+        :param flush_records: Records buffered before they are written
+        :param fields: Extra fields of the "start" record (e.g. the options)
+        """
+
+        self.path = path
+        self.flush_records = flush_records
+        self.records = []  # Every record of the run, for the text summaries
+        self.written = 0  # Records already written to path
+        self.started = time.perf_counter()
+        self.run = None  # Totals record, once the run is finished
+        self.record("start", pid=os.getpid(), **fields)
+
+    def record(self, event, **fields):
+        """
+        Adds a record
+
+        :param event: Record type: "start", "file", "note", "error" or "run"
+        :param fields: Record fields (JSON serializable)
+        :return: Record dictionary
+        """
+
+        record = {"event": event,
+                  "time": datetime.datetime.now().isoformat(timespec="milliseconds")}
+        record.update(fields)
+        self.records.append(record)
+        if len(self.records) - self.written>=self.flush_records:
+            self.flush()
+        return record
+
+    def file(self, entry):
+        """
+        Records a merged file; usable as the progress callback of the engine
+
+        :param entry: Entry dictionary after its rows were written
+        :return: Record dictionary
+        """
+
+        scan_seconds = entry.get("scan_seconds", 0.0)
+        copy_seconds = entry.get("copy_seconds", 0.0)
+        bytes_read = entry.get("bytes_read", 0)
+        fields = {"path": entry["path"], "size": entry["size"],
+                  "bytes_read": bytes_read, "rows": entry.get("rows"),
+                  "cached_header": "scan_seconds" not in entry,
+                  "scan_seconds": round(scan_seconds, 6),
+                  "copy_seconds": round(copy_seconds, 6),
+                  "mb_per_s": rate(bytes_read, copy_seconds)}
+        if "duplicates" in entry:
+            fields["duplicates"] = entry["duplicates"]
+        return self.record("file", **fields)
+
+    def note(self, text, **fields):
+        """
+        Records a free-text message (e.g. where an extra output was saved)
+
+        :param text: Message
+        :param fields: Extra fields
+        :return: Record dictionary
+        """
+
+        return self.record("note", text=text, **fields)
+
+    def error(self, message):
+        """
+        Records why the merge stopped
+
+        :param message: Error message
+        :return: Record dictionary
+        """
+
+        return self.record("error", message=message)
+
+    def records_of(self, event):
+        """
+        Lists the records of one type
+
+        :param event: Record type
+        :return: List of record dictionaries
+        """
+
+        return [record for record in self.records if record["event"]==event]
+
+    def finish(self, **fields):
+        """
+        Records the run totals and writes the remaining records
+
+        :param fields: Extra fields of the "run" record
+        :return: Totals record
+        """
+
+        files = self.records_of("file")
+        bytes_read = sum(record["bytes_read"] for record in files)
+        wall_seconds = time.perf_counter() - self.started
+        peak, child_peak = peak_rss()
+        totals = {"status": "error" if self.records_of("error") else "ok",
+                  "files": len(files),
+                  "cached_headers": sum(record["cached_header"]
+                                        for record in files),
+                  "bytes_read": bytes_read,
+                  "rows": sum(record["rows"] or 0 for record in files),
+                  "scan_seconds": round(sum(record["scan_seconds"]
+                                            for record in files), 6),
+                  "copy_seconds": round(sum(record["copy_seconds"]
+                                            for record in files), 6),
+                  "wall_seconds": round(wall_seconds, 6),
+                  "mb_per_s": rate(bytes_read, wall_seconds),
+                  "peak_rss_bytes": peak, "peak_child_rss_bytes": child_peak}
+        if any("duplicates" in record for record in files):
+            totals["duplicates"] = sum(record.get("duplicates", 0)
+                                       for record in files)
+        totals.update(fields)
+        self.run = self.record("run", **totals)
+        self.flush()
+        return self.run
+
+    def flush(self):
+        """Appends the records not written yet to the JSON Lines file"""
+
+        if self.path is None or self.written==len(self.records):
+            return
+        lines = [json.dumps(record) + "\n"
+                 for record in self.records[self.written:]]
+        with open(self.path, "a", encoding="utf-8") as log_file:
+            log_file.writelines(lines)
+        self.written = len(self.records)
+
+
+def format_file(record):
+    """
+    Formats a "file" record for a text log
+
+    :param record: Record dictionary
+    :return: Text lines
+    """
+
+    text = f"File {record['path']} has merged. Time: {record['time']}\n" \
+           f"    {record['rows']} rows, {record['bytes_read'] / MEGABYTE:.1f} MB " \
+           f"copied in {record['copy_seconds']:.3f} s"
+    if record["mb_per_s"] is not None:
+        text += f" ({record['mb_per_s']:.1f} MB/s)"
+    text += ", header " + ("from cache" if record["cached_header"] else
+                           f"read in {record['scan_seconds']:.3f} s") + "\n"
+    if "duplicates" in record:
+        text += f"    {record['duplicates']} duplicate rows removed\n"
+    return text
+
+
+def format_run(record):
+    """
+    Formats a "run" record for a text log
+
+    :param record: Record dictionary
+    :return: Text lines
+    """
+
+    text = f"{record['files']} files, {record['rows']} rows, " \
+           f"{record['bytes_read'] / MEGABYTE:.1f} MB in " \
+           f"{record['wall_seconds']:.2f} s"
+    if record["mb_per_s"] is not None:
+        text += f" ({record['mb_per_s']:.1f} MB/s)"
+    text += f"; header scan {record['scan_seconds']:.2f} s " \
+            f"({record['cached_headers']} from cache), copy " \
+            f"{record['copy_seconds']:.2f} s"
+    if record["peak_rss_bytes"] is not None:
+        text += f"; peak memory {record['peak_rss_bytes'] / MEGABYTE:.0f} MB"
+    return text + "\n"
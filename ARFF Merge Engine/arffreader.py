@@ -0,0 +1,459 @@
+"""Vectorized ARFF reader: parses @data sections in large chunks into NumPy arrays
+
+Headers are read with the same rules as the merge (arffscan.read_header and
+arffschema.header_attributes). The @data section is read CHUNK_SIZE bytes at a
+time and every chunk is converted column-wise: all numeric values of a chunk
+by one call to NumPy's C number parser, nominal columns through np.unique,
+instead of splitting and converting row by row in Python. The file is read
+once; the chunks' arrays are joined at the end.
+"""
+
+# Library imports
+import warnings
+import numpy as np
+from arffio import open_arff
+from arffscan import CHUNK_SIZE, ENCODING, ERRORS, read_header
+from arffschema import NUMERIC_TYPES, header_attributes, nominal_values, \
+    sparse_defaults, split_name, split_row
+
+# Constant definitions
+BATCH_ROWS = 65536  # Rows per batch yielded by ArffReader.batches
+MISSING_TEXT = b"?"  # ARFF missing value
+MISSING_CODE = -1  # Code stored for a missing nominal/string value
+SLOW_PATH_BYTES = (b"%", b"{")  # Bytes that need the row by row parser
+# (comment lines, sparse rows)
+
+
+def unquote(value):
+    """
+    Removes the ARFF quotes around a value
+
+    :param value: Value text
+    :return: Unquoted value text
+    """
+
+    if len(value)>=2 and value[0]==value[-1] and value[0] in ("'", '"'):
+        return value[1:-1].replace("\\" + value[0], value[0])
+    return value
+
+
+def describe_attributes(header_lines, float_dtype="float64"):
+    """
+    Describes how every attribute of a header is converted
+
+    :param header_lines: Header lines, or attribute declaration lines
+    :param float_dtype: NumPy float type for numeric attributes
+    :return: List of attribute dictionaries with name, declaration, kind
+        (numeric, nominal or string), dtype and, for nominal and string
+        attributes, the list of values the codes refer to
+    """
+
+    attributes = []
+    for name, declaration in header_attributes(header_lines):
+        _, kind = split_name(declaration)
+        values = nominal_values(kind)
+        attribute = {"name": name, "declaration": declaration.strip()}
+        if values is not None:
+            values = [unquote(value) for value in values]
+            attribute.update(kind="nominal", values=values,
+                             dtype=np.min_scalar_type(-len(values)).name)
+        elif kind.split()[0].lower() in NUMERIC_TYPES:
+            attribute.update(kind="numeric", dtype=np.dtype(float_dtype).name)
+        else:  # string and date attributes are dictionary encoded as well
+            attribute.update(kind="string", values=[], dtype="int32")
+        attributes.append(attribute)
+    return attributes
+
+
+def value_edges(block, width):
+    """
+    Locates every value of a block of plain data lines
+
+    Commas and newlines are found with two vectorized comparisons; the block
+    is accepted when every row has exactly width - 1 commas (the same rule as
+    arffschema.split_row).
+
+    :param block: Data bytes ending with a newline, without carriage returns
+    :param width: Number of attributes
+    :return: Block as a uint8 array and an edge array of shape
+        (rows, width + 1): value j of a row lies between edges j and j + 1
+        (exclusive). None if the block needs the row by row parser
+        (comments, blank lines, sparse or badly formed rows)
+    """
+
+    if any(special in block for special in SLOW_PATH_BYTES) or \
+            block.startswith(b"\n") or b"\n\n" in block:
+        return None
+    data = np.frombuffer(block, dtype=np.uint8)
+    newlines = np.flatnonzero(data==ord("\n"))
+    commas = np.flatnonzero(data==ord(","))
+    rows = len(newlines)
+    if len(commas)!=rows * (width - 1) or np.any(
+            np.searchsorted(commas, newlines)!=
+            np.arange(1, rows + 1) * (width - 1)):
+        return None
+
+    edges = np.empty((rows, width + 1), dtype=np.int64)
+    edges[0, 0] = -1
+    edges[1:, 0] = newlines[:-1]
+    edges[:, 1:width] = commas.reshape(rows, width - 1)
+    edges[:, width] = newlines
+    return data, edges
+
+
+def slice_column(data, edges, column):
+    """
+    Cuts one column of values out of a block without a Python loop
+
+    :param data: Block as a uint8 array, from value_edges
+    :param edges: Edge array from value_edges
+    :param column: Column index
+    :return: NumPy bytes array of the column's values (spaces kept)
+    """
+
+    starts = edges[:, column] + 1
+    lengths = edges[:, column + 1] - starts
+    size = max(int(lengths.max(initial=0)), 1)
+    offsets = np.arange(size)
+    index = np.minimum(starts[:, None] + offsets, len(data) - 1)
+    gathered = np.where(offsets<lengths[:, None], data[index], 0)
+    return gathered.astype(np.uint8).view(f"S{size}").reshape(-1)
+
+
+def parse_numeric(data, edges, blank, dtype):
+    """
+    Parses every numeric value of a plain block with one conversion
+
+    The values of the other columns are overwritten by 0 in a copy of the
+    block, newlines become commas and '?' becomes nan, so the whole block is
+    one comma-separated list of numbers for np.fromstring's C parser.
+
+    :param data: Block as a uint8 array, from value_edges
+    :param edges: Edge array from value_edges
+    :param blank: File columns that are not numeric
+    :param dtype: NumPy float type
+    :return: Array of shape (rows, width), or None if a numeric column holds
+        something other than a number (decode then reports it)
+    """
+
+    rows, width = len(edges), edges.shape[1] - 1
+    text = data.copy()
+    for column in blank:
+        starts = edges[:, column] + 1
+        lengths = edges[:, column + 1] - starts
+        if lengths.min(initial=1)<1:  # Empty value: no room for the 0
+            return None
+        text[starts] = ord("0")
+        rest = lengths - 1
+        if rest.any():  # Spaces over the remaining bytes of every value
+            firsts = np.repeat(starts + 1, rest)
+            steps = np.arange(len(firsts)) - np.repeat(np.cumsum(rest) - rest,
+                                                       rest)
+            text[firsts + steps] = ord(" ")
+    text[edges[:, width]] = ord(",")
+    with warnings.catch_warnings():  # Older NumPy only warns on a bad value
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            values = np.fromstring(text.tobytes().replace(MISSING_TEXT, b"nan"),
+                                   dtype=dtype, sep=",")
+        except (ValueError, DeprecationWarning):
+            return None
+    if len(values)!=rows * width:
+        return None
+    return values.reshape(rows, width)
+
+
+def split_rows(block, width, path="", defaults=None):
+    """
+    Splits a block of data lines row by row into a 2D array of value tokens
+
+    :param block: Data bytes ending with a newline
+    :param width: Number of attributes
+    :param path: File path used in error messages
+    :param defaults: Values of the entries sparse rows leave out (see
+        arffschema.sparse_defaults)
+    :return: NumPy bytes array of shape (rows, width), sparse rows expanded
+    """
+
+    rows = []
+    for line in block.split(b"\n"):
+        line = line.strip()
+        if not line or line.startswith(b"%"):
+            continue
+        try:
+            rows.append(split_row(line, width, defaults))
+        except ValueError as error:
+            raise ValueError(f"File {path}: {error}") from None
+    if not rows:
+        return np.empty((0, width), dtype="S1")
+    return np.array(rows)
+
+
+def iter_blocks(path, data_offset, chunk_size=CHUNK_SIZE):
+    """
+    Yields the @data section of an ARFF file in blocks of complete lines
+
+    :param path: ARFF file path
+    :param data_offset: Byte offset of the first data row
+    :param chunk_size: Bytes read at a time
+    :return: Generator of newline-terminated bytes blocks, carriage returns
+        removed
+    """
+
+    tail = b""  # Partial line carried over to the next chunk
+    with open_arff(path) as arff:
+        arff.seek(data_offset)
+        for chunk in iter(lambda: arff.read(chunk_size), b""):
+            cut = chunk.rfind(b"\n") + 1
+            if not cut:
+                tail += chunk
+                continue
+            yield (tail + chunk[:cut]).replace(b"\r", b"")
+            tail = chunk[cut:]
+    if tail.strip():
+        yield tail.replace(b"\r", b"") + b"\n"
+
+
+class ArffDecoder:
+    """Converts columns of value tokens into typed arrays"""
+
+    def __init__(self, attributes):
+        """
+        Prepares the code lookups of every attribute
+
+        :param attributes: Attribute dictionaries from describe_attributes;
+            the values lists of string attributes grow as values are seen
+        """
+
+        self.attributes = attributes
+        self.lookups = [{value: code for code, value in
+                         enumerate(attribute.get("values", []))}
+                        for attribute in attributes]
+
+    def allocate(self, rows):
+        """
+        Allocates one empty array per attribute
+
+        :param rows: Array length
+        :return: Dictionary of attribute name -> array
+        """
+
+        return {attribute["name"]: np.empty(rows, dtype=attribute["dtype"])
+                for attribute in self.attributes}
+
+    def decode(self, index, tokens):
+        """
+        Converts one column of value tokens
+
+        :param index: Attribute index
+        :param tokens: NumPy bytes array of the column's values
+        :return: Float array ('?' as NaN) for numeric attributes, integer
+            code array (MISSING_CODE for '?') otherwise
+        """
+
+        attribute = self.attributes[index]
+        if attribute["kind"]=="numeric":
+            try:
+                return np.where(tokens==MISSING_TEXT, b"nan",
+                                tokens).astype(attribute["dtype"])
+            except ValueError:  # Values with spaces around them, or bad values
+                tokens = np.char.strip(tokens)
+                try:
+                    return np.where(tokens==MISSING_TEXT, b"nan",
+                                    tokens).astype(attribute["dtype"])
+                except ValueError as error:
+                    raise ValueError(f"Attribute {attribute['name']}: "
+                                     f"{error}") from None
+
+        # Look each distinct value up once, then broadcast through the inverse
+        distinct, inverse = np.unique(tokens, return_inverse=True)
+        lookup = self.lookups[index]
+        codes = np.empty(len(distinct), dtype=np.int64)
+        for position, raw in enumerate(distinct):
+            value = unquote(raw.strip().decode(ENCODING, ERRORS))
+            if value==MISSING_TEXT.decode():
+                codes[position] = MISSING_CODE
+                continue
+            if value not in lookup:
+                if attribute["kind"]=="nominal":
+                    raise ValueError(f"Value {value} is not declared for "
+                                     f"attribute {attribute['name']}")
+                lookup[value] = len(attribute["values"])
+                attribute["values"].append(value)
+            codes[position] = lookup[value]
+        return codes[inverse.reshape(-1)].astype(attribute["dtype"])
+
+    def missing(self, index, rows):
+        """
+        Builds the column of an attribute a file lacks
+
+        :param index: Attribute index
+        :param rows: Array length
+        :return: Array of NaN or MISSING_CODE
+        """
+
+        attribute = self.attributes[index]
+        fill = np.nan if attribute["kind"]=="numeric" else MISSING_CODE
+        return np.full(rows, fill, dtype=attribute["dtype"])
+
+    def decode_block(self, block, width, columns=None, path="", defaults=None):
+        """
+        Converts a block of data lines into one array per attribute
+
+        Numeric columns of plain blocks are parsed straight from the bytes in
+        one conversion (see parse_numeric); nominal and string columns are cut
+        out of the block by their value edges. Other blocks, including sparse
+        rows, are split row by row.
+
+        :param block: Block from iter_blocks
+        :param width: Number of attributes the file declares
+        :param columns: For every decoder attribute, the file column holding
+            it, or width where the file lacks it (default: same order, see
+            arffschema.column_map)
+        :param path: File path used in error messages
+        :param defaults: Values of the entries sparse rows leave out, per file
+            column (see arffschema.sparse_defaults)
+        :return: Dictionary of attribute name -> array
+        """
+
+        if columns is None:
+            columns = range(len(self.attributes))
+        tokens = None
+        located = value_edges(block, width)
+        if located is None:
+            tokens = split_rows(block, width, path, defaults)
+            rows = len(tokens)
+        else:
+            data, edges = located
+            rows = len(edges)
+
+        arrays = {}
+        numeric = [(index, column) for index, column in enumerate(columns)
+                   if column<width and self.attributes[index]["kind"]=="numeric"]
+        if located is not None and numeric:
+            numeric_columns = {column for _, column in numeric}
+            parsed = parse_numeric(data, edges, [column for column in range(width)
+                                                 if column not in numeric_columns],
+                                   self.attributes[numeric[0][0]]["dtype"])
+            if parsed is not None:
+                for index, column in numeric:
+                    arrays[self.attributes[index]["name"]] = parsed[:, column]
+
+        for index, column in enumerate(columns):
+            name = self.attributes[index]["name"]
+            if name in arrays:
+                continue
+            if column>=width:
+                arrays[name] = self.missing(index, rows)
+            elif tokens is not None:
+                arrays[name] = self.decode(index, tokens[:, column])
+            else:
+                arrays[name] = self.decode(index, slice_column(data, edges, column))
+        return arrays
+
+
+class ArffReader:
+    """Reads the @data section of one ARFF file into NumPy arrays"""
+
+    def __init__(self, path, float_dtype="float64", chunk_size=CHUNK_SIZE):
+        """
+        Reads the header of an ARFF file
+
+        :param path: ARFF file path
+        :param float_dtype: NumPy float type for numeric attributes
+            ("float32" halves the memory)
+        :param chunk_size: Bytes read at a time
+        """
+
+        self.path = path
+        self.chunk_size = chunk_size
+        self.header_lines, self.data_offset = read_header(path)
+        self.decoder = ArffDecoder(describe_attributes(self.header_lines,
+                                                       float_dtype))
+        self.attributes = self.decoder.attributes
+        self.defaults = sparse_defaults(self.header_lines)
+        self.names = [attribute["name"] for attribute in self.attributes]
+
+    def batches(self, batch_rows=BATCH_ROWS):
+        """
+        Yields the data in fixed-size row batches, for files larger than memory
+
+        :param batch_rows: Rows per batch (the last batch may be shorter)
+        :return: Generator of dictionaries of attribute name -> array
+        """
+
+        arrays = self.decoder.allocate(batch_rows)
+        filled = 0
+        width = len(self.attributes)
+        for decoded in self.blocks():
+            rows = len(decoded[self.names[0]]) if width else 0
+            start = 0
+            while start<rows:
+                take = min(batch_rows - filled, rows - start)
+                for name in self.names:
+                    arrays[name][filled:filled + take] = \
+                        decoded[name][start:start + take]
+                filled += take
+                start += take
+                if filled==batch_rows:
+                    yield arrays
+                    arrays = self.decoder.allocate(batch_rows)
+                    filled = 0
+        if filled:
+            yield {name: array[:filled] for name, array in arrays.items()}
+
+    def blocks(self):
+        """
+        Yields the data chunk by chunk, as the chunks come
+
+        :return: Generator of dictionaries of attribute name -> array
+        """
+
+        width = len(self.attributes)
+        for block in iter_blocks(self.path, self.data_offset, self.chunk_size):
+            yield self.decoder.decode_block(block, width, path=self.path,
+                                            defaults=self.defaults)
+
+    def read(self):
+        """
+        Reads the whole data section
+
+        The file is read once and the arrays of its chunks are joined at the
+        end, so no pass is spent counting the rows first.
+
+        :return: Dictionary of attribute name -> array
+        """
+
+        parts = list(self.blocks())
+        if not parts:
+            return self.decoder.allocate(0)
+        return {name: np.concatenate([part[name] for part in parts])
+                for name in self.names}
+
+
+def read_arff(path, float_dtype="float64"):
+    """
+    Reads a dense or sparse ARFF file into NumPy arrays
+
+    :param path: ARFF file path
+    :param float_dtype: NumPy float type for numeric attributes
+    :return: Attribute dictionaries (see describe_attributes) and a dictionary
+        of attribute name -> array
+    """
+
+    reader = ArffReader(path, float_dtype)
+    columns = reader.read()
+    return reader.attributes, columns
+
+
+def iter_arff_batches(path, batch_rows=BATCH_ROWS, float_dtype="float64"):
+    """
+    Reads an ARFF file in fixed-size row batches
+
+    :param path: ARFF file path
+    :param batch_rows: Rows per batch
+    :param float_dtype: NumPy float type for numeric attributes
+    :return: Generator of dictionaries of attribute name -> array
+    """
+
+    return ArffReader(path, float_dtype).batches(batch_rows)
@@ -0,0 +1,312 @@
+"""Single-pass ARFF header scanner with a persistent on-disk schema cache"""
+
+# Library imports
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import re
+import time
+from arffio import open_arff
+
+# Constant definitions
+DATA_TAG = "@data"  # Line that ends the ARFF header
+ATTRIBUTE_TAG = "@attribute"  # Prefix of attribute declaration lines
+ENCODING = "utf-8"  # Header text encoding
+ERRORS = "surrogateescape"  # Round-trips any undecodable header bytes
+CACHE_NAME = ".arffmerge_cache.json"  # Default cache filename
+CACHE_VERSION = 2  # Bumped whenever the cache layout changes
+CHUNK_SIZE = 4 * 1024 * 1024  # Bytes moved per read/write while streaming
+# @data sections
+ROW_PATTERN = re.compile(rb"^[ \t]*[^%\s]", re.MULTILINE)  # Start of a data
+# row (skips blank and % comment lines)
+CACHED_FIELDS = ("size", "mtime_ns", "fingerprint", "data_offset", "rows",
+                 "attribute_count", "file_class")  # Entry fields kept on disk
+
+
+def read_header(path):
+    """
+    Reads an ARFF header up to and including the @data line
+
+    Compressed files are only decompressed up to the @data line.
+
+    :param path: ARFF file path
+    :return: Header lines (newline terminated) and the byte offset of the
+        first data row (in uncompressed bytes)
+    """
+
+    header_lines = []
+    with open_arff(path) as arff:
+        for raw_line in iter(arff.readline, b""):
+            line = raw_line.decode(ENCODING, ERRORS).rstrip("\r\n") + "\n"
+            header_lines.append(line)
+            if line.strip().lower()==DATA_TAG:
+                return header_lines, arff.tell()
+
+    raise ValueError(f"File {path} has no @data line")
+
+
+def schema_fingerprint(header_lines):
+    """
+    Hashes the attribute declarations of a header
+
+    Relation names, comments and blank lines are ignored, so files exported
+    with the same attributes share a fingerprint.
+
+    :param header_lines: Header lines
+    :return: Hex digest
+    """
+
+    digest = hashlib.sha1()
+    for line in header_lines:
+        if line.lstrip().lower().startswith(ATTRIBUTE_TAG):
+            digest.update(" ".join(line.split()).encode(ENCODING, ERRORS))
+            digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def new_cache():
+    """
+    Creates an empty schema cache
+
+    :return: Cache dictionary
+    """
+
+    return {"version": CACHE_VERSION, "schemas": {}, "files": {}, "outputs": {}}
+
+
+def load_cache(cache_path):
+    """
+    Loads a schema cache, starting a new one if it is missing or unreadable
+
+    :param cache_path: Cache file path
+    :return: Cache dictionary
+    """
+
+    try:
+        with open(cache_path, encoding=ENCODING) as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return new_cache()
+
+    if cache.get("version")!=CACHE_VERSION:
+        return new_cache()
+    return cache
+
+
+def save_cache(cache, cache_path):
+    """
+    Writes a schema cache atomically
+
+    :param cache: Cache dictionary
+    :param cache_path: Cache file path
+    """
+
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, "w", encoding=ENCODING) as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(temp_path, cache_path)
+
+
+def file_stamp(path):
+    """
+    Gets the cache key and change stamp of a file
+
+    :param path: File path
+    :return: Absolute path, size in bytes and modification time in ns
+    """
+
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, stat.st_mtime_ns
+
+
+def header_summary(header_lines):
+    """
+    Counts the attributes and reads the class set of a header the way the
+    merge error reports group files
+
+    :param header_lines: Header lines
+    :return: Number of @attribute lines and the last value of the
+        @attribute class nominal set ("" if there is no class attribute)
+    """
+
+    attribute_count = 0
+    file_class = ""
+    for line in header_lines:
+        line = line.strip()
+        if line.startswith("@attribute"):
+            attribute_count += 1
+        if line.startswith("@attribute class"):
+            file_class = line.split(",")[-1].lstrip("'").rstrip("'}")
+    return attribute_count, file_class
+
+
+def count_rows(path, data_offset, chunk_size=CHUNK_SIZE):
+    """
+    Counts the data rows of an ARFF file without keeping them in memory
+
+    :param path: ARFF file path
+    :param data_offset: Byte offset of the first data row
+    :param chunk_size: Bytes read at a time
+    :return: Number of data rows
+    """
+
+    rows = 0
+    tail = b""  # Partial line carried over to the next chunk
+    with open_arff(path) as arff:
+        arff.seek(data_offset)
+        for chunk in iter(lambda: arff.read(chunk_size), b""):
+            cut = chunk.rfind(b"\n") + 1
+            if cut:
+                rows += len(ROW_PATTERN.findall(tail + chunk[:cut]))
+                tail = chunk[cut:]
+            else:
+                tail += chunk
+    return rows + len(ROW_PATTERN.findall(tail))
+
+
+def read_entry(path, rows=False):
+    """
+    Scans one ARFF file from disk
+
+    :param path: ARFF file path
+    :param rows: Also count the data rows
+    :return: Entry dictionary with path, size, mtime_ns, fingerprint,
+        data_offset, rows (None unless counted), attribute_count, file_class,
+        header_lines and scan_seconds (not cached: entries found in the cache
+        have none)
+    """
+
+    start = time.perf_counter()
+    _, size, mtime_ns = file_stamp(path)
+    header_lines, data_offset = read_header(path)
+    attribute_count, file_class = header_summary(header_lines)
+    return {"path": path, "size": size, "mtime_ns": mtime_ns,
+            "fingerprint": schema_fingerprint(header_lines),
+            "data_offset": data_offset,
+            "rows": count_rows(path, data_offset) if rows else None,
+            "attribute_count": attribute_count, "file_class": file_class,
+            "header_lines": header_lines,
+            "scan_seconds": time.perf_counter() - start}
+
+
+def cached_entry(path, cache):
+    """
+    Looks up the cached scan of a file, if the file is unchanged since
+
+    :param path: ARFF file path
+    :param cache: Cache dictionary, or None
+    :return: Entry dictionary, or None on a cache miss
+    """
+
+    if cache is None:
+        return None
+    key, size, mtime_ns = file_stamp(path)
+    cached = cache["files"].get(key)
+    if not cached or cached["size"]!=size or cached["mtime_ns"]!=mtime_ns:
+        return None
+
+    entry = dict(cached, path=path)
+    entry["header_lines"] = cache["schemas"][cached["fingerprint"]]
+    return entry
+
+
+def store_entry(entry, cache):
+    """
+    Saves a freshly scanned entry into the cache
+
+    :param entry: Entry dictionary from read_entry
+    :param cache: Cache dictionary, or None
+    """
+
+    if cache is not None:
+        cache["schemas"].setdefault(entry["fingerprint"], entry["header_lines"])
+        cache["files"][os.path.abspath(entry["path"])] = \
+            {name: entry[name] for name in CACHED_FIELDS}
+
+
+def scan_file(path, cache=None):
+    """
+    Scans one ARFF header, reusing the cached result if the file is unchanged
+
+    Only the header is read; the row count is filled in later by the merge
+    that streams the @data section (see record_rows).
+
+    :param path: ARFF file path
+    :param cache: Cache dictionary, or None to always read the header
+    :return: Entry dictionary (see read_entry)
+    """
+
+    entry = cached_entry(path, cache)
+    if entry is None:
+        entry = read_entry(path)
+        store_entry(entry, cache)
+    return entry
+
+
+def scan_files(file_list, cache=None, workers=1, rows=False):
+    """
+    Scans the headers of several ARFF files, optionally across a process pool
+
+    Files found unchanged in the cache are not opened. The rest are read by
+    up to `workers` processes, which overlaps the per-file open/read latency
+    of network storage; results come back in file_list order.
+
+    :param file_list: ARFF file paths
+    :param cache: Cache dictionary, or None to always read the headers
+    :param workers: Number of worker processes (1 scans in this process)
+    :param rows: Also count the data rows of files without a cached count
+    :return: List of entry dictionaries, in file_list order
+    """
+
+    entries = [cached_entry(name, cache) for name in file_list]
+    misses = [index for index, entry in enumerate(entries)
+              if entry is None or (rows and entry["rows"] is None)]
+    paths = [file_list[index] for index in misses]
+
+    if workers>1 and len(paths)>1:
+        chunksize = max(1, len(paths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scanned = list(pool.map(read_entry, paths, [rows] * len(paths),
+                                    chunksize=chunksize))
+    else:
+        scanned = [read_entry(path, rows) for path in paths]
+
+    for index, entry in zip(misses, scanned):
+        store_entry(entry, cache)
+        entries[index] = entry
+    return entries
+
+
+def group_entries(entries):
+    """
+    Groups scanned files by class set and by attribute count
+
+    :param entries: Entry dictionaries from scan_files
+    :return: Dictionary of file_class -> filenames and dictionary of
+        attribute count (as str) -> filenames, keys in first-seen order
+    """
+
+    class_dict = {}
+    attributes_dict = {}
+    for entry in entries:
+        name = os.path.basename(entry["path"])
+        class_dict.setdefault(entry["file_class"], []).append(name)
+        attributes_dict.setdefault(str(entry["attribute_count"]), []).append(name)
+    return class_dict, attributes_dict
+
+
+def record_rows(entry, rows, cache=None):
+    """
+    Stores the row count of a scanned file once its data has been streamed
+
+    :param entry: Entry dictionary from scan_file
+    :param rows: Number of data rows
+    :param cache: Cache dictionary, or None
+    """
+
+    entry["rows"] = rows
+    if cache is not None:
+        cached = cache["files"].get(os.path.abspath(entry["path"]))
+        if cached and cached["mtime_ns"]==entry["mtime_ns"]:
+            cached["rows"] = rows
@@ -0,0 +1,471 @@
+"""Name-aligned ARFF schemas: union of attributes and per-file column remapping"""
+
+# Library imports
+from operator import itemgetter
+import re
+from arffio import open_arff
+from arffscan import ATTRIBUTE_TAG, CHUNK_SIZE, ENCODING, ERRORS
+
+# Constant definitions
+MISSING = b"?"  # ARFF missing value, written for attributes a file lacks
+CLASS_NAME = "class"  # Attribute kept last in a union schema (WEKA class index)
+NUMERIC_TYPES = {"numeric", "real", "integer"}  # Interchangeable numeric types
+VALUE_PATTERN = re.compile(rb"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|[^,'"]+""")
+# One dense data value: quoted (with backslash escapes) or unquoted
+NOMINAL_PATTERN = re.compile(r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|[^,'"]+""")
+# One value of a {nominal, set}
+SPARSE_PATTERN = re.compile(
+    rb"""(\d+)\s+('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|[^,'"}]*[^,'"}\s])""")
+# One "index value" entry of a sparse {...} data row
+ZERO = b"0"  # Value of the numeric attributes a sparse row leaves out
+
+
+def split_name(declaration):
+    """
+    Splits an @attribute declaration into its name and type
+
+    :param declaration: Attribute line
+    :return: Unquoted attribute name and the type text after it
+    """
+
+    rest = declaration.strip()[len(ATTRIBUTE_TAG):].strip()
+    if rest[:1] in ("'", '"'):
+        end = rest.index(rest[0], 1)
+        return rest[1:end], rest[end + 1:].strip()
+    parts = rest.split(None, 1)
+    return parts[0], parts[1].strip() if len(parts)>1 else ""
+
+
+def nominal_values(kind):
+    """
+    Lists the values of a nominal type
+
+    :param kind: Type text of an attribute declaration
+    :return: List of value tokens (quotes kept), or None if not nominal
+    """
+
+    if not kind.startswith("{"):
+        return None
+    inner = kind[1:kind.rindex("}")]
+    return [value.strip() for value in NOMINAL_PATTERN.findall(inner)
+            if not value.isspace()]
+
+
+def header_attributes(header_lines):
+    """
+    Lists the attributes declared in a header
+
+    :param header_lines: Header lines
+    :return: List of (name, declaration line) pairs, in column order
+    """
+
+    attributes = []
+    for line in header_lines:
+        if line.lstrip().lower().startswith(ATTRIBUTE_TAG):
+            name, _ = split_name(line)
+            attributes.append((name, line.strip() + "\n"))
+    return attributes
+
+
+def union_schema(headers):
+    """
+    Builds one schema holding every attribute of several headers
+
+    Attributes are matched by name through a dictionary, so building the
+    union is linear in the total number of declarations. Columns keep the
+    order they are first seen in, except the class attribute, which stays
+    last. Nominal attributes that share a name get the union of their values.
+
+    :param headers: Iterable of header line lists
+    :return: List of attribute declaration lines
+    """
+
+    union = {}  # name -> [declaration, type, nominal values or None]
+    for header_lines in headers:
+        for name, declaration in header_attributes(header_lines):
+            _, kind = split_name(declaration)
+            known = union.get(name)
+            if known is None:
+                union[name] = [declaration, kind, nominal_values(kind)]
+                continue
+            if kind==known[1]:
+                continue
+
+            values = nominal_values(kind)
+            if values is None or known[2] is None:
+                if kind.lower()!=known[1].lower() and not \
+                        {kind.lower(), known[1].lower()}<=NUMERIC_TYPES:
+                    raise ValueError(f"Attribute {name} is declared both as "
+                                     f"{known[1]} and as {kind}")
+                continue
+
+            # Same nominal attribute with another value set: keep every value
+            seen = {value.strip("'\"") for value in known[2]}
+            added = [value for value in values if value.strip("'\"") not in seen]
+            if added:
+                known[2].extend(added)
+                known[1] = "{" + ",".join(known[2]) + "}"
+                head = known[0].strip()
+                known[0] = head[:head.index("{")] + known[1] + "\n"
+
+    names = [name for name in union if name.lower()!=CLASS_NAME]
+    names += [name for name in union if name.lower()==CLASS_NAME]
+    return [union[name][0] for name in names]
+
+
+def select_schema(schema, names):
+    """
+    Keeps only some attributes of a schema, and the class
+
+    :param schema: Attribute declaration lines from union_schema
+    :param names: Names of the attributes to keep
+    :return: Attribute declaration lines, in schema order; the class (the
+        attribute named class, else the last one) is always kept
+    """
+
+    names = set(names)
+    declared = [split_name(declaration)[0] for declaration in schema]
+    lowered = [name.lower() for name in declared]
+    target = lowered.index(CLASS_NAME) if CLASS_NAME in lowered else len(schema) - 1
+    return [declaration for index, (name, declaration) in
+            enumerate(zip(declared, schema)) if name in names or index==target]
+
+
+def column_map(header_lines, schema):
+    """
+    Maps the columns of a file onto a union schema
+
+    :param header_lines: Header lines of the file
+    :param schema: Attribute declaration lines from union_schema
+    :return: Tuple with, for every schema column, the file's column index,
+        or the file's column count where the file lacks that attribute
+    """
+
+    columns = {name: index for index, (name, _)
+               in enumerate(header_attributes(header_lines))}
+    missing = len(columns)
+    return tuple(columns.get(split_name(declaration)[0], missing)
+                 for declaration in schema)
+
+
+def is_identity(mapping, width):
+    """
+    Checks whether a column map leaves rows unchanged
+
+    :param mapping: Column map from column_map
+    :param width: Number of columns the file declares
+    :return: True if rows can be copied as they are
+    """
+
+    return len(mapping)==width and mapping==tuple(range(width))
+
+
+def schema_header(template_lines, schema):
+    """
+    Swaps the attribute block of a header for a union schema
+
+    :param template_lines: Header lines supplying @relation, comments and @data
+    :param schema: Attribute declaration lines from union_schema
+    :return: Header lines
+    """
+
+    attribute_rows = [index for index, line in enumerate(template_lines)
+                      if line.lstrip().lower().startswith(ATTRIBUTE_TAG)]
+    if not attribute_rows:
+        return template_lines[:-1] + list(schema) + template_lines[-1:]
+    return template_lines[:attribute_rows[0]] + list(schema) + \
+        template_lines[attribute_rows[-1] + 1:]
+
+
+def split_row(line, width, defaults=None):
+    """
+    Splits one data row into its values
+
+    :param line: Data row bytes, without the line terminator
+    :param width: Number of columns the file declares
+    :param defaults: Values of the entries a sparse row leaves out (see
+        sparse_defaults); 0 for every column by default
+    :return: List of value bytes (quotes kept)
+    """
+
+    if line.startswith(b"{"):
+        return expand_sparse(line, width, defaults)
+    if line.count(b",")==width - 1:  # No quoted value holds a comma
+        values = line.split(b",")
+    else:
+        values = [value for value in VALUE_PATTERN.findall(line)
+                  if not value.isspace()]
+    if len(values)!=width:
+        raise ValueError(f"Row has {len(values)} values, expected {width}")
+    return [value.strip() for value in values]
+
+
+def sparse_defaults(header_lines):
+    """
+    Gets the value every column takes when a sparse row leaves it out
+
+    :param header_lines: Header lines, or attribute declaration lines
+    :return: List of value bytes: the first declared value of nominal
+        attributes, 0 for the others
+    """
+
+    defaults = []
+    for _, declaration in header_attributes(header_lines):
+        values = nominal_values(split_name(declaration)[1])
+        defaults.append(values[0].encode(ENCODING, ERRORS) if values else ZERO)
+    return defaults
+
+
+def numeric_columns(header_lines):
+    """
+    Flags the numeric attributes of a header
+
+    :param header_lines: Header lines, or attribute declaration lines
+    :return: List of booleans, one per attribute
+    """
+
+    return [(split_name(declaration)[1].split() or [""])[0].lower() in
+            NUMERIC_TYPES for _, declaration in header_attributes(header_lines)]
+
+
+def sparse_pairs(line, width):
+    """
+    Splits one sparse data row into its entries
+
+    :param line: Sparse row bytes, "{index value, ...}"
+    :param width: Number of columns the file declares
+    :return: List of (column index, value bytes) pairs
+    """
+
+    end = line.rfind(b"}")
+    if end<0:
+        raise ValueError("Sparse row has no closing brace")
+    pairs = [(int(index), value) for index, value
+             in SPARSE_PATTERN.findall(line, 1, end)]
+    if pairs and not 0<=max(index for index, _ in pairs)<width:
+        raise ValueError(f"Sparse row has an index outside 0-{width - 1}")
+    return pairs
+
+
+def expand_sparse(line, width, defaults=None):
+    """
+    Turns one sparse data row into a dense list of values
+
+    :param line: Sparse row bytes
+    :param width: Number of columns the file declares
+    :param defaults: Values of the entries the row leaves out (see
+        sparse_defaults); 0 for every column by default
+    :return: List of value bytes
+    """
+
+    values = list(defaults) if defaults else [ZERO] * width
+    for index, value in sparse_pairs(line, width):
+        values[index] = value
+    return values
+
+
+def is_zero(value):
+    """
+    Checks whether a numeric value is zero (0, 0.0, -0.00, ...)
+
+    :param value: Value bytes
+    :return: True if the value is zero
+    """
+
+    return b"0" in value and not value.strip(b"+-.0")
+
+
+def sparse_row(values, omittable, threshold):
+    """
+    Writes a dense row as a sparse row if enough of it is zero
+
+    :param values: List of value bytes, ordered like the output schema
+    :param omittable: Flags of the columns a sparse row may leave out when
+        zero (see numeric_columns)
+    :param threshold: Smallest fraction of zero values for which the row is
+        written sparse
+    :return: Row bytes, sparse or dense
+    """
+
+    kept = [b"%d %s" % (index, value) for index, value in enumerate(values)
+            if not (omittable[index] and is_zero(value))]
+    if len(values) - len(kept)<threshold * len(values):
+        return b",".join(values)
+    return b"{" + b",".join(kept) + b"}"
+
+
+def sparse_plan(header_lines, schema, mapping):
+    """
+    Prepares the remapping of a file's sparse rows onto a union schema
+
+    :param header_lines: Header lines of the file
+    :param schema: Attribute declaration lines from union_schema
+    :param mapping: Column map from column_map
+    :return: For every file column, its schema column index, and the
+        (schema index, value) entries to write whenever a row leaves them
+        out: '?' for attributes the file lacks, and the file's own default
+        where the schema's first nominal value differs from it
+    """
+
+    width = len(header_attributes(header_lines))
+    positions = [None] * width
+    fill = []
+    file_defaults = sparse_defaults(header_lines)
+    for target, (column, default) in enumerate(zip(mapping,
+                                                   sparse_defaults(schema))):
+        if column>=width:
+            fill.append((target, MISSING))
+            continue
+        positions[column] = target
+        if file_defaults[column].strip(b"'\"")!=default.strip(b"'\""):
+            fill.append((target, file_defaults[column]))
+    return positions, fill
+
+
+def remap_sparse_row(line, positions, fill, width):
+    """
+    Moves the entries of one sparse row onto a union schema, keeping it sparse
+
+    :param line: Sparse row bytes
+    :param positions: Schema column of every file column, from sparse_plan
+    :param fill: Entries to write when left out, from sparse_plan
+    :param width: Number of columns the file declares
+    :return: Remapped sparse row bytes (entries of columns the schema lacks
+        are dropped)
+    """
+
+    pairs = [(positions[index], value)
+             for index, value in sparse_pairs(line, width)
+             if positions[index] is not None]
+    present = {index for index, _ in pairs}
+    pairs += [entry for entry in fill if entry[0] not in present]
+    pairs.sort()
+    return b"{" + b",".join(b"%d %s" % pair for pair in pairs) + b"}"
+
+
+def remap_row(line, mapping, width):
+    """
+    Reorders one dense data row onto a union schema
+
+    :param line: Data row bytes, without the line terminator
+    :param mapping: Column map from column_map
+    :param width: Number of columns the file declares
+    :return: Remapped row bytes
+    """
+
+    values = split_row(line, width)
+    values.append(MISSING)
+    if len(mapping)==1:
+        return values[mapping[0]]
+    return b",".join(itemgetter(*mapping)(values))
+
+
+def iter_data_rows(path, data_offset, chunk_size=CHUNK_SIZE):
+    """
+    Yields the data rows of an ARFF file, reading it in large chunks
+
+    :param path: ARFF file path
+    :param data_offset: Byte offset of the first data row
+    :param chunk_size: Bytes read at a time
+    :return: Generator of stripped row bytes (blank and % comment lines
+        skipped)
+    """
+
+    tail = b""
+    with open_arff(path) as arff:
+        arff.seek(data_offset)
+        for chunk in iter(lambda: arff.read(chunk_size), b""):
+            lines = (tail + chunk).split(b"\n")
+            tail = lines.pop()
+            for line in lines:
+                line = line.strip()
+                if line and not line.startswith(b"%"):
+                    yield line
+    tail = tail.strip()
+    if tail and not tail.startswith(b"%"):
+        yield tail
+
+
+def remap_data(path, data_offset, output, header_lines, schema,
+               chunk_size=CHUNK_SIZE, sparse_threshold=None, dedup=None):
+    """
+    Streams the @data section of an ARFF file onto a union schema
+
+    Every dense row is split once and permuted with a single itemgetter call;
+    attributes the file lacks are filled with '?'. Sparse rows stay sparse:
+    only their indices are moved. Blank and % comment lines are copied as
+    they are. With a deduplicator, rows seen before are dropped.
+
+    :param path: ARFF file path
+    :param data_offset: Byte offset of the first data row
+    :param output: Output file opened in binary write/append mode
+    :param header_lines: Header lines of the file
+    :param schema: Attribute declaration lines from union_schema
+    :param chunk_size: Bytes read at a time
+    :param sparse_threshold: Write dense rows with at least this fraction of
+        numeric zeros as sparse rows (None keeps them dense)
+    :param dedup: arffdedup.RowDeduplicator, or None to keep every row
+    :return: Number of bytes read and number of data rows written
+    """
+
+    mapping = column_map(header_lines, schema)
+    width = len(header_attributes(header_lines))
+    positions, fill = sparse_plan(header_lines, schema, mapping)
+    omittable = numeric_columns(schema)
+    identity = is_identity(mapping, width) and not fill
+
+    def remap_line(line):
+        if identity and sparse_threshold is None:
+            return line
+        if line.startswith(b"{"):
+            return remap_sparse_row(line, positions, fill, width)
+        if sparse_threshold is None:
+            return remap_row(line, mapping, width)
+        values = split_row(line, width)
+        values.append(MISSING)
+        return sparse_row([values[index] for index in mapping], omittable,
+                          sparse_threshold)
+
+    copied = 0
+    rows = 0
+    tail = b""
+    with open_arff(path) as arff:
+        arff.seek(data_offset)
+        for chunk in iter(lambda: arff.read(chunk_size), b""):
+            copied += len(chunk)
+            lines = (tail + chunk).split(b"\n")
+            tail = lines.pop()
+            out_lines = []
+            data_rows = []  # Positions of the data rows in out_lines
+            for line in lines:
+                stripped = line.strip()
+                if not stripped or stripped.startswith(b"%"):
+                    out_lines.append(line)
+                    continue
+                try:
+                    data_rows.append(len(out_lines))
+                    out_lines.append(remap_line(stripped))
+                except ValueError as error:
+                    raise ValueError(f"File {path}: {error}") from None
+            if dedup is not None and data_rows:
+                flags = dedup.keep([out_lines[index] for index in data_rows])
+                for index, keep in zip(data_rows, flags):
+                    if not keep:
+                        out_lines[index] = None
+                out_lines = [line for line in out_lines if line is not None]
+                data_rows = [index for index, keep in zip(data_rows, flags)
+                             if keep]
+            rows += len(data_rows)
+            if out_lines:
+                output.write(b"\n".join(out_lines) + b"\n")
+
+    tail = tail.strip()
+    if tail and not tail.startswith(b"%"):
+        try:
+            line = remap_line(tail)
+        except ValueError as error:
+            raise ValueError(f"File {path}: {error}") from None
+        if dedup is None or dedup.keep([line])[0]:
+            output.write(line + b"\n")
+            rows += 1
+    return copied, rows
@@ -0,0 +1,358 @@
+"""Information gain attribute selection, as WEKA's InfoGainAttributeEval + Ranker
+
+The same selection as AttributeSelection (with GUI)/Main.java processFile,
+without a JVM: numeric attributes are discretized with Fayyad & Irani's MDL
+criterion (WEKA's supervised Discretize with better encoding), missing
+values are spread over the known values in proportion, and every attribute
+whose information gain about the class is above the threshold is kept.
+
+Each numeric column is reduced to its distinct values with per-class counts
+(np.unique and np.bincount), which is all the MDL split search needs; the
+search then evaluates every candidate cut of a range at once from cumulative
+counts. The contingency tables of all attributes are padded to one array so
+the gains are computed in a single vectorized pass.
+"""
+
+# Library imports
+import os
+import numpy as np
+from arffio import ARFF_SUFFIX, compression, open_arff
+from arffreader import MISSING_CODE, read_arff
+from arffscan import ENCODING, ERRORS, read_header
+from arffschema import CLASS_NAME, remap_data, schema_header
+
+# Constant definitions
+THRESHOLD = 0.5  # Ranker threshold of Main.processFile: gains above it are kept
+SELECTION_SUFFIX = "_selection"  # Added to the input filename for the output
+SMALL = 1e-6  # WEKA's Utils.SMALL, the tolerance of its comparisons
+
+
+def xlogx(values):
+    """
+    Computes x * ln(x) elementwise, 0 where x <= 0 (WEKA's lnFunc)
+
+    :param values: Array
+    :return: Array
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    positive = np.where(values>0, values, 1.0)
+    return np.where(values>0, values * np.log(positive), 0.0)
+
+
+def entropy(counts):
+    """
+    Entropy of class counts, in bits, over the last axis
+
+    :param counts: Array of counts (..., classes)
+    :return: Array of entropies
+    """
+
+    total = counts.sum(axis=-1)
+    value = (xlogx(total) - xlogx(counts).sum(axis=-1)) / \
+        (np.where(total>SMALL, total, 1.0) * np.log(2))
+    return np.where(total>SMALL, value, 0.0)
+
+
+def conditional_entropy(tables):
+    """
+    Entropy of the columns given the rows, in bits (WEKA's
+    ContingencyTables.entropyConditionedOnRows)
+
+    :param tables: Array of contingency tables (..., rows, columns)
+    :return: Array of entropies
+    """
+
+    total = tables.sum(axis=(-2, -1))
+    value = (xlogx(tables.sum(axis=-1)).sum(axis=-1) -
+             xlogx(tables).sum(axis=(-2, -1))) / \
+        (np.where(total>SMALL, total, 1.0) * np.log(2))
+    return np.where(total>SMALL, value, 0.0)
+
+
+def class_index(attributes):
+    """
+    Finds the class attribute: the one named class, else the last one
+
+    :param attributes: Attribute dictionaries from arffreader
+    :return: Column index
+    """
+
+    names = [attribute["name"].lower() for attribute in attributes]
+    return names.index(CLASS_NAME) if CLASS_NAME in names else len(names) - 1
+
+
+def value_counts(values, labels, classes):
+    """
+    Counts every distinct value of a numeric column per class
+
+    :param values: Float array (NaN for missing values, which are skipped)
+    :param labels: Class code array (MISSING_CODE rows count as class 0, as
+        in WEKA's Discretize)
+    :param classes: Number of classes
+    :return: Sorted distinct values and their (values, classes) counts
+    """
+
+    known = ~np.isnan(values)
+    distinct, inverse = np.unique(values[known], return_inverse=True)
+    labels = np.maximum(labels[known], 0)
+    counts = np.bincount(inverse * classes + labels,
+                         minlength=len(distinct) * classes)
+    return distinct, counts.reshape(len(distinct), classes).astype(np.float64)
+
+
+def accept_split(prior, left, right, instances, cut_count):
+    """
+    Fayyad & Irani's MDL stopping criterion
+
+    :param prior: Class counts of the range
+    :param left: Class counts left of the best cut
+    :param right: Class counts right of the best cut
+    :param instances: Number of instances in the range
+    :param cut_count: Number of candidate cuts in the range
+    :return: True if the cut is worth keeping
+    """
+
+    prior_entropy = entropy(prior)
+    gain = prior_entropy - conditional_entropy(np.stack([left, right]))
+    classes_total = np.count_nonzero(prior>0)
+    classes_left = np.count_nonzero(left>0)
+    classes_right = np.count_nonzero(right>0)
+    delta = np.log2(3.0 ** classes_total - 2) - (
+        classes_total * prior_entropy - classes_right * entropy(right) -
+        classes_left * entropy(left))
+    return gain>(np.log2(cut_count) + delta) / instances
+
+
+def mdl_cut_points(distinct, counts):
+    """
+    Finds the MDL cut points of a numeric attribute (WEKA's supervised
+    Discretize with better encoding)
+
+    :param distinct: Sorted distinct values
+    :param counts: Class counts of every distinct value
+    :return: Sorted array of cut points (empty: the attribute is one bin)
+    """
+
+    cuts = []
+    ranges = [(0, len(distinct))]  # Distinct value ranges still to split
+    while ranges:
+        first, stop = ranges.pop()
+        if stop - first<2:
+            continue
+        block = counts[first:stop]
+        prior = block.sum(axis=0)
+        left = np.cumsum(block[:-1], axis=0)  # Counts left of each cut
+        right = prior - left
+        scores = conditional_entropy(np.stack([left, right], axis=1))
+        best = int(np.argmin(scores))
+        prior_entropy = entropy(prior)
+        if not scores[best]<prior_entropy or prior_entropy - scores[best]<=0:
+            continue
+        if accept_split(prior, left[best], right[best], prior.sum(),
+                        stop - first - 1):
+            cuts.append((distinct[first + best] + distinct[first + best + 1]) / 2)
+            ranges += [(first, first + best + 1), (first + best + 1, stop)]
+    return np.sort(np.array(cuts, dtype=np.float64))
+
+
+def attribute_table(codes, bins, labels, classes):
+    """
+    Builds the contingency table of a discretized or nominal attribute
+
+    :param codes: Bin or value codes (MISSING_CODE for missing values)
+    :param bins: Number of bins or values
+    :param labels: Class codes (MISSING_CODE for a missing class)
+    :param classes: Number of classes
+    :return: (bins + 1, classes + 1) counts; the last row and column hold the
+        missing attribute values and the missing classes
+    """
+
+    rows = np.where(codes<0, bins, codes)
+    columns = np.where(labels<0, classes, labels)
+    table = np.bincount(rows * (classes + 1) + columns,
+                        minlength=(bins + 1) * (classes + 1))
+    return table.reshape(bins + 1, classes + 1).astype(np.float64)
+
+
+def discretize(values, labels, classes):
+    """
+    Discretizes a numeric column by MDL
+
+    :param values: Float array (NaN for missing values)
+    :param labels: Class codes
+    :param classes: Number of classes
+    :return: Bin codes (MISSING_CODE for missing values), number of bins and
+        the cut points
+    """
+
+    cuts = mdl_cut_points(*value_counts(values, labels, classes))
+    codes = np.searchsorted(cuts, values, side="left")
+    return np.where(np.isnan(values), MISSING_CODE, codes), len(cuts) + 1, cuts
+
+
+def spread_missing(tables, bins):
+    """
+    Spreads the missing value counts over the known cells in proportion (WEKA's
+    default missing-value handling), for many tables at once
+
+    :param tables: Array (attributes, rows, classes + 1) whose last row holds
+        the missing attribute values; rows past an attribute's bins are 0
+    :param bins: Number of real rows of every table
+    :return: Tables (attributes, rows - 1, classes) to compute the gains on,
+        and a mask of the attributes that had no known cell (their full table,
+        missing row and column included, is used instead)
+    """
+
+    known = tables[:, :-1, :-1]
+    missing_row = tables[:, -1, :-1]
+    missing_column = tables[:, :-1, -1]
+    missing_both = tables[:, -1, -1]
+    total = known.sum(axis=(1, 2))
+    empty = ~(total>SMALL)
+    safe = np.where(empty, 1.0, total)[:, None, None]
+    row_sums = known.sum(axis=2, keepdims=True)
+    column_sums = known.sum(axis=1, keepdims=True)
+    spread = known + row_sums / safe * missing_row[:, None, :] + \
+        column_sums / safe * missing_column[:, :, None] + \
+        known / safe * missing_both[:, None, None]
+    return spread, empty
+
+
+def info_gains(attributes, columns, class_column=None):
+    """
+    Computes the information gain of every attribute about the class
+
+    :param attributes: Attribute dictionaries from arffreader
+    :param columns: Dictionary of attribute name -> array
+    :param class_column: Index of the class attribute (default: class_index)
+    :return: Array of gains, one per attribute (0 for the class)
+    """
+
+    if class_column is None:
+        class_column = class_index(attributes)
+    target = attributes[class_column]
+    if target["kind"]!="nominal":
+        raise ValueError(f"Class attribute {target['name']} is not nominal")
+    labels = columns[target["name"]].astype(np.int64)
+    classes = len(target["values"])
+
+    tables = []
+    for index, attribute in enumerate(attributes):
+        if index==class_column:
+            tables.append(np.zeros((2, classes + 1)))
+        elif attribute["kind"]=="numeric":
+            codes, bins, _ = discretize(columns[attribute["name"]], labels, classes)
+            tables.append(attribute_table(codes, bins, labels, classes))
+        elif attribute["kind"]=="nominal":
+            tables.append(attribute_table(columns[attribute["name"]].astype(np.int64),
+                                          len(attribute["values"]), labels, classes))
+        else:
+            raise ValueError(f"Cannot evaluate string attribute {attribute['name']}")
+    return table_gains(tables, class_column)
+
+
+def table_gains(tables, class_column=None):
+    """
+    Computes information gains from contingency tables
+
+    :param tables: List of (bins + 1, classes + 1) tables from attribute_table
+    :param class_column: Index of the class attribute, whose gain is 0
+    :return: Array of gains
+    """
+
+    rows = max(len(table) for table in tables)
+    padded = np.zeros((len(tables), rows, tables[0].shape[1]))
+    for index, table in enumerate(tables):
+        padded[index, :len(table) - 1] = table[:-1]
+        padded[index, -1] = table[-1]
+    spread, empty = spread_missing(padded, [len(table) - 1 for table in tables])
+    gains = entropy(spread.sum(axis=1)) - conditional_entropy(spread)
+    for index in np.flatnonzero(empty):  # Nothing known: WEKA keeps the full table
+        gains[index] = entropy(padded[index].sum(axis=0)) - \
+            conditional_entropy(padded[index])
+    if class_column is not None:
+        gains[class_column] = 0.0
+    return gains
+
+
+def rank_attributes(gains, class_column, threshold=THRESHOLD):
+    """
+    Ranks the attributes like WEKA's Ranker with a threshold
+
+    :param gains: Array of gains
+    :param class_column: Index of the class attribute
+    :param threshold: Only gains strictly above it are kept
+    :return: List of attribute indices, best first
+    """
+
+    order = sorted((index for index in range(len(gains)) if index!=class_column),
+                   key=lambda index: -gains[index])
+    return [index for index in order if gains[index]>threshold]
+
+
+def selection_path(path, output_dir=None):
+    """
+    Names the output of a selection: data.arff -> data_selection.arff
+
+    :param path: Input ARFF file path
+    :param output_dir: Output folder (default: the input's folder)
+    :return: Output file path (compressed like the input)
+    """
+
+    suffix = compression(path)
+    name = os.path.basename(path)[:len(os.path.basename(path)) - len(suffix)]
+    if name.lower().endswith(ARFF_SUFFIX):
+        name = name[:-len(ARFF_SUFFIX)]
+    return os.path.join(output_dir or os.path.dirname(path),
+                        name + SELECTION_SUFFIX + ARFF_SUFFIX + suffix)
+
+
+def write_selection(path, output_path, keep, level=None):
+    """
+    Writes the kept attributes of an ARFF file, in their original order
+
+    Rows are projected from the input text as it is, so values are written
+    exactly as they were read; sparse rows stay sparse.
+
+    :param path: Input ARFF file path
+    :param output_path: Output ARFF file path
+    :param keep: Indices of the attributes to keep (the class included)
+    :param level: Compression level of a compressed output
+    :return: Number of data rows written
+    """
+
+    header_lines, data_offset = read_header(path)
+    declarations = [line for line in header_lines
+                    if line.lstrip().lower().startswith("@attribute")]
+    schema = [declarations[index].strip() + "\n" for index in sorted(keep)]
+    with open_arff(output_path, "wb", level) as output:
+        output.write("".join(schema_header(header_lines, schema))
+                     .encode(ENCODING, ERRORS))
+        _, rows = remap_data(path, data_offset, output, header_lines, schema)
+    return rows
+
+
+def select_file(path, output_dir=None, threshold=THRESHOLD, level=None):
+    """
+    Selects the attributes of one ARFF file and writes *_selection.arff
+
+    :param path: Input ARFF file path
+    :param output_dir: Output folder (default: the input's folder)
+    :param threshold: Information gain threshold
+    :param level: Compression level of a compressed output
+    :return: Dictionary with "output", "attributes" (input count), "kept"
+        (output count, class included), "ranking" (names and gains of the
+        selected attributes, best first) and "rows"
+    """
+
+    attributes, columns = read_arff(path)
+    target = class_index(attributes)
+    gains = info_gains(attributes, columns, target)
+    ranking = rank_attributes(gains, target, threshold)
+    output_path = selection_path(path, output_dir)
+    rows = write_selection(path, output_path, ranking + [target], level)
+    return {"output": output_path, "attributes": len(attributes),
+            "kept": len(ranking) + 1, "rows": rows,
+            "ranking": [(attributes[index]["name"], float(gains[index]))
+                        for index in ranking]}
@@ -0,0 +1,494 @@
+"""Mergeable information gain statistics over many ARFF files
+
+A sketch holds, for every attribute, how often each value occurs with each
+class: the full contingency table of a nominal attribute, and for a numeric
+attribute its distinct values with per-class counts plus the counts of its
+missing values. That is everything arffselect needs for the MDL
+discretization and the gains, so a folder too large to load can be ranked in
+one streaming pass: each file is read in row batches into its own sketch
+(files in parallel worker processes), and the partial sketches are added
+together into the statistics of the union of all files.
+
+Memory stays bounded by keeping at most `buckets` values per numeric
+attribute. Past that, values are truncated to fewer mantissa bits (a fixed
+ladder of precisions, so every part of a merge lands on the same grid);
+neighbouring values share a bucket and the MDL cut points fall between
+buckets. With buckets=None every distinct value is kept and the gains equal
+those of arffselect.info_gains on the merged file.
+
+Attributes are matched by name and nominal values by text, as in a merge
+by name: rows of a file that lacks an attribute count as missing values of
+it.
+"""
+
+# Library imports
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import json
+import os
+import zipfile
+import numpy as np
+from arffreader import BATCH_ROWS, ArffReader
+from arffselect import THRESHOLD, class_index, mdl_cut_points, rank_attributes, table_gains
+
+# Constant definitions
+BUCKETS = 8192  # Most values kept per numeric attribute before coarsening
+MANTISSA_BITS = 52  # Mantissa bits of a float64 (exact values)
+BITS_STEP = 4  # Mantissa bits dropped per coarsening step
+SKETCH_SUFFIX = ".sketch"  # Appended to a merged file path for the saved
+# sketch of its inputs
+SKETCH_VERSION = 2  # Bumped whenever the saved sketch layout changes
+
+
+def quantize(values, bits):
+    """
+    Truncates float64 values to a number of mantissa bits (towards 0, so the
+    order of the values is kept)
+
+    :param values: Float array
+    :param bits: Mantissa bits kept (MANTISSA_BITS keeps the values exact)
+    :return: Float64 array
+    """
+
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    if bits>=MANTISSA_BITS:
+        return values
+    mask = np.uint64(~((1 << (MANTISSA_BITS - bits)) - 1) & 0xFFFFFFFFFFFFFFFF)
+    return (values.view(np.uint64) & mask).view(np.float64)
+
+
+def add_keyed(keys, counts, other_keys, other_counts):
+    """
+    Adds two sets of per-value counts
+
+    :param keys: Sorted values
+    :param counts: Counts of every value (values, columns)
+    :param other_keys: Sorted values
+    :param other_counts: Counts of every value (values, columns)
+    :return: Sorted union of the values and their summed counts
+    """
+
+    union, inverse = np.unique(np.concatenate([keys, other_keys]),
+                               return_inverse=True)
+    stacked = np.concatenate([counts, other_counts])
+    summed = np.empty((len(union), stacked.shape[1]))
+    for column in range(stacked.shape[1]):
+        summed[:, column] = np.bincount(inverse, weights=stacked[:, column],
+                                        minlength=len(union))
+    return union, summed
+
+
+def widen(counts, mapping, width):
+    """
+    Moves the class columns of a count array onto a longer class list
+
+    :param counts: Counts (..., classes + 1), missing class last
+    :param mapping: New index of every old class
+    :param width: New number of classes
+    :return: Counts (..., width + 1)
+    """
+
+    wide = np.zeros(counts.shape[:-1] + (width + 1,))
+    wide[..., mapping] = counts[..., :-1]
+    wide[..., -1] = counts[..., -1]
+    return wide
+
+
+class InfoGainSketch:
+    """Per-attribute, per-class counts of ARFF rows, mergeable"""
+
+    def __init__(self, buckets=BUCKETS):
+        """
+        Starts an empty sketch
+
+        :param buckets: Most values kept per numeric attribute (None keeps
+            every distinct value)
+        """
+
+        self.buckets = buckets
+        self.classes = []  # Class values, in first-seen order
+        self.class_name = None
+        self.class_counts = np.zeros(1)  # Rows per class, missing class last
+        self.attributes = {}  # Name -> dictionary with kind and counts
+        self.rows = 0
+        self.files = 0
+
+    def add_batch(self, attributes, columns, class_column=None):
+        """
+        Adds a batch of rows read by arffreader
+
+        :param attributes: Attribute dictionaries from arffreader
+        :param columns: Dictionary of attribute name -> array
+        :param class_column: Index of the class attribute (default:
+            arffselect.class_index)
+        """
+
+        if class_column is None:
+            class_column = class_index(attributes)
+        target = attributes[class_column]
+        if target["kind"]!="nominal":
+            raise ValueError(f"Class attribute {target['name']} is not nominal")
+        classes = len(target["values"])
+        labels = np.asarray(columns[target["name"]], dtype=np.int64)
+        labels = np.where(labels<0, classes, labels)  # Missing class last
+
+        batch = InfoGainSketch(self.buckets)
+        batch.classes = list(target["values"])
+        batch.class_name = target["name"]
+        batch.class_counts = np.bincount(labels, minlength=classes + 1).astype(np.float64)
+        batch.rows = len(labels)
+        for index, attribute in enumerate(attributes):
+            name = attribute["name"]
+            if index==class_column:
+                continue
+            if attribute["kind"]=="numeric":
+                values = np.asarray(columns[name], dtype=np.float64)
+                known = ~np.isnan(values)
+                bits = self.attributes[name]["bits"] if name in self.attributes \
+                    else MANTISSA_BITS  # Already coarse: quantize before np.unique
+                keys, inverse = np.unique(quantize(values[known], bits),
+                                          return_inverse=True)
+                counts = np.bincount(inverse * (classes + 1) + labels[known],
+                                     minlength=len(keys) * (classes + 1))
+                batch.attributes[name] = {
+                    "kind": "numeric", "bits": bits, "keys": keys,
+                    "counts": counts.reshape(len(keys), classes + 1).astype(np.float64),
+                    "missing": np.bincount(labels[~known],
+                                           minlength=classes + 1).astype(np.float64)}
+                batch.coarsen(name)
+            elif attribute["kind"]=="nominal":
+                values = len(attribute["values"])
+                codes = np.asarray(columns[name], dtype=np.int64)
+                codes = np.where(codes<0, values, codes)  # Missing value last
+                table = np.bincount(codes * (classes + 1) + labels,
+                                    minlength=(values + 1) * (classes + 1))
+                batch.attributes[name] = {
+                    "kind": "nominal", "values": list(attribute["values"]),
+                    "counts": table.reshape(values + 1, classes + 1).astype(np.float64)}
+            else:
+                raise ValueError(f"Cannot evaluate string attribute {name}")
+        self.merge(batch, files=0)
+
+    def coarsen(self, name):
+        """
+        Truncates the values of a numeric attribute until at most `buckets`
+        remain
+
+        :param name: Attribute name
+        """
+
+        state = self.attributes[name]
+        while self.buckets is not None and len(state["keys"])>self.buckets \
+                and state["bits"]>0:
+            state["bits"] = max(0, state["bits"] - BITS_STEP)
+            keys = quantize(state["keys"], state["bits"])
+            starts = np.flatnonzero(np.concatenate([[True], keys[1:]!=keys[:-1]]))
+            state["keys"] = keys[starts]
+            state["counts"] = np.add.reduceat(state["counts"], starts, axis=0)
+
+    def set_classes(self, classes):
+        """
+        Extends the class list, moving every count onto it
+
+        :param classes: Class values to add (those already known are kept
+            where they are)
+        :return: New index of each of the given classes
+        """
+
+        new = [value for value in classes if value not in self.classes]
+        if new:
+            mapping = list(range(len(self.classes)))
+            self.classes += new
+            self.class_counts = widen(self.class_counts, mapping, len(self.classes))
+            for state in self.attributes.values():
+                state["counts"] = widen(state["counts"], mapping, len(self.classes))
+                if state["kind"]=="numeric":
+                    state["missing"] = widen(state["missing"], mapping, len(self.classes))
+        return [self.classes.index(value) for value in classes]
+
+    def merge(self, other, files=None):
+        """
+        Adds another sketch to this one
+
+        :param other: InfoGainSketch (left unchanged)
+        :param files: Number of files other stands for (default: other.files)
+        :return: This sketch
+        """
+
+        mapping = self.set_classes(other.classes)
+        width = len(self.classes)
+        if self.class_name is None:
+            self.class_name = other.class_name
+        other_class_counts = widen(other.class_counts, mapping, width)
+        for name in self.attributes.keys() - other.attributes.keys():
+            state = self.attributes[name]  # Rows of other lack it: missing
+            if state["kind"]=="numeric":
+                state["missing"] += other_class_counts
+            else:
+                state["counts"][-1] += other_class_counts
+
+        for name, theirs in other.attributes.items():
+            counts = widen(theirs["counts"], mapping, width)
+            mine = self.attributes.get(name)
+            if mine is not None and mine["kind"]!=theirs["kind"]:
+                raise ValueError(f"Attribute {name} is {mine['kind']} in some files "
+                                 f"and {theirs['kind']} in others")
+            if theirs["kind"]=="numeric":
+                missing = widen(theirs["missing"], mapping, width)
+                if mine is None:  # Rows of this sketch lack it: missing
+                    self.attributes[name] = {
+                        "kind": "numeric", "bits": theirs["bits"],
+                        "keys": theirs["keys"].copy(), "counts": counts,
+                        "missing": missing + self.class_counts}
+                    continue
+                bits = min(mine["bits"], theirs["bits"])
+                mine["keys"], mine["counts"] = add_keyed(
+                    quantize(mine["keys"], bits), mine["counts"],
+                    quantize(theirs["keys"], bits), counts)
+                mine["bits"] = bits
+                mine["missing"] += missing
+                self.coarsen(name)
+            else:
+                if mine is None:
+                    mine = self.attributes[name] = {
+                        "kind": "nominal", "values": [],
+                        "counts": np.zeros((1, width + 1))}
+                    mine["counts"][-1] = self.class_counts
+                new = [value for value in theirs["values"] if value not in mine["values"]]
+                if new:
+                    mine["values"] += new
+                    grown = np.zeros((len(mine["values"]) + 1, width + 1))
+                    grown[:len(mine["counts"]) - 1] = mine["counts"][:-1]
+                    grown[-1] = mine["counts"][-1]
+                    mine["counts"] = grown
+                rows = [mine["values"].index(value) for value in theirs["values"]]
+                np.add.at(mine["counts"], rows + [-1], counts)
+
+        self.class_counts += other_class_counts
+        self.rows += other.rows
+        self.files += other.files if files is None else files
+        return self
+
+    def tables(self):
+        """
+        Discretizes the numeric attributes by MDL and builds the contingency
+        table of every attribute
+
+        :return: Attribute names and their (bins + 1, classes + 1) tables
+            (missing values in the last row, missing class in the last column)
+        """
+
+        names = list(self.attributes)
+        tables = []
+        for name in names:
+            state = self.attributes[name]
+            if state["kind"]=="nominal":
+                tables.append(state["counts"])
+                continue
+            mdl_counts = state["counts"][:, :-1].copy()
+            mdl_counts[:, 0] += state["counts"][:, -1]  # As arffselect.value_counts
+            cuts = mdl_cut_points(state["keys"], mdl_counts)
+            bins = np.searchsorted(cuts, state["keys"], side="left")
+            table = np.zeros((len(cuts) + 2, len(self.classes) + 1))
+            for column in range(table.shape[1]):
+                table[:-1, column] = np.bincount(bins, weights=state["counts"][:, column],
+                                                 minlength=len(cuts) + 1)
+            table[-1] = state["missing"]
+            tables.append(table)
+        return names, tables
+
+    def gains(self):
+        """
+        Computes the information gain of every attribute about the class
+
+        :return: Dictionary of attribute name -> gain
+        """
+
+        names, tables = self.tables()
+        if not names:
+            return {}
+        return dict(zip(names, table_gains(tables).tolist()))
+
+    def ranking(self, threshold=THRESHOLD):
+        """
+        Ranks the attributes like WEKA's Ranker with a threshold
+
+        :param threshold: Only gains strictly above it are kept
+        :return: List of (name, gain) pairs, best first
+        """
+
+        gains = self.gains()
+        names = list(gains)
+        order = rank_attributes([gains[name] for name in names], None, threshold)
+        return [(names[index], gains[names[index]]) for index in order]
+
+
+def sketch_file(path, buckets=BUCKETS, batch_rows=BATCH_ROWS):
+    """
+    Builds the sketch of one ARFF file, reading it in row batches
+
+    :param path: ARFF file path
+    :param buckets: Most values kept per numeric attribute (None: exact)
+    :param batch_rows: Rows decoded at a time
+    :return: InfoGainSketch
+    """
+
+    reader = ArffReader(path)
+    target = class_index(reader.attributes)
+    sketch = InfoGainSketch(buckets)
+    for batch in reader.batches(batch_rows):
+        sketch.add_batch(reader.attributes, batch, target)
+    if not sketch.rows:  # No data: still record the attributes and classes
+        sketch.add_batch(reader.attributes, reader.decoder.allocate(0), target)
+    sketch.files = 1
+    return sketch
+
+
+def sketch_files(file_list, workers=1, buckets=BUCKETS, batch_rows=BATCH_ROWS,
+                 progress=None):
+    """
+    Builds the merged sketch of several ARFF files, optionally across a
+    process pool
+
+    Partial sketches are added in as soon as they arrive, and at most two
+    per worker are waiting at any time, so memory does not grow with the
+    number of files.
+
+    :param file_list: ARFF file paths
+    :param workers: Number of worker processes (1 reads in this process)
+    :param buckets: Most values kept per numeric attribute (None: exact)
+    :param batch_rows: Rows decoded at a time
+    :param progress: Optional callback, called with each file's path and
+        sketch once it is added
+    :return: InfoGainSketch of all rows of all files
+    """
+
+    total = InfoGainSketch(buckets)
+
+    def add(path, sketch):
+        total.merge(sketch)
+        if progress:
+            progress(path, sketch)
+
+    if workers<=1 or len(file_list)<2:
+        for path in file_list:
+            add(path, sketch_file(path, buckets, batch_rows))
+        return total
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        for path in file_list:
+            pending[pool.submit(sketch_file, path, buckets, batch_rows)] = path
+            if len(pending)>=workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    add(pending.pop(future), future.result())
+        for future in list(pending):
+            add(pending.pop(future), future.result())
+    return total
+
+
+def load_sketch(sketch_path, buckets=BUCKETS):
+    """
+    Loads a sketch saved by update_sketch
+
+    The file is read with allow_pickle=False, so it can only hold arrays and
+    the JSON header (see save_sketch).
+
+    :param sketch_path: Saved sketch path
+    :param buckets: Buckets the sketch must have been built with
+    :return: Dictionary of the inputs it covers (absolute path -> [size,
+        mtime_ns]) and the InfoGainSketch, or ({}, None) if it is missing,
+        unreadable or built otherwise
+    """
+
+    try:
+        with np.load(sketch_path, allow_pickle=False) as arrays:
+            header = json.loads(arrays["header"].tobytes().decode("utf-8"))
+            if not isinstance(header, dict) or \
+                    header.get("version")!=SKETCH_VERSION or \
+                    header.get("buckets")!=buckets:
+                return {}, None
+            sketch = InfoGainSketch(buckets)
+            sketch.classes = header["classes"]
+            sketch.class_name = header["class_name"]
+            sketch.rows = header["rows"]
+            sketch.files = header["files"]
+            sketch.class_counts = arrays["class_counts"]
+            for index, state in enumerate(header["attributes"]):
+                name = state.pop("name")
+                for key in ("counts", "keys", "missing"):
+                    if f"{key}_{index}" in arrays:
+                        state[key] = arrays[f"{key}_{index}"]
+                sketch.attributes[name] = state
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return {}, None
+    return header["inputs"], sketch
+
+
+def save_sketch(sketch, inputs, sketch_path):
+    """
+    Saves a sketch and the inputs it covers atomically
+
+    The counts go into an .npz archive as plain arrays (counts_<i>,
+    keys_<i> and missing_<i> for the i-th attribute) next to a JSON header
+    with the version, the inputs, the classes and every attribute's name,
+    kind, precision and nominal values. No pickled objects are written.
+
+    :param sketch: InfoGainSketch
+    :param inputs: Dictionary of absolute path -> [size, mtime_ns]
+    :param sketch_path: Saved sketch path
+    """
+
+    header = {"version": SKETCH_VERSION, "buckets": sketch.buckets,
+              "inputs": inputs, "classes": sketch.classes,
+              "class_name": sketch.class_name, "rows": int(sketch.rows),
+              "files": int(sketch.files), "attributes": []}
+    arrays = {"class_counts": sketch.class_counts}
+    for index, (name, state) in enumerate(sketch.attributes.items()):
+        header["attributes"].append({"name": name, **{
+            key: value for key, value in state.items()
+            if key not in ("counts", "keys", "missing")}})
+        for key in ("counts", "keys", "missing"):
+            if key in state:
+                arrays[f"{key}_{index}"] = state[key]
+    arrays["header"] = np.frombuffer(json.dumps(header).encode("utf-8"),
+                                     dtype=np.uint8)
+    temp_path = sketch_path + ".tmp"
+    with open(temp_path, "wb") as sketch_file:  # A file object: no .npz added
+        np.savez(sketch_file, **arrays)
+    os.replace(temp_path, sketch_path)
+
+
+def update_sketch(entries, sketch_path, workers=1, buckets=BUCKETS,
+                  batch_rows=BATCH_ROWS):
+    """
+    Builds the merged sketch of scanned files, reading only the files the
+    saved sketch does not cover yet
+
+    The saved sketch remembers its inputs by path, size and mtime. If they
+    are all still among the entries and unchanged, only the other files are
+    read and added to it (an incremental merge re-ranks without reading the
+    files merged before); otherwise every file is read again. The result is
+    saved back.
+
+    :param entries: Entry dictionaries from arffscan.scan_files
+    :param sketch_path: Saved sketch path, e.g. the merged file path +
+        SKETCH_SUFFIX
+    :param workers: Number of worker processes reading the files
+    :param buckets: Most values kept per numeric attribute (None: exact)
+    :param batch_rows: Rows decoded at a time
+    :return: InfoGainSketch of all rows of all files
+    """
+
+    current = {os.path.abspath(entry["path"]): [entry["size"], entry["mtime_ns"]]
+               for entry in entries}
+    inputs, sketch = load_sketch(sketch_path, buckets)
+    if sketch is None or any(current.get(path)!=stamp for path, stamp in inputs.items()):
+        inputs, sketch = {}, InfoGainSketch(buckets)  # Rows cannot be taken out
+    new = [entry["path"] for entry in entries
+           if os.path.abspath(entry["path"]) not in inputs]
+    if new or not os.path.exists(sketch_path):
+        sketch.merge(sketch_files(new, workers, buckets, batch_rows))
+        inputs.update((os.path.abspath(path), current[os.path.abspath(path)])
+                      for path in new)
+        save_sketch(sketch, inputs, sketch_path)
+    return sketch
@@ -0,0 +1,77 @@
+"""Checks the attribute selection against WEKA reference results
+
+Every ARFF file listed in expected.json is ranked with arffselect (the
+selection of AttributeSelection (with GUI)/attributeselection.py) and with an
+exact arffsketch sketch (the selection of the merge front ends), and the
+gains and the attributes selected at each threshold are compared with the
+values WEKA's InfoGainAttributeEval + Ranker gives for the same file. Prints
+one line per file and check, and exits with status 1 if any of them differ.
+"""
+
+# Library imports
+import json
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from arffreader import read_arff
+from arffselect import class_index, info_gains, rank_attributes
+from arffsketch import sketch_files
+
+# Constant definitions
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXPECTED_NAME = "expected.json"  # Reference gains and selections, per file
+
+
+def selection_rankings(path):
+    """
+    Ranks the attributes of one file both ways
+
+    :param path: ARFF file path
+    :return: Dictionary of method name -> function of a threshold returning
+        (name, gain) pairs, best first
+    """
+
+    attributes, columns = read_arff(path)
+    target = class_index(attributes)
+    gains = info_gains(attributes, columns, target)
+    sketch = sketch_files([path], buckets=None)
+    return {"arffselect": lambda threshold: [
+                (attributes[index]["name"], float(gains[index]))
+                for index in rank_attributes(gains, target, threshold)],
+            "arffsketch": sketch.ranking}
+
+
+def check_reference(folder=HERE):
+    """
+    Compares the rankings with the reference results
+
+    :param folder: Folder of expected.json and its ARFF files
+    :return: List of mismatch descriptions (empty if everything matches)
+    """
+
+    with open(os.path.join(folder, EXPECTED_NAME)) as file:
+        expected = json.load(file)
+    tolerance = expected["tolerance"]
+    mismatches = []
+    for name, reference in expected["files"].items():
+        for method, ranking in selection_rankings(os.path.join(folder, name)).items():
+            gains = dict(ranking(float("-inf")))
+            for attribute, gain in reference["gains"].items():
+                if abs(gains.get(attribute, 0.0) - gain)>tolerance:
+                    mismatches.append(f"{name} {method}: gain of {attribute} is "
+                                      f"{gains.get(attribute, 0.0):.6f}, expected {gain:.6f}")
+            for threshold, selected in reference["selected"].items():
+                names = [attribute for attribute, _ in ranking(float(threshold))]
+                if names!=selected:
+                    mismatches.append(f"{name} {method}: threshold {threshold} "
+                                      f"selects {names}, expected {selected}")
+            print(f"{name} {method}: checked", flush=True)
+    return mismatches
+
+
+if __name__ == "__main__":
+    mismatches = check_reference()
+    for mismatch in mismatches:
+        print(mismatch)
+    print("All rankings match the reference" if not mismatches else f"{len(mismatches)} mismatches")
+    sys.exit(1 if mismatches else 0)
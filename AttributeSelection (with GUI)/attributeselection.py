@@ -0,0 +1,161 @@
+"""Attribute selection of every ARFF file in a folder, without Java
+
+Python counterpart of Main.processDirectory: each file gets WEKA's
+InfoGainAttributeEval + Ranker selection (information gain above 0.5) and
+is saved as <name>_selection.arff in the output folder, and every task is
+logged to process_log.txt there in the same format. With --union the
+attributes are ranked once over the rows of all files together (streamed,
+in parallel workers) and every file keeps that same set.
+"""
+
+# Library imports
+import argparse
+import logging
+import os
+import sys
+
+# The selection code lives in the sibling "ARFF Merge Engine" folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "ARFF Merge Engine"))
+from arffio import find_arff
+from arffscan import read_header
+from arffschema import header_attributes
+from arffselect import SELECTION_SUFFIX, THRESHOLD, class_index, select_file, selection_path, write_selection
+from arffsketch import BUCKETS, sketch_files
+
+# Constant definitions
+LOG_NAME = "process_log.txt"  # Log file in the output folder, appended to
+LOGGER = logging.getLogger("attributeselection")
+
+
+def setup_logger(output_dir):
+    """
+    Logs to process_log.txt in the output folder and to the console
+
+    :param output_dir: Output folder
+    """
+
+    LOGGER.setLevel(logging.INFO)
+    for handler in list(LOGGER.handlers):
+        LOGGER.removeHandler(handler)
+        handler.close()
+    formatter = logging.Formatter("%(asctime)s %(levelname)s: %(message)s")
+    for handler in (logging.FileHandler(os.path.join(output_dir, LOG_NAME), encoding="utf-8"),
+                    logging.StreamHandler()):
+        handler.setFormatter(formatter)
+        LOGGER.addHandler(handler)
+
+
+def suitable_files(input_dir):
+    """
+    Lists the ARFF files of a folder that are not selections themselves
+
+    :param input_dir: Input folder
+    :return: Sorted file paths
+    """
+
+    return sorted(path for path in find_arff(input_dir)
+                  if SELECTION_SUFFIX not in os.path.basename(path).lower())
+
+
+def process_directory(input_dir, output_dir, threshold=THRESHOLD):
+    """
+    Selects the attributes of every ARFF file in a folder
+
+    :param input_dir: Input folder (files already named *_selection are skipped)
+    :param output_dir: Output folder
+    :param threshold: Information gain threshold
+    :return: List of select_file results of the files that succeeded
+    """
+
+    files = suitable_files(input_dir)
+    if not files:
+        LOGGER.info("No suitable ARFF files found in the directory.")
+        return []
+
+    LOGGER.info(f"Total number of suitable ARFF files found: {len(files)}")
+    results = []
+    for task, path in enumerate(files, 1):
+        LOGGER.info(f"Processing task {task}")
+        try:
+            result = select_file(path, output_dir, threshold)
+        except (OSError, ValueError) as error:
+            LOGGER.info(f"Error processing file: {os.path.basename(path)} ({error})")
+            continue
+        results.append(result)
+        LOGGER.info(f"Task {task} // Input file: {os.path.basename(path)} - attributes: {result['attributes']} "
+                    f"// Output file: {os.path.basename(result['output'])} - attributes: {result['kept']} "
+                    f"- Save {'successful' if os.path.exists(result['output']) else 'failed'}")
+    LOGGER.info("All tasks completed successfully.")
+    return results
+
+
+def process_union(input_dir, output_dir, threshold=THRESHOLD, workers=1, buckets=BUCKETS):
+    """
+    Ranks the attributes over the rows of all ARFF files of a folder together
+    and writes every file with the attributes selected that way
+
+    The files are read once, in row batches, into mergeable per-class counts
+    (arffsketch), so the folder does not have to fit in memory.
+
+    :param input_dir: Input folder (files already named *_selection are skipped)
+    :param output_dir: Output folder
+    :param threshold: Information gain threshold
+    :param workers: Number of processes reading the files
+    :param buckets: Most values kept per numeric attribute (None: exact)
+    :return: Ranking as a list of (name, gain) pairs, best first
+    """
+
+    files = suitable_files(input_dir)
+    if not files:
+        LOGGER.info("No suitable ARFF files found in the directory.")
+        return []
+
+    LOGGER.info(f"Total number of suitable ARFF files found: {len(files)}")
+    try:
+        sketch = sketch_files(files, workers, buckets)
+    except (OSError, ValueError) as error:
+        LOGGER.info(f"Error ranking the attributes: {error}")
+        return []
+    ranking = sketch.ranking(threshold)
+    LOGGER.info(f"Ranked {len(sketch.attributes)} attributes over {sketch.rows} rows of {sketch.files} files, "
+                f"{len(ranking)} above {threshold}")
+    for name, gain in ranking:
+        LOGGER.info(f"{gain:.6f} {name}")
+
+    selected = {name for name, _ in ranking}
+    for task, path in enumerate(files, 1):
+        LOGGER.info(f"Processing task {task}")
+        try:
+            names = [name for name, _ in header_attributes(read_header(path)[0])]
+            target = class_index([{"name": name} for name in names])
+            keep = [index for index, name in enumerate(names) if name in selected] + [target]
+            output_path = selection_path(path, output_dir)
+            write_selection(path, output_path, keep)
+        except (OSError, ValueError) as error:
+            LOGGER.info(f"Error processing file: {os.path.basename(path)} ({error})")
+            continue
+        LOGGER.info(f"Task {task} // Input file: {os.path.basename(path)} - attributes: {len(names)} "
+                    f"// Output file: {os.path.basename(output_path)} - attributes: {len(keep)} "
+                    f"- Save {'successful' if os.path.exists(output_path) else 'failed'}")
+    LOGGER.info("All tasks completed successfully.")
+    return ranking
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the attributes of every ARFF file in a folder whose information gain "
+                                                 "about the class is above a threshold (WEKA InfoGainAttributeEval + Ranker)")
+    parser.add_argument("input_dir", help="folder of the ARFF files")
+    parser.add_argument("output_dir", help="folder the *_selection.arff files and process_log.txt are written to")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD, help=f"information gain threshold (default {THRESHOLD})")
+    parser.add_argument("--union", action="store_true", help="rank the attributes once over all files together and keep the same set in every file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="processes reading the files with --union (default: all cores)")
+    parser.add_argument("--buckets", type=int, default=BUCKETS,
+                        help=f"values kept per numeric attribute with --union before neighbouring values are pooled (default {BUCKETS}, 0 keeps all)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    setup_logger(args.output_dir)
+    if args.union:
+        process_union(args.input_dir, args.output_dir, args.threshold, args.workers, args.buckets or None)
+    else:
+        process_directory(args.input_dir, args.output_dir, args.threshold)
@@ -0,0 +1,424 @@
+"""Z-slab parallel 3D blurs of TIFF stacks
+
+The blurs of macro1b are run on Z slabs of the stack instead of the whole
+volume. Each slab is read with a halo of the pages its kernel reaches above
+and below, blurred, and only its own pages are kept, so the result is
+bit-identical to blurring the whole volume (at the top and bottom of the
+stack the slab edge is the volume edge, as before). The slabs are blurred by
+a pool of worker processes, each opening the file once and reading its
+slabs straight from it (stackio), and finished slabs are streamed to the
+output TIFF in order: memory follows the slab size and the number of
+workers, not the volume.
+
+The median of 8-bit stacks can also be taken from gray-level histograms
+instead of sorting every neighbourhood: for each gray level the voxels at or
+below it are counted in every window with box filters, and a voxel's median
+is the number of levels whose count does not reach half the window. The
+cost per voxel is fixed (one box count per gray level in the stack), so large
+kernels cost as much as small ones, and the result equals scipy's.
+
+The mean blur is a true 3D box mean with independent Z, Y and X sizes, read
+from a summed-volume table (IntegralVolume): every box sum is eight table
+lookups whatever the kernel size, and one table serves several kernel sizes
+of the same stack (mean_stacks).
+"""
+
+# Library imports
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import os
+import cv2
+import numpy as np
+from scipy.ndimage import gaussian_filter, median_filter
+from stackio import WORKERS, StackWriter, open_stack, slab_depth
+
+# Constant definitions
+TRUNCATE = 4.0  # Gaussian kernel radius in sigmas (scipy's default)
+OUTPUT_COMPRESSION = "none"  # Blurred stacks are saved uncompressed
+MEDIAN_BACKENDS = ("auto", "histogram", "sort")  # Median algorithms
+MEDIAN_BACKEND = "auto"  # Histogram median for 8-bit stacks and kernels
+# larger than HISTOGRAM_VOLUME, else sorting (scipy)
+HISTOGRAM_VOLUME = 27  # Largest kernel volume sorted by the auto backend
+worker_stack = None  # Stack a worker process opened once (open_worker_stack)
+
+
+def to_uint8(blurred):
+    """
+    Clips a blurred stack to 8 bits
+
+    :param blurred: Blurred stack
+    :return: uint8 stack, values clipped to [0, 255]
+    """
+
+    return np.clip(blurred, 0, 255).astype(np.uint8)
+
+
+def gaussian_blur(image_array, sizes):
+    """
+    3D Gaussian blur
+
+    :param image_array: Stack as a 3D array (Z, Y, X)
+    :param sizes: Sigmas (Z, Y, X)
+    :return: Blurred uint8 stack
+    """
+
+    return to_uint8(gaussian_filter(image_array, sigma=sizes, truncate=TRUNCATE))
+
+
+def histogram_median(image_array, sizes):
+    """
+    3D median of an 8-bit stack from gray-level histograms
+
+    Same result as scipy's median_filter (mode "reflect", upper median of
+    even windows) at a cost per voxel that does not depend on the kernel.
+
+    :param image_array: uint8 stack as a 3D array (Z, Y, X)
+    :param sizes: Kernel sizes (Z, Y, X)
+    :return: Median uint8 stack
+    """
+
+    image_array = np.asarray(image_array)
+    if image_array.dtype!=np.uint8:
+        raise ValueError("The histogram median needs an 8-bit stack")
+    size_z, size_y, size_x = (int(size) for size in sizes)
+    depth, height, width = image_array.shape
+    padded = np.pad(image_array, [(size // 2, size - 1 - size // 2) for size in (size_z, size_y, size_x)],
+                    mode="symmetric")  # scipy's "reflect"
+    rank = size_z * size_y * size_x // 2
+    count_type = cv2.CV_16U if size_z * size_y * size_x<65536 else cv2.CV_32S
+    low, high = int(image_array.min()), int(image_array.max())
+
+    # The median is the lowest level with more than rank voxels at or below
+    # it in the window, i.e. low + the levels from low up with at most rank
+    columns = padded.reshape(padded.shape[0], -1)  # One column per (Y, X) pixel
+    below = np.empty_like(columns)
+    median = np.full(image_array.shape, low, dtype=np.uint8)
+    for level in range(low, high):
+        np.less_equal(columns, level, out=below.view(bool))
+        counts = cv2.boxFilter(below, count_type, (1, size_z), anchor=(0, size_z // 2),
+                               normalize=False, borderType=cv2.BORDER_CONSTANT)  # Along Z
+        planes = counts[size_z // 2:size_z // 2 + depth].reshape(depth * padded.shape[1], padded.shape[2])
+        counts = cv2.boxFilter(planes, count_type, (size_x, size_y), normalize=False,
+                               borderType=cv2.BORDER_CONSTANT)  # Along Y and X; the padding
+        # rows between planes absorb the window crossing them
+        counts = counts.reshape(depth, padded.shape[1], padded.shape[2])[
+            :, size_y // 2:size_y // 2 + height, size_x // 2:size_x // 2 + width]
+        median += counts<=rank
+    return median
+
+
+def median_blur(image_array, sizes, backend=MEDIAN_BACKEND):
+    """
+    3D median blur
+
+    :param image_array: Stack as a 3D array (Z, Y, X)
+    :param sizes: Kernel sizes (Z, Y, X)
+    :param backend: "histogram" (8-bit stacks, constant time per voxel),
+        "sort" (scipy) or "auto" (histogram for 8-bit stacks and kernels of
+        more than HISTOGRAM_VOLUME voxels)
+    :return: Blurred uint8 stack
+    """
+
+    if backend not in MEDIAN_BACKENDS:
+        raise ValueError(f"Unknown median backend {backend}, use one of {', '.join(MEDIAN_BACKENDS)}")
+    if backend=="auto":
+        backend = "histogram" if np.asarray(image_array).dtype==np.uint8 \
+            and int(np.prod(sizes))>HISTOGRAM_VOLUME else "sort"
+    if backend=="histogram":
+        return histogram_median(image_array, sizes)
+    return to_uint8(median_filter(image_array, size=sizes))
+
+
+class IntegralVolume:
+    """Summed-volume table of a stack, giving box sums of any size up to a largest one"""
+
+    def __init__(self, image_array, largest):
+        """
+        Builds the table of the stack padded for the largest kernel
+
+        :param image_array: Stack as a 3D array (Z, Y, X)
+        :param largest: Largest kernel sizes (Z, Y, X) that will be asked for
+        """
+
+        image_array = np.asarray(image_array)
+        self.shape = image_array.shape
+        self.pads = [(int(size) // 2, int(size) - 1 - int(size) // 2) for size in largest]
+        padded = np.pad(image_array, self.pads, mode="symmetric")  # scipy's "reflect"
+        if image_array.dtype.kind in "ub" and image_array.dtype.itemsize<=2 \
+                and np.iinfo(np.uint16).max * int(np.prod(largest))<2**32:
+            self.dtype = np.uint32  # Box sums fit, so sums taken modulo 2^32
+            # are exact even where the running table wraps around
+        elif image_array.dtype.kind in "iub":
+            self.dtype = np.int64
+        else:
+            self.dtype = np.float64
+        self.table = np.zeros([size + 1 for size in padded.shape], dtype=self.dtype)
+        inner = self.table[1:, 1:, 1:]
+        np.cumsum(padded, axis=0, dtype=self.dtype, out=inner)
+        np.cumsum(inner, axis=1, dtype=self.dtype, out=inner)
+        np.cumsum(inner, axis=2, dtype=self.dtype, out=inner)
+
+    def box_sum(self, sizes):
+        """
+        Sums every voxel's box (window [i - size // 2, i + size - 1 - size // 2]
+        along each axis, as scipy's filters)
+
+        :param sizes: Kernel sizes (Z, Y, X), at most the table's largest
+        :return: Box sums (Z, Y, X)
+        """
+
+        lows, highs = [], []
+        for (before, after), size, length in zip(self.pads, sizes, self.shape):
+            size = int(size)
+            if size<1 or size // 2>before or size - 1 - size // 2>after:
+                raise ValueError(f"Kernel sizes {tuple(sizes)} do not fit the integral volume")
+            start = before - size // 2  # Table row before the first window
+            lows.append(slice(start, start + length))
+            highs.append(slice(start + size, start + size + length))
+
+        table = self.table
+        (z0, y0, x0), (z1, y1, x1) = lows, highs
+        total = table[z1, y1, x1] - table[z0, y1, x1]
+        total -= table[z1, y0, x1]
+        total -= table[z1, y1, x0]
+        total += table[z0, y0, x1]
+        total += table[z0, y1, x0]
+        total += table[z1, y0, x0]
+        total -= table[z0, y0, x0]
+        return total
+
+    def mean(self, sizes):
+        """
+        3D box mean
+
+        :param sizes: Kernel sizes (Z, Y, X), at most the table's largest
+        :return: Mean uint8 stack, rounded to the nearest value
+        """
+
+        return to_uint8(np.rint(self.box_sum(sizes) / float(np.prod([int(size) for size in sizes]))))
+
+
+def mean_blur(image_array, sizes):
+    """
+    3D mean blur (box mean with independent Z, Y and X sizes)
+
+    :param image_array: Stack as a 3D array (Z, Y, X)
+    :param sizes: Kernel sizes (Z, Y, X)
+    :return: Blurred uint8 stack
+    """
+
+    return IntegralVolume(image_array, sizes).mean(sizes)
+
+
+BLURS = {"Gaussian": gaussian_blur, "Median": median_blur, "Mean": mean_blur}  # Blur
+# type -> function
+
+
+def blur_halo(blur_type, sizes):
+    """
+    Pages a blur reaches above and below a page
+
+    :param blur_type: "Gaussian", "Median" or "Mean"
+    :param sizes: Sigmas or kernel sizes (Z, Y, X)
+    :return: Number of halo pages on each side of a slab
+    """
+
+    if blur_type=="Gaussian":
+        return int(TRUNCATE * float(sizes[0]) + 0.5)
+    if blur_type in ("Median", "Mean"):
+        return int(sizes[0]) // 2
+    raise ValueError(f"Unknown blur type {blur_type}, use one of {', '.join(BLURS)}")
+
+
+def blur_slab(path, start, stop, blur_type, sizes, median_backend=MEDIAN_BACKEND, stack=None):
+    """
+    Blurs the pages start to stop - 1 of a stack file
+
+    :param path: TIFF file path
+    :param start: First page index
+    :param stop: Page index after the last one
+    :param blur_type: "Gaussian", "Median" or "Mean"
+    :param sizes: Sigmas or kernel sizes (Z, Y, X)
+    :param median_backend: Median algorithm (see median_blur)
+    :param stack: Stack already opened from path (each worker opens its own
+        once, see open_worker_stack)
+    :return: Blurred uint8 slab (stop - start, Y, X)
+    """
+
+    stack = stack if stack is not None else open_stack(path)
+    halo = blur_halo(blur_type, sizes)
+    low, high = max(start - halo, 0), min(stop + halo, len(stack))
+    options = {"backend": median_backend} if blur_type=="Median" else {}
+    blurred = BLURS[blur_type](np.asarray(stack[low:high]), sizes, **options)
+    return blurred[start - low:stop - low]
+
+
+def mean_slabs(path, start, stop, sizes_list, stack=None):
+    """
+    3D means of several kernel sizes of the pages start to stop - 1 of a
+    stack file, from one integral volume
+
+    :param path: TIFF file path
+    :param start: First page index
+    :param stop: Page index after the last one
+    :param sizes_list: List of kernel sizes (Z, Y, X)
+    :param stack: Stack already opened from path (each worker opens its own
+        once, see open_worker_stack)
+    :return: List of blurred uint8 slabs (stop - start, Y, X), one per size
+    """
+
+    stack = stack if stack is not None else open_stack(path)
+    halo = max(blur_halo("Mean", sizes) for sizes in sizes_list)
+    low, high = max(start - halo, 0), min(stop + halo, len(stack))
+    largest = [max(int(sizes[axis]) for sizes in sizes_list) for axis in range(3)]
+    volume = IntegralVolume(stack[low:high], largest)
+    return [volume.mean(sizes)[start - low:stop - low] for sizes in sizes_list]
+
+
+def open_worker_stack(path):
+    """
+    Opens the stack once in a worker process (the pool's initializer), so its
+    slabs reuse the open file and its page cache
+
+    :param path: TIFF file path
+    """
+
+    global worker_stack
+    worker_stack = open_stack(path)
+
+
+def worker_slab(function, path, start, stop, *arguments):
+    """
+    Runs a slab function in a worker process on the stack it opened
+
+    :param function: Slab function (see run_slabs)
+    :param path: TIFF file path
+    :param start: First page index
+    :param stop: Page index after the last one
+    :param arguments: Further arguments of the function
+    :return: What the function returns
+    """
+
+    return function(path, start, stop, *arguments, stack=worker_stack)
+
+
+def run_slabs(path, writers, function, arguments, halo, workers=WORKERS, depth=None):
+    """
+    Runs a slab function over a stack file and streams its slabs in order
+
+    :param path: TIFF file path
+    :param writers: StackWriters, one per slab the function returns
+    :param function: function(path, start, stop, *arguments, stack=None)
+        returning a slab or a list of slabs (one per writer)
+    :param arguments: Further arguments of the function
+    :param halo: Halo pages of the function
+    :param workers: Number of processes (1: in this process)
+    :param depth: Pages per slab (default: stackio's slab size, at least the
+        halo)
+    :return: Shape of the stack (Z, Y, X)
+    """
+
+    stack = open_stack(path)
+    depth = depth or max(slab_depth(stack), halo, 1)
+    slabs = [(start, min(start + depth, len(stack))) for start in range(0, len(stack), depth)]
+
+    def write(result):
+        for writer, slab in zip(writers, result if isinstance(result, list) else [result]):
+            writer.write(slab)
+
+    if workers<=1:
+        for start, stop in slabs:
+            write(function(path, start, stop, *arguments, stack=stack))
+        return stack.shape
+
+    # Keep at most twice as many slabs in flight as workers and write them
+    # in stack order
+    pending = deque()
+    with ProcessPoolExecutor(workers, initializer=open_worker_stack, initargs=(path,)) as pool:
+        for start, stop in slabs:
+            if len(pending)>=2 * workers:
+                write(pending.popleft().result())
+            pending.append(pool.submit(worker_slab, function, path, start, stop, *arguments))
+        while pending:
+            write(pending.popleft().result())
+    return stack.shape
+
+
+def blur_stack(path, output_path, blur_type, sizes, workers=WORKERS, depth=None,
+               median_backend=MEDIAN_BACKEND):
+    """
+    Blurs a stack file slab by slab and streams the result to a TIFF file
+
+    :param path: Input TIFF file path
+    :param output_path: Output TIFF file path
+    :param blur_type: "Gaussian", "Median" or "Mean"
+    :param sizes: Sigmas or kernel sizes (Z, Y, X)
+    :param workers: Number of processes blurring slabs (1: in this process)
+    :param depth: Pages per slab (default: stackio's slab size, at least the
+        halo)
+    :param median_backend: Median algorithm (see median_blur)
+    :return: Shape of the stack (Z, Y, X)
+    """
+
+    halo = blur_halo(blur_type, sizes)
+    with StackWriter(output_path, OUTPUT_COMPRESSION) as writer:
+        return run_slabs(path, [writer], blur_slab, (blur_type, sizes, median_backend),
+                         halo, workers, depth)
+
+
+def mean_stacks(path, output_paths, sizes_list, workers=WORKERS, depth=None):
+    """
+    3D means of one stack file with several kernel sizes, each slab's
+    integral volume shared by all sizes
+
+    :param path: Input TIFF file path
+    :param output_paths: Output TIFF file paths, one per size
+    :param sizes_list: List of kernel sizes (Z, Y, X)
+    :param workers: Number of processes blurring slabs (1: in this process)
+    :param depth: Pages per slab (default: stackio's slab size, at least the
+        halo)
+    :return: Shape of the stack (Z, Y, X)
+    """
+
+    if len(output_paths)!=len(sizes_list):
+        raise ValueError("Give one output path per kernel size")
+    halo = max(blur_halo("Mean", sizes) for sizes in sizes_list)
+    writers = [StackWriter(output_path, OUTPUT_COMPRESSION) for output_path in output_paths]
+    try:
+        return run_slabs(path, writers, mean_slabs, (sizes_list,), halo, workers, depth)
+    finally:
+        for writer in writers:
+            writer.close()
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="Blur a TIFF stack in Z slabs on parallel workers (macro1b's blurs)")
+    parser.add_argument("input", help="input TIFF stack")
+    parser.add_argument("output", help="output TIFF stack (8-bit)")
+    parser.add_argument("blur_type", choices=list(BLURS), help="blur type")
+    parser.add_argument("sizes", type=float, nargs=3, metavar=("Z", "Y", "X"),
+                        help="Gaussian sigmas or kernel sizes along Z, Y and X")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="processes blurring slabs (default: all cores)")
+    parser.add_argument("--median-backend", choices=MEDIAN_BACKENDS, default=MEDIAN_BACKEND,
+                        help=f"median algorithm (default {MEDIAN_BACKEND})")
+    parser.add_argument("--mean-size", type=int, nargs=3, action="append", default=[], metavar=("Z", "Y", "X"),
+                        help="another Mean kernel size, blurred in the same pass from the same integral volumes and saved "
+                             "as <output>_<Z>x<Y>x<X>.tif (repeatable; Mean only)")
+    args = parser.parse_args()
+    if args.mean_size and args.blur_type!="Mean":
+        parser.error("--mean-size needs the Mean blur")
+
+    sizes = tuple(args.sizes) if args.blur_type=="Gaussian" else tuple(int(size) for size in args.sizes)
+    if args.mean_size:
+        # One pass over the stack: each slab's integral volume serves every size
+        stem, extension = os.path.splitext(args.output)
+        sizes_list = [sizes] + [tuple(more) for more in args.mean_size]
+        outputs = [args.output] + [f"{stem}_{z}x{y}x{x}{extension or '.tif'}" for z, y, x in args.mean_size]
+        shape = mean_stacks(args.input, outputs, sizes_list, args.workers)
+        for more, output in zip(sizes_list, outputs):
+            print(f"Saved Mean blur {more} of {shape} stack: {output}")
+    else:
+        shape = blur_stack(args.input, args.output, args.blur_type, sizes, args.workers,
+                           median_backend=args.median_backend)
+        print(f"Saved {args.blur_type} blur of {shape} stack: {args.output}")
@@ -0,0 +1,207 @@
+"""Sparse label archives of MIB models
+
+A model with many small labels is mostly background in every mask stack, so
+instead of one full-size stack per label all labels can be kept in one
+compressed NumPy archive (.npz): the stack shape, the label values, each
+label's voxel count and bounding box, and its voxels as runs of consecutive
+flat indices ("rle") or as the flat indices themselves ("coords"). The
+archive is built slab by slab from a label stack and its size and writing
+time follow the labelled voxels, not labels x volume. LabelArchive rebuilds
+any label's mask, whole or cropped to its bounding box, on demand.
+"""
+
+# Library imports
+import numpy as np
+from labelsplit import MASK_ON, label_layout, label_voxels
+from stackio import iter_slabs
+
+# Constant definitions
+ENCODINGS = ("rle", "coords")  # Voxel encodings of an archive
+ENCODING = "rle"  # Default voxel encoding
+
+
+def voxel_runs(voxels):
+    """
+    Run-length encodes ascending flat voxel indices
+
+    :param voxels: Ascending flat indices (1D array)
+    :return: Start and length of every run of consecutive indices
+    """
+
+    if not len(voxels):
+        return voxels[:0], voxels[:0]
+    breaks = np.flatnonzero(np.diff(voxels)!=1) + 1
+    firsts = np.concatenate([[0], breaks])
+    lengths = np.diff(np.concatenate([firsts, [len(voxels)]]))
+    return voxels[firsts], lengths
+
+
+def join_runs(starts, lengths):
+    """
+    Joins runs that continue one another (e.g. across two slabs)
+
+    :param starts: Run starts, ascending
+    :param lengths: Run lengths
+    :return: Joined run starts and lengths
+    """
+
+    if len(starts)<2:
+        return starts, lengths
+    follows = starts[1:]==starts[:-1] + lengths[:-1]
+    groups = np.concatenate([[0], np.cumsum(~follows)])
+    return starts[np.concatenate([[True], ~follows])], np.bincount(groups, lengths).astype(lengths.dtype)
+
+
+def run_voxels(starts, lengths):
+    """
+    Expands runs back into flat voxel indices
+
+    :param starts: Run starts
+    :param lengths: Run lengths
+    :return: Ascending flat indices
+    """
+
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - (ends - lengths), lengths)
+
+
+def archive_labels(image_stack, archive_path, encoding=ENCODING, depth=None):
+    """
+    Writes the labels of a stack to a sparse archive
+
+    :param image_stack: Label stack as a 3D array-like (Z, Y, X), e.g. a
+        TiffStack; read in Z slabs
+    :param archive_path: Archive file path (.npz)
+    :param encoding: "rle" (runs of consecutive voxels) or "coords" (flat
+        voxel indices)
+    :param depth: Pages per slab (default: stackio's slab size)
+    :return: Label values in the archive
+    """
+
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown encoding {encoding}, use one of {', '.join(ENCODINGS)}")
+    shape = tuple(image_stack.shape)
+    plane = shape[1] * shape[2]
+    labels = {}  # Value -> {"chunks": voxel arrays or (starts, lengths) per slab, "low", "high", "count"}
+    for start, slab in iter_slabs(image_stack, depth):
+        layout = label_layout(slab)
+        for index, value in enumerate(layout["values"]):
+            voxels = label_voxels(layout, index) + start * plane  # Flat index
+            # in the whole stack
+            z, rest = np.divmod(voxels, plane)
+            y, x = np.divmod(rest, shape[2])
+            low = [int(z[0]), int(y.min()), int(x.min())]
+            high = [int(z[-1]) + 1, int(y.max()) + 1, int(x.max()) + 1]
+            label = labels.setdefault(value.item(), {"chunks": [], "low": low, "high": high, "count": 0})
+            label["low"] = [min(a, b) for a, b in zip(label["low"], low)]
+            label["high"] = [max(a, b) for a, b in zip(label["high"], high)]
+            label["count"] += len(voxels)
+            label["chunks"].append(voxel_runs(voxels) if encoding=="rle" else voxels)
+
+    # Flatten the labels into a few arrays, each label a segment of them
+    values = sorted(labels)
+    arrays = {"shape": np.array(shape, dtype=np.int64),
+              "values": np.array(values, dtype=image_stack.dtype),
+              "counts": np.array([labels[value]["count"] for value in values], dtype=np.int64),
+              "boxes": np.array([labels[value]["low"] + labels[value]["high"] for value in values],
+                                dtype=np.int64).reshape(-1, 6),
+              "encoding": np.array(encoding)}
+    segments = []
+    for value in values:
+        chunks = labels.pop(value)["chunks"]
+        if encoding=="rle":
+            segments.append(join_runs(np.concatenate([starts for starts, _ in chunks]),
+                                      np.concatenate([lengths for _, lengths in chunks])))
+        else:
+            segments.append((np.concatenate(chunks),))
+    sizes = [len(segment[0]) for segment in segments]
+    arrays["offsets"] = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    keys = ("starts", "lengths") if encoding=="rle" else ("voxels",)
+    for position, key in enumerate(keys):
+        arrays[key] = np.concatenate([segment[position] for segment in segments]) if segments \
+            else np.zeros(0, dtype=np.int64)
+    with open(archive_path, "wb") as file:  # An open file keeps the name as given
+        np.savez_compressed(file, **arrays)
+    return values
+
+
+class LabelArchive:
+    """Sparse label archive, rebuilding label masks on demand"""
+
+    def __init__(self, archive_path):
+        """
+        Opens an archive
+
+        :param archive_path: Archive file path (.npz)
+        """
+
+        with np.load(archive_path) as archive:
+            self.shape = tuple(int(size) for size in archive["shape"])
+            self.values = archive["values"]
+            self.counts = archive["counts"]
+            self.boxes = archive["boxes"]
+            self.encoding = str(archive["encoding"])
+            self.offsets = archive["offsets"]
+            self.data = [archive[key] for key in (("starts", "lengths") if self.encoding=="rle" else ("voxels",))]
+        self.index = {value.item(): position for position, value in enumerate(self.values)}
+
+    def __len__(self):
+        return len(self.values)
+
+    def position(self, value):
+        """
+        Finds a label
+
+        :param value: Label value
+        :return: Position of the label in values
+        """
+
+        if value not in self.index:
+            raise ValueError(f"Label {value} is not in the archive")
+        return self.index[value]
+
+    def box(self, value):
+        """
+        Bounding box of a label
+
+        :param value: Label value
+        :return: Tuple of slices (Z, Y, X) selecting the box in the stack
+        """
+
+        low_z, low_y, low_x, high_z, high_y, high_x = (int(bound) for bound in self.boxes[self.position(value)])
+        return slice(low_z, high_z), slice(low_y, high_y), slice(low_x, high_x)
+
+    def voxels(self, value):
+        """
+        Flat voxel indices of a label
+
+        :param value: Label value
+        :return: Ascending flat indices in the whole stack
+        """
+
+        position = self.position(value)
+        segment = slice(self.offsets[position], self.offsets[position+1])
+        if self.encoding=="rle":
+            return run_voxels(self.data[0][segment], self.data[1][segment])
+        return self.data[0][segment]
+
+    def mask(self, value, crop=False, dtype=np.uint8):
+        """
+        Rebuilds the mask stack of a label
+
+        :param value: Label value
+        :param crop: Rebuild only the label's bounding box (see box)
+        :param dtype: Mask type (bool for True where the label is)
+        :return: Mask as an array (Z, Y, X), MASK_ON where the label is
+        """
+
+        voxels = self.voxels(value)
+        if not crop:
+            mask = np.zeros(self.shape, dtype=dtype)
+            mask.reshape(-1)[voxels] = MASK_ON
+            return mask
+        box = self.box(value)
+        mask = np.zeros([part.stop - part.start for part in box], dtype=dtype)
+        z, y, x = np.unravel_index(voxels, self.shape)
+        mask[z - box[0].start, y - box[1].start, x - box[2].start] = MASK_ON
+        return mask
@@ -0,0 +1,97 @@
+"""Single-pass label layout of MIB models
+
+Instead of comparing every voxel with every label (one cv2.inRange pass over
+the stack per label), the labelled voxels are grouped by label once: the
+labels are turned into small integer codes and the voxel positions are
+sorted by code with a stable radix sort, so each label's voxels end up in one
+contiguous run, in stack order. Every label's mask is then written straight
+from its run. The work is proportional to the number of voxels, whatever the
+number of labels.
+"""
+
+# Library imports
+import numpy as np
+
+# Constant definitions
+BACKGROUND = 0  # Label value that gets no mask
+MASK_ON = 255  # Mask value of a labelled voxel (as cv2.inRange)
+RADIX_CODES = 1 << 16  # Largest number of codes sorted by NumPy's radix sort
+
+
+def label_codes(labels):
+    """
+    Maps label values onto consecutive integer codes
+
+    :param labels: Label values of the labelled voxels (1D array)
+    :return: Sorted distinct label values and the code of every voxel, in the
+        smallest unsigned type that holds them (8/16 bit codes are sorted by
+        NumPy's radix sort, in linear time)
+    """
+
+    if labels.dtype.kind in "iub" and len(labels):
+        low = int(labels.min())
+        span = int(labels.max()) - low + 1
+        if span<=RADIX_CODES:  # Small value range: a lookup table, no sort
+            offsets = (labels - low).astype(np.min_scalar_type(span - 1))
+            present = np.bincount(offsets, minlength=span)>0
+            values = (np.flatnonzero(present) + low).astype(labels.dtype)
+            lookup = (np.cumsum(present) - 1).astype(
+                np.min_scalar_type(max(len(values) - 1, 0)))
+            return values, lookup[offsets]
+    values, codes = np.unique(labels, return_inverse=True)
+    return values, codes.astype(np.min_scalar_type(max(len(values) - 1, 0)))
+
+
+def label_layout(image_stack):
+    """
+    Groups the voxels of a label stack by label in one pass
+
+    :param image_stack: Label stack as a 3D array (Z, Y, X) or list of slices
+    :return: Dictionary with "shape", "values" (sorted labels other than the
+        background), "counts" (voxels per label), "starts" (start of each
+        label's run in "voxels") and "voxels" (flat voxel indices grouped by
+        label, ascending within a label)
+    """
+
+    image_stack = np.asarray(image_stack)
+    shape = image_stack.shape
+    flat = image_stack.reshape(-1)
+    voxels = np.flatnonzero(flat!=BACKGROUND)  # Background is usually most of
+    # the stack, so only the labelled voxels are grouped
+    values, codes = label_codes(flat[voxels])
+    order = np.argsort(codes, kind="stable")
+    voxels = order if len(voxels)==len(flat) else voxels[order]  # No background:
+    # the positions are the voxel indices
+    counts = np.bincount(codes, minlength=len(values))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    return {"shape": shape, "values": values, "counts": counts,
+            "starts": starts, "voxels": voxels}
+
+
+def label_voxels(layout, index):
+    """
+    Gets the flat voxel indices of one label
+
+    :param layout: Layout from label_layout
+    :param index: Position of the label in layout["values"]
+    :return: Flat voxel indices, ascending
+    """
+
+    start = layout["starts"][index]
+    return layout["voxels"][start:start + layout["counts"][index]]
+
+
+def label_mask(layout, index, dtype=np.uint8):
+    """
+    Builds the binary mask stack of one label
+
+    :param layout: Layout from label_layout
+    :param index: Position of the label in layout["values"]
+    :param dtype: Mask type (bool for True where the label is)
+    :return: Mask stack as an array (Z, Y, X), MASK_ON where the label is
+    """
+
+    mask = np.zeros(layout["shape"], dtype=dtype)
+    mask.reshape(-1)[label_voxels(layout, index)] = MASK_ON
+    return mask
+
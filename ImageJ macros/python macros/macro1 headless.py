@@ -1,105 +1,325 @@
 # Library imports
-from tkinter import Tk
-from tkinter import filedialog
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import contextlib
+import hashlib
+import json
 import numpy as np
-import cv2
 import os
+import time
+from labelarchive import ENCODING, archive_labels
+from labelsplit import label_layout, label_mask
+from stackio import COMPRESSION, WORKERS, WriterPool, iter_slabs, open_stack
 
 # Constant definitions
 ERROR = -1  # Error flag
 INIT_N = 0  # Initial number
 INIT_I = 0  # Initial index
+MANIFEST_NAME = "macro1_manifest.json"  # Batch manifest in the output directory
+REPORT_NAME = "macro1_report.jsonl"  # Batch report in the output directory
+IMAGE_EXTENSIONS = (".tif", ".tiff")  # Inputs of a batch
+HASH_CHUNK = 1 << 20  # Bytes read at a time when hashing an input
 
 
 def load_image_stack(image_path):
     """
-    Load multi-page TIFF image stack
+    Open multi-page TIFF image stack without loading it
 
     :param image_path: Image file path
-    :return: Image stack as list of NumPy arrays
+    :return: Image stack as a TiffStack (3D array-like, memory-mapped if
+        uncompressed, else decoded page by page), read in Z slabs
     """
 
-    # Open image and initialise empty image stack
-    image = Image.open(image_path)
-    image_stack = []
+    return open_stack(image_path)
+
+
+def image_split(image_path, mask_dir, mask_prefix, workers=WORKERS,
+                compression=COMPRESSION, level=None):
+    """
+    Splits image into binary masks based on unique pixel values
+
+    :param image_path: Image file path
+    :param mask_dir: Masks' output directory
+    :param mask_prefix: Masks' filename prefix
+    :param workers: Number of threads writing the masks
+    :param compression: Masks' compression ("none", "packbits", "lzw" or
+        "deflate")
+    :param level: Deflate level (1 fastest to 9 smallest), or None
+    :return: Saved mask stack paths, or ERROR
+    """
+
+    image_stack = load_image_stack(image_path)  # Open image stack (32-bit TIFF
+    # image)
+    if len(image_stack)==INIT_N:
+        print("Image stack load failed")
+        return ERROR
+
+    # Split the stack slab by slab, so only one slab is in memory; each mask
+    # stack is written page by page from the slab its label is first met in.
+    # Masks are 1-bit pages, encoded and written by the pool's threads while
+    # the next label's mask is built
+    writers = {}  # Pixel value -> StackWriter of its mask stack
+    blank = np.zeros(image_stack.shape[1:], dtype=bool)  # Slice without the
+    # label
+    with WriterPool(workers, compression, level) as pool:
+        for start, slab in iter_slabs(image_stack):
+            layout = label_layout(slab)  # Group the voxels by pixel value in
+            # one pass (value 0 is skipped, its mask would be the inverted image)
+            present = {value.item(): label for label, value in enumerate(layout["values"])}
+            for value in present:
+                if value not in writers:
+                    index = f"{value:02d}"  # Add leading zero for single-digit
+                    # indices
+                    mask_stack_path = os.path.join(mask_dir, f"{mask_prefix}_{index}.tif")
+                    writers[value] = pool.open(mask_stack_path)
+                    pool.write(writers[value], [blank] * start)  # Slices before
+                    # the label was met
+
+            # Add the slab's slices to every mask stack
+            for value, writer in writers.items():
+                if value in present:
+                    pool.write(writer, label_mask(layout, present[value], bool))
+                else:
+                    pool.write(writer, [blank] * len(slab))
+
+        # Finish mask stacks
+        for value in sorted(writers):
+            pool.close(writers[value])
+            print(f"Mask stack saved: {writers[value].path}")
+    return [writers[value].path for value in sorted(writers)]
+
+
+def image_archive(image_path, mask_dir, mask_prefix, encoding=ENCODING):
+    """
+    Saves all labels of an image in one sparse label archive instead of one
+    mask stack per label (rebuild masks with labelarchive.LabelArchive)
+
+    :param image_path: Image file path
+    :param mask_dir: Archive's output directory
+    :param mask_prefix: Archive's filename prefix
+    :param encoding: Voxel encoding ("rle" or "coords")
+    :return: Saved archive path (in a list, as image_split), or ERROR
+    """
+
+    image_stack = load_image_stack(image_path)  # Open image stack (32-bit TIFF
+    # image)
+    if len(image_stack)==INIT_N:
+        print("Image stack load failed")
+        return ERROR
+
+    archive_path = os.path.join(mask_dir, f"{mask_prefix}_labels.npz")
+    values = archive_labels(image_stack, archive_path, encoding)
+    print(f"Label archive saved ({len(values)} labels): {archive_path}")
+    return [archive_path]
+
+
+def file_hash(path):
+    """
+    Hashes the content of a file
+
+    :param path: File path
+    :return: SHA-256 hex digest
+    """
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(manifest_path):
+    """
+    Loads a batch manifest, starting a new one if it is missing or unreadable
+
+    :param manifest_path: Manifest file path
+    :return: Dictionary of relative input path -> entry ("size", "mtime_ns",
+        "hash", "options", "outputs")
+    """
 
-    # Load each frame in image into stack
     try:
-        while True:
-            frame = np.array(image)
-            image_stack.append(frame)
-            image.seek(image.tell()+1)  # Move to next frame
-    except EOFError:
-        pass
+        with open(manifest_path, encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest, manifest_path):
+    """
+    Writes a batch manifest atomically
+
+    :param manifest: Manifest dictionary
+    :param manifest_path: Manifest file path
+    """
 
-    return image_stack
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(temp_path, manifest_path)
 
 
-def threshold_apply(image, threshold):
+def find_images(input_dir, output_dir):
     """
-    Applies threshold to image to create binary mask
+    Lists the TIFF images of a directory tree
 
-    :param image: Image as NumPy array
-    :param threshold: Unique pixel value
-    :return: Mask as NumPy array
+    :param input_dir: Input directory
+    :param output_dir: Output directory (skipped if inside the input)
+    :return: Sorted paths relative to the input directory
     """
 
-    mask = cv2.inRange(image, np.array(threshold), np.array(threshold))
-    return mask
+    output_dir = os.path.abspath(output_dir)
+    images = []
+    for folder, subfolders, files in os.walk(input_dir):
+        subfolders[:] = [sub for sub in subfolders
+                         if os.path.abspath(os.path.join(folder, sub))!=output_dir]
+        images.extend(os.path.relpath(os.path.join(folder, file), input_dir)
+                      for file in files if file.lower().endswith(IMAGE_EXTENSIONS))
+    return sorted(images)
 
 
-def mask_stack_save(mask_stack, mask_stack_path):
+def mask_prefixes(images):
     """
-    Save mask stack at specified path
+    Names the masks of every image after it
 
-    :param mask_stack: Mask stack as list of NumPy arrays
-    :param mask_stack_path: Mask stack file path
+    The prefix is the image name without its extension, unless another image
+    of the same folder has the same name with another extension (a.tif and
+    a.tiff): those keep the extension, so their masks do not overwrite each
+    other.
+
+    :param images: Image paths relative to the input directory
+    :return: Dictionary of image path -> masks' filename prefix
     """
 
-    mask_image_stack = [Image.fromarray(mask) for mask in mask_stack]  # Convert
-    # mask stack from NumPy arrays into images
-    mask_image_stack[INIT_I].save(mask_stack_path, save_all=True,
-                                  append_images=mask_image_stack[INIT_I+1:],
-                                  compression="tiff_deflate")  # Save mask stack
-    # at specified path
+    stems = {}
+    for relative in images:
+        folder, name = os.path.split(relative)
+        stems.setdefault((folder, os.path.splitext(name)[0].lower()), []).append(relative)
+    prefixes = {}
+    for same in stems.values():
+        for relative in same:
+            name = os.path.basename(relative)
+            prefixes[relative] = name if len(same)>1 else os.path.splitext(name)[0]
+    return prefixes
 
 
-def image_split(image_path, mask_dir, mask_prefix):
+def split_task(image_path, mask_dir, mask_prefix, options, threads):
     """
-    Splits image into binary masks based on unique pixel values
+    Splits one image in a batch worker
 
     :param image_path: Image file path
-    :param mask_dir: Masks' output directory
+    :param mask_dir: Masks' output directory (created if missing)
     :param mask_prefix: Masks' filename prefix
+    :param options: Split options ("sparse", "compression", "level",
+        "encoding")
+    :param threads: Number of threads writing the masks
+    :return: Saved file paths and seconds taken
     """
 
-    image_stack = load_image_stack(image_path)  # Load image stack (32-bit TIFF
-    # image)
-    if len(image_stack)==INIT_N:
-        print("Image stack load failed")
-        return ERROR
+    start = time.perf_counter()
+    os.makedirs(mask_dir, exist_ok=True)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # The report replaces the per-mask messages
+        if options["sparse"]:
+            outputs = image_archive(image_path, mask_dir, mask_prefix, options["encoding"])
+        else:
+            outputs = image_split(image_path, mask_dir, mask_prefix, threads,
+                                  options["compression"], options["level"])
+    if outputs==ERROR:
+        raise ValueError("Image stack load failed")
+    return outputs, time.perf_counter() - start
 
-    unique_values = np.unique(image_stack)  # Get unique pixel values in image
-    # stack
 
-    # Create mask using each unique pixel value
-    for value in unique_values:
-        if value==INIT_N:  # If value==0 resulting mask will be inverted image
-            # therefore skip
-            continue
+def batch_split(input_dir, output_dir, options, workers=WORKERS, threads=None, force=False):
+    """
+    Splits every TIFF image of a directory tree on a process pool
 
-        mask_stack = []
-        for image_slice in image_stack: # Apply threshold to each slice in image
-            # stack
-            mask = threshold_apply(image_slice, value)
-            mask_stack.append(mask)
+    Each image's masks go to the same relative folder under the output
+    directory, prefixed with the image name (see mask_prefixes). Changed
+    inputs are hashed by the pool's processes too. The manifest there records each
+    input's content hash and the options it was split with, and unchanged
+    inputs whose outputs still exist are skipped. A JSON line per input is
+    written to the report as it finishes ("status" done, skipped or failed).
 
-        # Save mask stack
-        index = f"{value:02d}"  # Add leading zero for single-digit indices
-        mask_stack_path = os.path.join(mask_dir, f"{mask_prefix}_{index}.tif")
-        mask_stack_save(mask_stack, mask_stack_path)
-        print(f"Mask stack saved: {mask_stack_path}")
+    :param input_dir: Input directory
+    :param output_dir: Output directory
+    :param options: Split options ("sparse", "compression", "level",
+        "encoding")
+    :param workers: Number of processes
+    :param threads: Mask writing threads per process (default: the cores
+        left per process)
+    :param force: Split every input even if unchanged
+    :return: List of report records
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    threads = threads or max(WORKERS // max(workers, 1), 1)
+    records = []
+
+    with open(os.path.join(output_dir, REPORT_NAME), "w", encoding="utf-8") as report:
+        def record(entry):
+            records.append(entry)
+            report.write(json.dumps(entry) + "\n")
+            report.flush()
+
+        # Hash the changed inputs on the pool (reusing the hash of files whose
+        # size and time are unchanged), queueing each one's split as soon as
+        # its hash is known
+        tasks = {}
+        with ProcessPoolExecutor(max(workers, 1)) as pool:
+            def queue(relative, stat, entry, digest):
+                if not force and entry.get("hash")==digest and entry.get("options")==options \
+                        and all(os.path.exists(os.path.join(output_dir, output)) for output in entry["outputs"]):
+                    record({"input": relative, "status": "skipped", "outputs": entry["outputs"]})
+                    return
+                mask_dir = os.path.join(output_dir, os.path.dirname(relative))
+                future = pool.submit(split_task, os.path.join(input_dir, relative), mask_dir,
+                                     prefixes[relative], options, threads)
+                tasks[future] = (relative, {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                            "hash": digest, "options": options})
+
+            images = find_images(input_dir, output_dir)
+            prefixes = mask_prefixes(images)
+            hashes = {}
+            for relative in images:
+                image_path = os.path.join(input_dir, relative)
+                try:
+                    stat = os.stat(image_path)
+                except OSError as error:
+                    record({"input": relative, "status": "failed", "error": str(error)})
+                    continue
+                entry = manifest.get(relative, {})
+                if (entry.get("size"), entry.get("mtime_ns"))==(stat.st_size, stat.st_mtime_ns):
+                    queue(relative, stat, entry, entry["hash"])
+                else:
+                    hashes[pool.submit(file_hash, image_path)] = (relative, stat, entry)
+            for future in as_completed(hashes):
+                relative, stat, entry = hashes[future]
+                try:
+                    digest = future.result()
+                except OSError as error:
+                    record({"input": relative, "status": "failed", "error": str(error)})
+                    continue
+                queue(relative, stat, entry, digest)
+
+            # Record the results as they come
+            for future in as_completed(tasks):
+                relative, entry = tasks[future]
+                try:
+                    outputs, seconds = future.result()
+                except Exception as error:  # Any failure is reported, the
+                    # batch goes on
+                    manifest.pop(relative, None)
+                    record({"input": relative, "status": "failed",
+                            "error": f"{type(error).__name__}: {error}"})
+                else:
+                    entry["outputs"] = [os.path.relpath(output, output_dir) for output in outputs]
+                    manifest[relative] = entry
+                    record({"input": relative, "status": "done", "seconds": round(seconds, 3),
+                            "outputs": entry["outputs"]})
+                save_manifest(manifest, manifest_path)
+    return records
 
 
 def main():
@@ -124,8 +344,39 @@ def main():
         print("Invalid masks' output directory")
         return ERROR
 
-    image_split(image_path, mask_dir, mask_prefix)  # Split image into masks
+    sparse = input("Save one sparse label archive instead of mask stacks? "
+                   "(y/N): ").strip().lower()=="y"
+    if sparse:
+        image_archive(image_path, mask_dir, mask_prefix)  # Archive labels
+    else:
+        image_split(image_path, mask_dir, mask_prefix)  # Split image into masks
 
 
 if __name__=="__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Split MIB models into binary masks. Without arguments, asks for one "
+                                                 "model; with a directory, splits every TIFF below it in parallel")
+    parser.add_argument("input_dir", nargs="?", help="directory tree of the models (batch mode)")
+    parser.add_argument("output_dir", nargs="?", help="directory the masks, manifest and report are written to")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="models split at once (default: all cores)")
+    parser.add_argument("--threads", type=int, help="mask writing threads per model (default: cores / workers)")
+    parser.add_argument("--compression", choices=["none", "packbits", "lzw", "deflate"], default=COMPRESSION,
+                        help=f"mask compression (default {COMPRESSION})")
+    parser.add_argument("--level", type=int, choices=range(1, 10), metavar="1-9", help="deflate level")
+    parser.add_argument("--sparse", action="store_true", help="write one sparse label archive per model instead of mask stacks")
+    parser.add_argument("--encoding", choices=["rle", "coords"], default=ENCODING,
+                        help=f"voxel encoding of the archives (default {ENCODING})")
+    parser.add_argument("--force", action="store_true", help="split every model, even if unchanged since the last run")
+    args = parser.parse_args()
+
+    if args.input_dir is None:
+        main()
+    elif args.output_dir is None:
+        parser.error("the output directory is required with an input directory")
+    else:
+        records = batch_split(args.input_dir, args.output_dir,
+                              {"sparse": args.sparse, "compression": args.compression,
+                               "level": args.level, "encoding": args.encoding},
+                              args.workers, args.threads, args.force)
+        failed = sum(entry["status"]=="failed" for entry in records)
+        if failed:
+            raise SystemExit(f"{failed} of {len(records)} models failed, see {REPORT_NAME}")
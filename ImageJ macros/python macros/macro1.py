@@ -1,10 +1,11 @@
 # Library imports
 from tkinter import Tk
 from tkinter import filedialog
-from PIL import Image
 import numpy as np
-import cv2
 import os
+from labelarchive import ENCODING, archive_labels
+from labelsplit import label_layout, label_mask
+from stackio import COMPRESSION, WORKERS, WriterPool, iter_slabs, open_stack
 
 # Constant definitions
 ERROR = -1  # Error flag
@@ -39,92 +40,94 @@ def mask_dir_select():
 
 def load_image_stack(image_path):
     """
-    Load multi-page TIFF image stack
+    Open multi-page TIFF image stack without loading it
 
     :param image_path: Image file path
-    :return: Image stack as list of NumPy arrays
+    :return: Image stack as a TiffStack (3D array-like, memory-mapped if
+        uncompressed, else decoded page by page), read in Z slabs
     """
 
-    # Open image and initialise empty image stack
-    image = Image.open(image_path)
-    image_stack = []
+    return open_stack(image_path)
 
-    # Load each frame in image into stack
-    try:
-        while True:
-            frame = np.array(image)
-            image_stack.append(frame)
-            image.seek(image.tell()+1)  # Move to next frame
-    except EOFError:
-        pass
 
-    return image_stack
-
-
-def threshold_apply(image, threshold):
-    """
-    Applies threshold to image to create binary mask
-
-    :param image: Image as NumPy array
-    :param threshold: Unique pixel value
-    :return: Mask as NumPy array
-    """
-
-    mask = cv2.inRange(image, np.array(threshold), np.array(threshold))
-    return mask
-
-
-def mask_stack_save(mask_stack, mask_stack_path):
-    """
-    Save mask stack at specified path
-
-    :param mask_stack: Mask stack as list of NumPy arrays
-    :param mask_stack_path: Mask stack file path
-    """
-
-    mask_image_stack = [Image.fromarray(mask) for mask in mask_stack]  # Convert
-    # mask stack from NumPy arrays into images
-    mask_image_stack[INIT_I].save(mask_stack_path, save_all=True,
-                                  append_images=mask_image_stack[INIT_I+1:],
-                                  compression="tiff_deflate")  # Save mask stack
-    # at specified path
-
-
-def image_split(image_path, mask_dir, mask_prefix):
+def image_split(image_path, mask_dir, mask_prefix, workers=WORKERS,
+                compression=COMPRESSION, level=None):
     """
     Splits image into binary masks based on unique pixel values
 
     :param image_path: Image file path
     :param mask_dir: Masks' output directory
     :param mask_prefix: Masks' filename prefix
+    :param workers: Number of threads writing the masks
+    :param compression: Masks' compression ("none", "packbits", "lzw" or
+        "deflate")
+    :param level: Deflate level (1 fastest to 9 smallest), or None
+    :return: Saved mask stack paths, or ERROR
     """
 
-    image_stack = load_image_stack(image_path)  # Load image stack (32-bit TIFF
+    image_stack = load_image_stack(image_path)  # Open image stack (32-bit TIFF
     # image)
     if len(image_stack)==INIT_N:
         print("Image stack load failed")
         return ERROR
 
-    unique_values = np.unique(image_stack)  # Get unique pixel values in image
-    # stack
+    # Split the stack slab by slab, so only one slab is in memory; each mask
+    # stack is written page by page from the slab its label is first met in.
+    # Masks are 1-bit pages, encoded and written by the pool's threads while
+    # the next label's mask is built
+    writers = {}  # Pixel value -> StackWriter of its mask stack
+    blank = np.zeros(image_stack.shape[1:], dtype=bool)  # Slice without the
+    # label
+    with WriterPool(workers, compression, level) as pool:
+        for start, slab in iter_slabs(image_stack):
+            layout = label_layout(slab)  # Group the voxels by pixel value in
+            # one pass (value 0 is skipped, its mask would be the inverted image)
+            present = {value.item(): label for label, value in enumerate(layout["values"])}
+            for value in present:
+                if value not in writers:
+                    index = f"{value:02d}"  # Add leading zero for single-digit
+                    # indices
+                    mask_stack_path = os.path.join(mask_dir, f"{mask_prefix}_{index}.tif")
+                    writers[value] = pool.open(mask_stack_path)
+                    pool.write(writers[value], [blank] * start)  # Slices before
+                    # the label was met
+
+            # Add the slab's slices to every mask stack
+            for value, writer in writers.items():
+                if value in present:
+                    pool.write(writer, label_mask(layout, present[value], bool))
+                else:
+                    pool.write(writer, [blank] * len(slab))
+
+        # Finish mask stacks
+        for value in sorted(writers):
+            pool.close(writers[value])
+            print(f"Mask stack saved: {writers[value].path}")
+    return [writers[value].path for value in sorted(writers)]
+
+
+def image_archive(image_path, mask_dir, mask_prefix, encoding=ENCODING):
+    """
+    Saves all labels of an image in one sparse label archive instead of one
+    mask stack per label (rebuild masks with labelarchive.LabelArchive)
 
-    # Create mask using each unique pixel value
-    for value in unique_values:
-        if value==INIT_N:  # If value==0 resulting mask will be inverted image
-            # therefore skip
-            continue
+    :param image_path: Image file path
+    :param mask_dir: Archive's output directory
+    :param mask_prefix: Archive's filename prefix
+    :param encoding: Voxel encoding ("rle" or "coords")
+    :return: Saved archive path (in a list, as image_split), or ERROR
+    """
 
-        mask_stack = []
-        for image_slice in image_stack: # Apply threshold to each slice in image
-            # stack
-            mask = threshold_apply(image_slice, value)
-            mask_stack.append(mask)
+    image_stack = load_image_stack(image_path)  # Open image stack (32-bit TIFF
+    # image)
+    if len(image_stack)==INIT_N:
+        print("Image stack load failed")
+        return ERROR
 
-        # Save mask stack
-        index = f"{value:02d}"  # Add leading zero for single-digit indices
-        mask_stack_path = os.path.join(mask_dir, f"{mask_prefix}_{index}.tif")
-        mask_stack_save(mask_stack, mask_stack_path)
-        print(f"Mask stack saved: {mask_stack_path}")
+    archive_path = os.path.join(mask_dir, f"{mask_prefix}_labels.npz")
+    values = archive_labels(image_stack, archive_path, encoding)
+    print(f"Label archive saved ({len(values)} labels): {archive_path}")
+    return [archive_path]
 
 
 def main():
@@ -149,7 +152,12 @@ def main():
         print("Invalid masks' output directory")
         return ERROR
 
-    image_split(image_path, mask_dir, mask_prefix)  # Split image into masks
+    sparse = input("Save one sparse label archive instead of mask stacks? "
+                   "(y/N): ").strip().lower()=="y"
+    if sparse:
+        image_archive(image_path, mask_dir, mask_prefix)  # Archive labels
+    else:
+        image_split(image_path, mask_dir, mask_prefix)  # Split image into masks
 
 
 if __name__ == "__main__":
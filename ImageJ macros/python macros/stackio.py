@@ -0,0 +1,387 @@
+"""Out-of-core access to multi-page TIFF stacks
+
+A stack is opened as a TiffStack, a read-only 3D array-like (Z, Y, X) that
+never holds the whole volume. Stacks whose pages are stored uncompressed, one
+sample per pixel, in contiguous strips are memory-mapped: slices are views of
+the file and the operating system pages them in and out. Any other stack
+(compressed, tiled, bit-packed) is decoded lazily, one page at a time, by
+PIL, and the most recently used pages are kept in a bounded cache. Either way
+callers read the stack in Z slabs (iter_slabs) and memory stays proportional
+to a slab, so volumes larger than the memory can be processed.
+
+Stacks are written page by page (StackWriter) with a selectable compression;
+binary masks go in as boolean pages and are stored as 1-bit, bit-packed
+pages. A WriterPool encodes and writes pages in worker threads (PIL releases
+the GIL while compressing), while the caller goes on computing the next ones.
+"""
+
+# Library imports
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+from PIL import Image, TiffImagePlugin
+import numpy as np
+
+# Constant definitions
+NO_COMPRESSION = 1  # TIFF Compression tag value of uncompressed pages
+SAMPLE_KINDS = {1: "u", 2: "i", 3: "f"}  # TIFF SampleFormat -> NumPy kind
+BYTE_ORDERS = {b"II": "<", b"MM": ">"}  # TIFF header -> NumPy byte order
+CACHE_BYTES = 256 * 1024 * 1024  # Decoded pages kept by a lazy stack
+SLAB_BYTES = 16 * 1024 * 1024  # Default size of a slab read by iter_slabs
+COMPRESSIONS = {"none": "raw", "packbits": "packbits", "lzw": "tiff_lzw",
+                "deflate": "tiff_deflate"}  # Compression name -> PIL name
+COMPRESSION = "deflate"  # Default compression of the written stacks
+ZIP_QUALITY = 65557  # libtiff pseudo-tag of the deflate level (1-9)
+WORKERS = os.cpu_count() or 1  # Default number of writing threads
+
+
+def tag_tuple(tags, tag, default=None):
+    """
+    Reads a TIFF tag as a tuple
+
+    :param tags: PIL tag dictionary of a page (tag_v2)
+    :param tag: Tag number
+    :param default: Value of a missing tag
+    :return: Tuple of the tag values, or None if missing without default
+    """
+
+    value = tags.get(tag, default)
+    if value is None:
+        return None
+    return tuple(value) if isinstance(value, (tuple, list)) else (value,)
+
+
+def page_layout(tags, byte_order):
+    """
+    Finds where the pixels of an uncompressed page are in the file
+
+    :param tags: PIL tag dictionary of the page (tag_v2)
+    :param byte_order: NumPy byte order of the file ("<" or ">")
+    :return: File offset of the first pixel and the pixel dtype, or None if
+        the page cannot be memory-mapped
+    """
+
+    if tags.get(259, NO_COMPRESSION)!=NO_COMPRESSION or tags.get(277, 1)!=1 \
+            or 322 in tags:  # Compressed, several samples per pixel or tiled
+        return None
+    bits = tag_tuple(tags, 258, 1)[0]
+    kind = SAMPLE_KINDS.get(tag_tuple(tags, 339, 1)[0])
+    offsets = tag_tuple(tags, 273)
+    counts = tag_tuple(tags, 279)
+    if kind is None or bits not in (8, 16, 32, 64) or not offsets or not counts:
+        return None
+    dtype = np.dtype(f"{byte_order}{kind}{bits // 8}")
+    if any(offsets[i] + counts[i]!=offsets[i+1] for i in range(len(offsets) - 1)):
+        return None  # Strips are scattered over the file
+    if sum(counts)<tags[256] * tags[257] * dtype.itemsize:
+        return None
+    return offsets[0], dtype
+
+
+class TiffStack:
+    """Read-only 3D array-like view of a multi-page TIFF stack"""
+
+    def __init__(self, path, cache_bytes=CACHE_BYTES):
+        """
+        Opens a stack, memory-mapped if its pages allow it
+
+        :param path: TIFF file path
+        :param cache_bytes: Most bytes of decoded pages a lazy stack keeps
+        """
+
+        self.path = path
+        self.image = Image.open(path)
+        if self.image.format!="TIFF":
+            self.image.close()
+            raise ValueError(f"{path} is not a TIFF file")
+        with open(path, "rb") as file:
+            byte_order = BYTE_ORDERS.get(file.read(2))
+
+        # Walk the pages once for their size and pixel layout
+        size, mode, layouts = None, None, []
+        for index in range(getattr(self.image, "n_frames", 1)):
+            self.image.seek(index)
+            if size is None:
+                size, mode = self.image.size, self.image.mode
+            elif (self.image.size, self.image.mode)!=(size, mode):
+                self.image.close()
+                raise ValueError(f"{path}: page {index} differs in size or type from the first page")
+            layouts.append(page_layout(self.image.tag_v2, byte_order) if byte_order else None)
+        self.shape = (len(layouts), size[1], size[0])
+
+        self.pages = None  # Memory-mapped views of the pages, if possible
+        self.volume = None  # Strided view of the stack, if evenly spaced
+        if all(layouts) and len({dtype for _, dtype in layouts})==1:
+            self.dtype = layouts[0][1]
+            buffer = np.memmap(path, dtype=np.uint8, mode="r")
+            page_shape = self.shape[1:]
+            self.pages = [np.ndarray(page_shape, self.dtype, buffer, offset)
+                          for offset, _ in layouts]
+            steps = {layouts[i+1][0] - layouts[i][0] for i in range(len(layouts) - 1)}
+            if len(steps)<=1:
+                step = steps.pop() if steps else 0
+                item = self.dtype.itemsize
+                self.volume = np.ndarray(self.shape, self.dtype, buffer, layouts[0][0],
+                                         (step, page_shape[1] * item, item))
+            self.image.close()
+            self.image = None
+        else:
+            self.image.seek(0)
+            self.dtype = np.array(self.image).dtype
+            page_bytes = max(self.shape[1] * self.shape[2] * self.dtype.itemsize, 1)
+            self.cache = OrderedDict()
+            self.cache_pages = max(cache_bytes // page_bytes, 1)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def mapped(self):
+        """True if the stack is memory-mapped rather than decoded"""
+        return self.pages is not None
+
+    def __len__(self):
+        return self.shape[0]
+
+    def page(self, index):
+        """
+        Reads one page
+
+        :param index: Page (Z) index
+        :return: Page as a 2D array (Y, X); read-only for a mapped stack
+        """
+
+        if self.pages is not None:
+            return self.pages[index]
+        index = range(len(self))[index]
+        if index in self.cache:
+            self.cache.move_to_end(index)
+            return self.cache[index]
+        self.image.seek(index)
+        page = np.array(self.image)
+        page.flags.writeable = False  # Cached pages are shared
+        self.cache[index] = page
+        if len(self.cache)>self.cache_pages:
+            self.cache.popitem(last=False)
+        return page
+
+    def __getitem__(self, key):
+        """
+        Indexes the stack like a NumPy array (Z first)
+
+        :param key: Index, slice or tuple of them
+        :return: Page, slab or part of them; a view for a mapped stack when
+            possible, else a new array
+        """
+
+        key = key if isinstance(key, tuple) else (key,)
+        if self.volume is not None:
+            return self.volume[key]
+        z, rest = key[0], key[1:]
+        if not isinstance(z, slice):
+            return self.page(z)[rest]
+        indices = range(len(self))[z]
+        first = self.page(indices[0])[rest] if len(indices) else \
+            np.empty(self.shape[1:], self.dtype)[rest]
+        slab = np.empty((len(indices),) + first.shape, self.dtype)
+        for position, index in enumerate(indices):
+            slab[position] = first if position==0 else self.page(index)[rest]
+        return slab
+
+    def slab(self, start, stop):
+        """
+        Reads the pages start to stop - 1
+
+        :param start: First page index
+        :param stop: Page index after the last one
+        :return: Slab as a 3D array (Z, Y, X)
+        """
+
+        return self[start:stop]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:], dtype=dtype)
+
+    def close(self):
+        """Closes the file of a lazy stack (mapped views stay valid)"""
+
+        if self.image is not None:
+            self.image.close()
+            self.image = None
+            self.cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_stack(path, cache_bytes=CACHE_BYTES):
+    """
+    Opens a multi-page TIFF stack without loading it
+
+    :param path: TIFF file path
+    :param cache_bytes: Most bytes of decoded pages a lazy stack keeps
+    :return: TiffStack
+    """
+
+    return TiffStack(path, cache_bytes)
+
+
+def slab_depth(stack, slab_bytes=SLAB_BYTES):
+    """
+    Number of pages that fit in a slab
+
+    :param stack: 3D array-like (Z, Y, X)
+    :param slab_bytes: Bytes per slab
+    :return: Pages per slab (at least 1)
+    """
+
+    page_bytes = stack.shape[1] * stack.shape[2] * np.dtype(stack.dtype).itemsize
+    return max(slab_bytes // max(page_bytes, 1), 1)
+
+
+def iter_slabs(stack, depth=None):
+    """
+    Reads a stack in consecutive Z slabs
+
+    :param stack: 3D array-like (Z, Y, X)
+    :param depth: Pages per slab (default: SLAB_BYTES worth)
+    :return: Generator of (first page index, slab as a 3D array)
+    """
+
+    depth = depth or slab_depth(stack)
+    for start in range(0, len(stack), depth):
+        yield start, stack[start:start + depth]
+
+
+class StackWriter:
+    """Writes a multi-page TIFF stack one page at a time"""
+
+    def __init__(self, path, compression=COMPRESSION, level=None):
+        """
+        Creates the file
+
+        :param path: TIFF file path
+        :param compression: "none", "packbits", "lzw" or "deflate"
+        :param level: Deflate level (1 fastest to 9 smallest), or None for
+            libtiff's default
+        """
+
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression {compression}, use one of {', '.join(COMPRESSIONS)}")
+        if level is not None and (compression!="deflate" or not 1<=level<=9):
+            raise ValueError("A compression level needs deflate compression and 1 to 9")
+        self.path = path
+        self.options = {"compression": COMPRESSIONS[compression]}
+        if level is not None:
+            self.options["tiffinfo"] = {ZIP_QUALITY: level}
+        self.file = TiffImagePlugin.AppendingTiffWriter(path, True)
+        self.file.__enter__()
+
+    def write(self, pages):
+        """
+        Appends pages
+
+        :param pages: 2D array (one page) or 3D array / list of pages;
+            boolean pages are saved as 1-bit pages
+        """
+
+        pages = [pages] if np.ndim(pages)==2 else pages
+        for page in pages:
+            Image.fromarray(np.ascontiguousarray(page)).save(
+                self.file, format="TIFF", **self.options)
+            self.file.newFrame()
+
+    def close(self):
+        """Finishes the file"""
+
+        if self.file is not None:
+            self.file.__exit__(None, None, None)
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class WriterPool:
+    """Writes several stacks at once in worker threads"""
+
+    def __init__(self, workers=WORKERS, compression=COMPRESSION, level=None):
+        """
+        Starts the threads
+
+        :param workers: Number of writing threads
+        :param compression: Compression of the stacks (see StackWriter)
+        :param level: Deflate level, or None
+        """
+
+        self.workers = max(workers or 1, 1)
+        self.compression = compression
+        self.level = level
+        self.executor = ThreadPoolExecutor(self.workers)
+        self.pending = deque()  # Submitted writes, oldest first
+        self.last = {}  # Writer -> its latest submitted write
+
+    def open(self, path):
+        """
+        Creates a stack
+
+        :param path: TIFF file path
+        :return: StackWriter to pass to write
+        """
+
+        return StackWriter(path, self.compression, self.level)
+
+    def write(self, writer, pages):
+        """
+        Queues pages for a stack
+
+        The pages of one stack are written in the order they are queued. The
+        call blocks while the stack's previous pages or more than twice as many
+        writes as threads are still pending, which bounds the memory held by
+        the queue.
+
+        :param writer: StackWriter from open
+        :param pages: Pages (see StackWriter.write), not changed afterwards
+        """
+
+        if writer in self.last:
+            self.last[writer].result()  # Keep the stack's pages in order
+        while len(self.pending)>=2 * self.workers:
+            self.pending.popleft().result()
+        future = self.executor.submit(writer.write, pages)
+        self.pending.append(future)
+        self.last[writer] = future
+
+    def close(self, writer):
+        """
+        Finishes a stack once its queued pages are written
+
+        :param writer: StackWriter from open
+        """
+
+        future = self.last.pop(writer, None)
+        if future is not None:
+            future.result()
+        writer.close()
+
+    def shutdown(self):
+        """Waits for every queued write and stops the threads"""
+
+        try:
+            while self.pending:
+                self.pending.popleft().result()
+        finally:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()